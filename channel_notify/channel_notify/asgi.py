@@ -11,7 +11,6 @@ import os
 import logging
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 
 # 配置日志
@@ -25,17 +24,19 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'channel_notify.settings')
 
 # Import will be available after we create the routing module
 from channel_notify.notifications.routing import websocket_urlpatterns
+from channel_notify.notifications.handshake import HandshakeAuthMiddlewareStack
+from channel_notify.notifications.invalidation import InvalidationListenerMiddleware
 
-# 创建ASGI应用
-application = ProtocolTypeRouter({
+# 创建ASGI应用；InvalidationListenerMiddleware 在本进程中接收其他进程广播的缓存失效消息
+application = InvalidationListenerMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
+        HandshakeAuthMiddlewareStack(
             URLRouter(
                 websocket_urlpatterns
             )
         )
     ),
-})
+}))
 
 logger.info("ASGI应用初始化完成")
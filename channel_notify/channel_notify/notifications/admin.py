@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import GroupRoute
+
+
+@admin.register(GroupRoute)
+class GroupRouteAdmin(admin.ModelAdmin):
+    list_display = ('sender_group', 'receiver_group', 'bidirectional')
+    list_filter = ('bidirectional',)
+    list_select_related = ('sender_group', 'receiver_group')
+    search_fields = ('sender_group__name', 'receiver_group__name')
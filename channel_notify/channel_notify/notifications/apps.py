@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class NotificationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'channel_notify.notifications'
+
+    def ready(self):
+        # 注册信号处理器
+        from . import signals  # noqa: F401
+        from . import dbtuning  # noqa: F401
@@ -0,0 +1,99 @@
+"""已确认通知的归档
+
+创建时间早于 settings.NOTIFY_ARCHIVE['AFTER_DAYS'] 天的已确认通知按主键顺序分块移入归档表：
+每块在一个短事务中 INSERT 到归档表并从通知表删除，通知表不会被长时间锁定。
+归档可通过 manage.py archive_notifications 执行，也可设置 INTERVAL_SECONDS 由消费者进程内的 asyncio 任务定期执行。
+
+历史API在通知表的结果不足以确定一页时才查询归档表：归档表中最新的创建时间（水位）早于本页最后一行，
+或 since 晚于水位时，归档表不可能有落在本页范围内的行。
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .db import database_sync_to_pool
+from .models import ArchivedNotification, Notification
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = (
+    'id', 'content', 'sender_id', 'sender_group_id', 'receiver_group_id',
+    'status', 'confirmed_by_id', 'created_at', 'confirmed_at',
+)
+
+
+def archive_config():
+    config = {'AFTER_DAYS': 90, 'BATCH_SIZE': 1000, 'INTERVAL_SECONDS': 0}
+    config.update(getattr(settings, 'NOTIFY_ARCHIVE', {}))
+    return config
+
+
+def archive_notifications(older_than=None, batch_size=None):
+    """把创建时间早于 now - older_than 的已确认通知分块移入归档表，返回移动的行数"""
+    config = archive_config()
+    if older_than is None:
+        older_than = timedelta(days=config['AFTER_DAYS'])
+    batch_size = batch_size or config['BATCH_SIZE']
+    cutoff = timezone.now() - older_than
+    moved, last_id = 0, 0
+    while True:
+        with transaction.atomic():
+            # 按主键范围推进，跳过的待确认旧通知不会被反复扫描
+            rows = list(
+                Notification.objects.filter(status='confirmed', created_at__lt=cutoff, id__gt=last_id)
+                .order_by('id')
+                .values(*ARCHIVE_FIELDS)[:batch_size]
+            )
+            if not rows:
+                return moved
+            ArchivedNotification.objects.bulk_create(
+                [ArchivedNotification(**row) for row in rows], ignore_conflicts=True
+            )
+            Notification.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        moved += len(rows)
+        last_id = rows[-1]['id']
+
+
+def archive_watermark(using=None):
+    """归档表中最新的创建时间，归档为空时返回 None（走 archive_created_idx，只读一个索引项）"""
+    return ArchivedNotification.objects.using(using).aggregate(latest=Max('created_at'))['latest']
+
+
+def needs_archive(rows, limit, watermark, since=None):
+    """通知表取到的一页（最多 limit+1 行，按创建时间倒序）是否可能还需要归档表中的行"""
+    if watermark is None:
+        return False
+    if since is not None and since > watermark:
+        return False
+    return len(rows) <= limit or rows[-1]['created_at'] <= watermark
+
+
+_archiver = None
+
+
+def ensure_archiver():
+    """配置了 INTERVAL_SECONDS 时，在当前事件循环中启动定期归档任务（每个进程一个）"""
+    global _archiver
+    interval = archive_config()['INTERVAL_SECONDS']
+    if not interval:
+        return
+    loop = asyncio.get_running_loop()
+    if _archiver is None or _archiver.done() or _archiver.get_loop() is not loop:
+        _archiver = loop.create_task(archive_periodically(interval))
+
+
+async def archive_periodically(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            moved = await database_sync_to_pool(archive_notifications)()
+        except Exception:
+            logger.exception('archive_failed')
+        else:
+            if moved:
+                logger.info('notifications_archived', extra={'fields': {'rows': moved}})
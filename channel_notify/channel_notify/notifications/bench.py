@@ -0,0 +1,204 @@
+"""基准测试辅助工具，供 bench_* 管理命令复用"""
+import contextlib
+import os
+import tempfile
+import time
+from importlib import import_module
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.db import connections
+
+from .models import GroupRoute
+from django.db.backends.utils import CursorWrapper
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment, setup_databases, teardown_databases,
+)
+
+
+@contextlib.contextmanager
+def bench_database(verbosity=0, on_disk=False):
+    """在临时测试数据库中运行基准测试，避免污染开发数据库
+
+    on_disk=True 时 SQLite 测试库建在临时文件中：共享缓存的内存库在多线程并发写入时会直接报表锁定，
+    多线程数据库访问的基准需要使用文件库。基准期间关闭发送限流与心跳（基准中的模拟客户端不回复 ping），
+    测量的是处理路径本身的吞吐量。
+    """
+    from . import consumers
+    from .heartbeat import HeartbeatWheel
+    from .ratelimit import RateLimiter
+    test_settings = connections['default'].settings_dict.setdefault('TEST', {})
+    old_name = test_settings.get('NAME')
+    tmpdir = None
+    if on_disk and connections['default'].vendor == 'sqlite':
+        tmpdir = tempfile.TemporaryDirectory()
+        test_settings['NAME'] = os.path.join(tmpdir.name, 'bench.sqlite3')
+    setup_test_environment()
+    old_config = setup_databases(verbosity=verbosity, interactive=False)
+    rate_limiter, consumers.rate_limiter = consumers.rate_limiter, RateLimiter()
+    heartbeat, consumers.heartbeat = consumers.heartbeat, HeartbeatWheel(interval=0, misses=0)
+    try:
+        yield
+    finally:
+        consumers.rate_limiter = rate_limiter
+        consumers.heartbeat = heartbeat
+        teardown_databases(old_config, verbosity=verbosity)
+        teardown_test_environment()
+        if tmpdir is not None:
+            test_settings['NAME'] = old_name
+            tmpdir.cleanup()
+
+
+def seed_pairs(pairs=1, users_per_group=1, password='password123'):
+    """创建 operations_group_N / finance_group_N 组、双向路由及其用户，返回 [(运营用户列表, 财务用户列表, 运营组, 财务组)]"""
+    seeded = []
+    for n in range(1, pairs + 1):
+        ops_group = Group.objects.get_or_create(name=f'operations_group_{n}')[0]
+        fin_group = Group.objects.get_or_create(name=f'finance_group_{n}')[0]
+        GroupRoute.objects.get_or_create(sender_group=ops_group, receiver_group=fin_group)
+        ops_users, fin_users = [], []
+        for i in range(users_per_group):
+            op = User.objects.create_user(username=f'bench_op{n}_{i}', password=password)
+            op.groups.add(ops_group)
+            fin = User.objects.create_user(username=f'bench_fin{n}_{i}', password=password)
+            fin.groups.add(fin_group)
+            ops_users.append(op)
+            fin_users.append(fin)
+        seeded.append((ops_users, fin_users, ops_group, fin_group))
+    return seeded
+
+
+def seed_clients(pairs, senders_per_group, receivers_per_group):
+    """批量创建大量压测用户（不可用密码，跳过耗时的密码哈希），返回 [(运营用户列表, 财务用户列表, 运营组, 财务组)]"""
+    seeded = []
+    password = make_password(None)
+    for n in range(1, pairs + 1):
+        ops_group = Group.objects.get_or_create(name=f'operations_group_{n}')[0]
+        fin_group = Group.objects.get_or_create(name=f'finance_group_{n}')[0]
+        GroupRoute.objects.get_or_create(sender_group=ops_group, receiver_group=fin_group)
+        ops_users = User.objects.bulk_create([
+            User(username=f'load_op{n}_{i}', password=password) for i in range(senders_per_group)
+        ])
+        fin_users = User.objects.bulk_create([
+            User(username=f'load_fin{n}_{i}', password=password) for i in range(receivers_per_group)
+        ])
+        Membership = User.groups.through
+        Membership.objects.bulk_create(
+            [Membership(user_id=user.id, group_id=ops_group.id) for user in ops_users]
+            + [Membership(user_id=user.id, group_id=fin_group.id) for user in fin_users]
+        )
+        seeded.append((ops_users, fin_users, ops_group, fin_group))
+    return seeded
+
+
+def login_cookie(user):
+    """为用户创建已登录的会话，返回可放入 WebSocket 握手请求的 Cookie 头"""
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    # save() 而非 create()：signed_cookies 引擎只在 save() 时生成会话键
+    session.save()
+    return (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode())
+
+
+class HopCounter:
+    """统计 sync_to_async 线程池跳转次数（包括 database_sync_to_async）
+
+    hops 为全部跳转次数；app_hops 排除 channels 每帧调用的 close_old_connections，只统计业务代码的跳转。
+    """
+
+    FRAMEWORK_FUNCS = frozenset(['close_old_connections', 'no_op'])
+
+    def __init__(self):
+        self.hops = 0
+        self.app_hops = 0
+        self._original = None
+
+    def __enter__(self):
+        self._original = original = SyncToAsync.__call__
+        counter = self
+
+        async def counting_call(instance, *args, **kwargs):
+            counter.hops += 1
+            if getattr(instance.func, '__name__', None) not in counter.FRAMEWORK_FUNCS:
+                counter.app_hops += 1
+            return await original(instance, *args, **kwargs)
+
+        SyncToAsync.__call__ = counting_call
+        return self
+
+    def __exit__(self, *exc_info):
+        SyncToAsync.__call__ = self._original
+
+
+class QueryCounter:
+    """统计所有线程、所有连接上执行的 SQL 语句数（CaptureQueriesContext 只能在同步上下文中使用）"""
+
+    def __init__(self):
+        self.queries = 0
+        self._original = None
+
+    def __enter__(self):
+        self._original = original = CursorWrapper._execute_with_wrappers
+        counter = self
+
+        def counting_execute(instance, *args, **kwargs):
+            counter.queries += 1
+            return original(instance, *args, **kwargs)
+
+        CursorWrapper._execute_with_wrappers = counting_execute
+        return self
+
+    def __exit__(self, *exc_info):
+        CursorWrapper._execute_with_wrappers = self._original
+
+
+class SimulatedLatency:
+    """在每条 SQL 执行前休眠固定时间，模拟网络数据库的往返延迟（休眠期间释放 GIL，与真实网络等待一致）"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._original = None
+
+    def __enter__(self):
+        if not self.seconds:
+            return self
+        self._original = original = CursorWrapper._execute_with_wrappers
+        seconds = self.seconds
+
+        def delayed_execute(instance, *args, **kwargs):
+            time.sleep(seconds)
+            return original(instance, *args, **kwargs)
+
+        CursorWrapper._execute_with_wrappers = delayed_execute
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._original is not None:
+            CursorWrapper._execute_with_wrappers = self._original
+
+
+@contextlib.contextmanager
+def measure():
+    """同时统计耗时、SQL 查询数与线程池跳转次数"""
+    result = {}
+    with HopCounter() as hops, QueryCounter() as queries:
+        start = time.perf_counter()
+        yield result
+        result['elapsed'] = time.perf_counter() - start
+    result['queries'] = queries.queries
+    result['hops'] = hops.hops
+    result['app_hops'] = hops.app_hops
+
+
+def percentile(samples, pct):
+    """返回样本的百分位数（最近秩法）"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
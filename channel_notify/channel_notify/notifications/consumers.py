@@ -1,62 +1,282 @@
+import functools
 import json
+import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth.models import User, Group
+from channels.consumer import get_handler_name
+from django.contrib.auth.models import Group
+from django.db import transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import Notification
+from .router import group_router
+from .metrics import metrics, timed
+from .jsoncodec import dumps, loads
+from .db import database_sync_to_pool
+from .writebehind import write_behind
+from .archive import ensure_archiver
+from .ratelimit import Throttled, rate_limiter
+from .outbound import OutboundQueue
+from .paging import per_group_pages
+from .heartbeat import HEARTBEAT_CLOSE_CODE, heartbeat
+from .fanout import local_fanout
+from .counters import (
+    GROUP, USER, apply_deltas, counter_cache, counters_frame, group_counter_channel, pending_deltas,
+    publish_counters, user_counter_channel,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# 批量发送/确认时单帧允许的最大条数
+MAX_BATCH_SIZE = 500
+
+# 断线重连时单次补发的最大条数（通知与确认分别计算），超出时客户端应回退到历史接口
+REPLAY_LIMIT = 200
+
+
+class NotificationError(Exception):
+    """通知处理中可直接返回给客户端的业务错误"""
+
+
+def user_channel_group(user_id):
+    """用户专属的频道层组名，用于推送组成员变更等控制消息"""
+    return f'notify.user.{user_id}'
+
+
+class ConnectionState:
+    """连接建立时解析的用户组信息，连接期间缓存以避免每帧查询数据库；创建后只读"""
+    __slots__ = ('group_ids', 'group_names', 'group_ids_by_name', 'sender_group_id', 'sender_group_name')
+    
+    def __init__(self, groups):
+        # groups: 按主键排序的 (id, name) 列表，第一个组作为发送组
+        self.group_ids = frozenset(group_id for group_id, _ in groups)
+        self.group_names = frozenset(name for _, name in groups)
+        self.group_ids_by_name = {name: group_id for group_id, name in groups}
+        self.sender_group_id, self.sender_group_name = groups[0] if groups else (None, None)
+    
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def for_groups(cls, groups):
+        """按 (id, name) 元组共享实例：属于相同组的大量连接只占用一份状态"""
+        return cls(groups)
+
+
+class ConnectionUser:
+    """连接期间使用的用户信息：只保留ID与用户名，不持有 User 模型实例"""
+    __slots__ = ('id', 'username')
+    is_authenticated = True
+    
+    def __init__(self, user_id, username):
+        self.id = user_id
+        self.username = username
+    
+    @property
+    def pk(self):
+        return self.id
+    
+    @classmethod
+    def from_user(cls, user):
+        """由 User 构造；匿名用户原样返回"""
+        if isinstance(user, cls) or not user.is_authenticated:
+            return user
+        return cls(user.id, user.username)
+
 
 class NotificationConsumer(AsyncWebsocketConsumer):
-    """WebSocket消费者，处理通知的发送和接收"""
+    """WebSocket消费者，处理通知的发送和接收
+    
+    ws/notifications/<组名>/ 的连接只订阅该组；ws/notifications/ 为多路复用连接，一个连接订阅用户有权访问的
+    全部组（或 groups 查询参数指定的组），连接期间可通过 subscribe / unsubscribe 帧增减订阅。
+    self.subscriptions 为当前订阅的 {组名: 组ID}。
+    
+    每个节点要承载数万个空闲连接：用户只保留 ConnectionUser，组信息使用按组共享的 ConnectionState，
+    发送队列空闲时不分配缓冲区。
+    """
     
+    async def dispatch(self, message):
+        """分发频道层与 WebSocket 消息
+        
+        channels 在每个处理器之前都会经 thread_sensitive 线程调用一次 close_old_connections，
+        进程内所有连接的每一帧都要排队经过这个线程。本消费者的数据库访问全部通过 database_sync_to_pool，
+        每次调用前后已在执行线程上清理连接，因此这里省去这次跳转。
+        """
+        handler = getattr(self, get_handler_name(message), None)
+        if handler is None:
+            raise ValueError(f'No handler for message type {message["type"]}')
+        await handler(message)
+    
+    @timed('connect')
     async def connect(self):
-        self.group_name = self.scope['url_route']['kwargs']['group_name']
-        self.user = self.scope['user']
+        # 多路复用连接的 group_name 为 None
+        self.group_name = self.scope['url_route']['kwargs'].get('group_name')
+        self.user = ConnectionUser.from_user(self.scope['user'])
+        self.state = None
+        self.accepted = False
+        self.subscriptions = {}
+        self.outbound = OutboundQueue.from_settings(self.send_frame, self.close)
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.subscribes_counters = query.get('counters') == ['1']
+        # 未指定 groups 的多路复用连接跟随用户的组成员关系：加入新组时自动订阅
+        self.follows_membership = self.group_name is None and 'groups' not in query
         
-        # 添加详细调试日志
-        print(f"WebSocket连接尝试: group_name={self.group_name}, user={self.user}, is_authenticated={self.user.is_authenticated}")
+        logger.debug('websocket_connect', extra={'fields': {
+            'group': self.group_name, 'user_id': self.user.id, 'authenticated': self.user.is_authenticated
+        }})
         
         # 验证用户是否已认证
         if not self.user.is_authenticated:
-            print(f"WebSocket连接拒绝: 用户未认证")
+            logger.info('websocket_rejected', extra={'fields': {'group': self.group_name, 'reason': 'unauthenticated'}})
             await self.close(code=401)  # 未授权
             return
         
-        # 验证用户是否属于该组
-        user_in_group = await self.user_in_group(self.user, self.group_name)
-        print(f"用户组验证: user_in_group={user_in_group}")
-        
-        if not user_in_group:
-            print(f"WebSocket连接拒绝: 用户不属于组 {self.group_name}")
+        # 一次性解析用户所属的组及路由目标，连接期间复用；握手认证中间件已解析出组时不再查询
+        groups = self.scope.get('notify_groups')
+        if groups is not None:
+            self.state = ConnectionState.for_groups(tuple(groups))
+        else:
+            self.state = await self.load_connection_state(self.user)
+        if self.group_name is not None:
+            group_names = [self.group_name]
+        elif 'groups' in query:
+            group_names = list(dict.fromkeys(name for name in query['groups'][0].split(',') if name))
+        else:
+            group_names = list(self.state.group_ids_by_name)
+        if not group_names:
+            # 没有可订阅的组（groups 为空或用户不属于任何组），连接不会收到任何通知
+            logger.info('websocket_rejected', extra={'fields': {'group': None, 'user_id': self.user.id, 'reason': 'no_groups'}})
             await self.close(code=403)  # 禁止访问
             return
+        denied = [name for name in group_names if name not in self.state.group_names]
+        if denied:
+            logger.info('websocket_rejected', extra={'fields': {
+                'group': ','.join(denied), 'user_id': self.user.id, 'reason': 'not_in_group'
+            }})
+            await self.close(code=403)  # 禁止访问
+            return
+        
+        if write_behind.enabled:
+            # 首个连接触发写后日志的加载，重放上次崩溃时尚未写入数据库的通知
+            await write_behind.start()
+        # 配置了定期归档时在本进程启动归档任务
+        ensure_archiver()
         
-        # 将用户添加到对应的WebSocket组
+        # 将用户添加到订阅的WebSocket组，并订阅该用户的组成员变更消息
+        for group_name in group_names:
+            await self.join(group_name)
         await self.channel_layer.group_add(
-            self.group_name,
+            user_channel_group(self.user.id),
             self.channel_name
         )
+        if self.subscribes_counters:
+            # 订阅用户发送的待确认计数（各组的计数随组订阅）
+            await self.channel_layer.group_add(
+                user_counter_channel(self.user.id),
+                self.channel_name
+            )
         
-        print(f"WebSocket连接成功: 用户 {self.user} 加入组 {self.group_name}")
         await self.accept()
+        self.accepted = True
+        for group_name in self.subscriptions:
+            metrics.connection_opened(group_name)
+        heartbeat.register(self)
+        logger.debug('websocket_accepted', extra={'fields': {'group': ','.join(self.subscriptions), 'user_id': self.user.id}})
         
         # 发送连接成功消息
-        await self.send(text_data=json.dumps({
-            'type': 'connection_established',
-            'message': f'成功连接到{self.group_name}组的通知频道'
-        }))
+        if self.group_name is not None:
+            await self.send(text_data=dumps({
+                'type': 'connection_established',
+                'message': f'成功连接到{self.group_name}组的通知频道'
+            }))
+        else:
+            await self.send(text_data=dumps({
+                'type': 'connection_established',
+                'message': f'成功连接到通知频道，已订阅: {"、".join(self.subscriptions)}',
+                'subscriptions': list(self.subscriptions)
+            }))
+        
+        if self.subscribes_counters:
+            await self.send(text_data=dumps(await self.load_counters(self.subscriptions)))
+        
+        # 重连时通过查询参数携带断线前的位置，补发断线期间错过的消息
+        if 'last_seen_id' in query or 'last_confirmed_at' in query:
+            await self.replay({
+                'last_seen_id': query.get('last_seen_id', [None])[0],
+                'last_confirmed_at': query.get('last_confirmed_at', [None])[0],
+            })
     
     async def disconnect(self, close_code):
+        if getattr(self, 'accepted', False):
+            # 心跳回收时已执行过一次，服务端随后送达的 websocket.disconnect 不再重复计数
+            self.accepted = False
+            for group_name in self.subscriptions:
+                metrics.connection_closed(group_name)
+            self.outbound.discard()
+            heartbeat.unregister(self)
         # 从组中移除用户
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        for group_name in list(getattr(self, 'subscriptions', ())):
+            await self.leave(group_name)
+        if self.state is not None:
+            await self.channel_layer.group_discard(
+                user_channel_group(self.user.id),
+                self.channel_name
+            )
+        if getattr(self, 'subscribes_counters', False) and self.state is not None:
+            await self.channel_layer.group_discard(user_counter_channel(self.user.id), self.channel_name)
+    
+    async def reap(self):
+        """心跳超时：立即退出频道层的组并关闭连接（半开连接的 websocket.disconnect 可能很久之后才到达）"""
+        metrics.connection_reaped()
+        logger.info('websocket_reaped', extra={'fields': {
+            'group': self.group_name, 'user_id': self.user.id, 'misses': self.heartbeat_misses
+        }})
+        await self.disconnect(HEARTBEAT_CLOSE_CODE)
+        await self.close(code=HEARTBEAT_CLOSE_CODE)
+    
+    async def join(self, group_name):
+        """订阅组的广播（订阅计数时同时订阅该组的待确认计数）"""
+        group_id = self.subscriptions[group_name] = self.state.group_ids_by_name[group_name]
+        await self.add_to_group(group_name)
+        if self.subscribes_counters:
+            await self.add_to_group(group_counter_channel(group_id))
+    
+    async def leave(self, group_name):
+        group_id = self.subscriptions.pop(group_name)
+        await self.discard_from_group(group_name)
+        if self.subscribes_counters:
+            await self.discard_from_group(group_counter_channel(group_id))
+    
+    async def add_to_group(self, group):
+        """加入组广播：启用本地扇出时登记到进程级的 local_fanout，否则本连接的频道加入频道层的组"""
+        if local_fanout.enabled:
+            await local_fanout.add(group, self)
+        else:
+            await self.channel_layer.group_add(group, self.channel_name)
+    
+    async def discard_from_group(self, group):
+        if local_fanout.enabled:
+            await local_fanout.discard(group, self)
+        else:
+            await self.channel_layer.group_discard(group, self.channel_name)
     
     async def receive(self, text_data):
         """接收WebSocket消息"""
         try:
-            text_data_json = json.loads(text_data)
+            # 收到客户端的任意帧都说明连接仍然存活
+            self.heartbeat_misses = 0
+            text_data_json = loads(text_data)
             message_type = text_data_json.get('type')
+            if message_type == 'pong':
+                # 心跳响应
+                return
+            
+            if message_type in ('send_notification', 'send_notifications'):
+                # 按用户与发送组限流，超出时返回 throttled 帧，不写入数据库也不广播
+                try:
+                    rate_limiter.acquire(self.user.id, self.state.sender_group_name, self.send_cost(text_data_json))
+                except Throttled as e:
+                    await self.reply_throttled(message_type, e)
+                    return
             
             if message_type == 'send_notification':
                 # 发送通知给另一个组
@@ -64,296 +284,730 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             elif message_type == 'confirm_notification':
                 # 确认通知
                 await self.confirm_notification(text_data_json)
+            elif message_type == 'send_notifications':
+                # 批量发送通知
+                await self.send_notifications(text_data_json)
+            elif message_type == 'confirm_notifications':
+                # 批量确认通知
+                await self.confirm_notifications(text_data_json)
+            elif message_type == 'resume':
+                # 补发断线期间错过的消息
+                await self.replay(text_data_json)
+            elif message_type in ('subscribe', 'unsubscribe'):
+                # 多路复用连接增减订阅的组
+                await self.change_subscriptions(message_type, text_data_json)
             else:
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=dumps({
                     'type': 'error',
                     'message': f'未知的消息类型: {message_type}'
                 }))
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': '无效的JSON格式'
             }))
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': f'处理消息时发生错误: {str(e)}'
             }))
     
+    @staticmethod
+    def send_cost(data):
+        """发送帧消耗的令牌数：每条通知一个；格式不合法或超过批量上限的帧随后会被拒绝，只计一个"""
+        contents = data.get('contents')
+        if data.get('type') == 'send_notifications' and isinstance(contents, list) and 0 < len(contents) <= MAX_BATCH_SIZE:
+            return len(contents)
+        return 1
+    
+    async def reply_throttled(self, message_type, throttled):
+        """告知客户端发送被限流；retry_after 为建议的重试等待秒数"""
+        metrics.count_messages('throttled')
+        logger.debug('send_throttled', extra={'fields': {
+            'user_id': self.user.id, 'group': self.state.sender_group_name, 'scope': throttled.scope
+        }})
+        if throttled.retry_after is None:
+            message = '单次发送的通知数超过限流容量'
+        else:
+            message = f'发送过于频繁，请在 {throttled.retry_after:.1f} 秒后重试'
+        await self.send(text_data=dumps({
+            'type': 'throttled',
+            'request_type': message_type,
+            'scope': throttled.scope,
+            'retry_after': None if throttled.retry_after is None else round(throttled.retry_after, 3),
+            'message': message
+        }))
+    
+    async def change_subscriptions(self, action, data):
+        """处理 {"type": "subscribe" | "unsubscribe", "groups": [组名, ...]}，只能订阅用户所在的组"""
+        group_names = data.get('groups')
+        if self.group_name is not None:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': '按组连接不支持订阅，请连接 ws/notifications/'
+            }))
+            return
+        if not isinstance(group_names, list) or not group_names or not all(isinstance(name, str) for name in group_names):
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': '缺少必要参数: groups'
+            }))
+            return
+        
+        group_names = list(dict.fromkeys(group_names))
+        if action == 'subscribe':
+            denied = [name for name in group_names if name not in self.state.group_names]
+            if denied:
+                await self.send(text_data=dumps({
+                    'type': 'error',
+                    'message': f'无权订阅: {"、".join(denied)}'
+                }))
+                return
+            changed = await self.subscribe_groups([name for name in group_names if name not in self.subscriptions])
+        else:
+            changed = await self.unsubscribe_groups([name for name in group_names if name in self.subscriptions])
+        # 显式管理订阅后不再随组成员关系自动订阅新组
+        self.follows_membership = False
+        await self.send(text_data=dumps({
+            'type': f'{action}d',
+            'groups': changed,
+            'subscriptions': list(self.subscriptions)
+        }))
+    
+    async def subscribe_groups(self, group_names):
+        for group_name in group_names:
+            await self.join(group_name)
+            metrics.connection_opened(group_name)
+        if group_names and self.subscribes_counters:
+            await self.send(text_data=dumps(await self.load_counters(
+                {group_name: self.subscriptions[group_name] for group_name in group_names}
+            )))
+        return group_names
+    
+    async def unsubscribe_groups(self, group_names):
+        for group_name in group_names:
+            await self.leave(group_name)
+            metrics.connection_closed(group_name)
+        return group_names
+    
+    @timed('send')
     async def send_notification(self, data):
         """发送通知给接收组，确保组对应关系正确"""
         content = data.get('content')
         receiver_group_name = data.get('receiver_group')
         
         if not content:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': '缺少必要参数: content'
             }))
             return
         
         try:
-            # 获取当前用户所属的组
-            sender_group = await self.get_user_group(self.user)
-            
-            if not sender_group:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': '用户不属于任何组'
-                }))
-                return
-            
-            sender_group_name = sender_group.name
+            # 校验路由、保存通知并序列化广播内容（默认只占用一次线程池调用和一个事务）
+            deliveries, counts = await self.store_notifications([content], receiver_group_name)
             
-            # 根据对应关系确定接收组
-            if not receiver_group_name:
-                # 如果没有指定接收组，根据对应关系自动选择
-                receiver_group_name = await self.get_corresponding_group(sender_group_name)
-                if not receiver_group_name:
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': f'无法确定与{sender_group_name}对应的组'
-                    }))
-                    return
-            else:
-                # 验证指定的接收组是否与发送组对应
-                expected_receiver = await self.get_corresponding_group(sender_group_name)
-                if expected_receiver and receiver_group_name != expected_receiver:
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': f'{sender_group_name}只能发送通知给{expected_receiver}'
-                    }))
-                    return
-            
-            # 验证接收组是否存在
-            if not await self.group_exists(receiver_group_name):
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': f'接收组 {receiver_group_name} 不存在'
-                }))
-                return
-            
-            # 获取接收组
-            receiver_group = await self.get_group_by_name(receiver_group_name)
-            
-            # 创建通知记录
-            notification = await self.create_notification(
-                content=content,
-                sender=self.user,
-                sender_group=sender_group,
-                receiver_group=receiver_group
-            )
-            
-            # 向接收组广播通知
-            await self.channel_layer.group_send(
-                receiver_group_name,
-                {
-                    'type': 'notification_message',
-                    'message': {
-                        'id': notification.id,
-                        'content': notification.content,
-                        'sender': notification.sender.username,
-                        'sender_group': notification.sender_group.name,
-                        'created_at': notification.created_at.isoformat(),
-                        'status': notification.status
+            for _, receiver_group_name, broadcast, sent in deliveries:
+                # 向接收组广播通知
+                await self.broadcast(
+                    receiver_group_name,
+                    {
+                        'type': 'notification_message',
+                        'message': broadcast
                     }
-                }
-            )
-            
-            # 向发送者返回成功消息
-            await self.send(text_data=json.dumps({
-                'type': 'notification_sent',
-                'message': {
-                    'id': notification.id,
-                    'content': notification.content,
-                    'receiver_group': receiver_group_name,
-                    'created_at': notification.created_at.isoformat(),
-                    'status': notification.status
-                }
+                )
+                
+                # 向发送者返回成功消息
+                await self.send(text_data=dumps({
+                    'type': 'notification_sent',
+                    'message': sent
+                }))
+            if counts is not None:
+                await publish_counters(*counts)
+        except NotificationError as e:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': str(e)
             }))
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': f'创建通知时发生错误: {str(e)}'
             }))
     
+    @timed('confirm')
     async def confirm_notification(self, data):
         """确认通知"""
         notification_id = data.get('notification_id')
         
         if not notification_id:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': '缺少通知ID'
             }))
             return
         
         try:
-            # 获取通知信息（包括必要的外键字段）
-            notification_data = await self.get_notification_with_groups(notification_id)
-            
-            if not notification_data:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': '通知不存在'
-                }))
-                return
-            
-            # 检查通知是否已被确认
-            if notification_data['status'] == 'confirmed':
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': '该通知已经被确认'
-                }))
-                return
-            
-            # 检查用户是否有权限确认该通知
-            if not await self.user_in_group(self.user, notification_data['receiver_group_name']):
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': '您没有权限确认此通知'
-                }))
-                return
-            
-            # 更新通知状态
-            updated_data = await self.update_notification_status(
+            if write_behind.is_pending([notification_id]):
+                await write_behind.flush()
+            # 条件更新：只有待确认且属于用户所在组的通知才会被更新，并发确认时只有一个成功
+            confirmed = await self.confirm_notification_atomic(
                 notification_id=notification_id,
-                user=self.user
+                user=self.user,
+                group_ids=self.state.group_ids
             )
             
-            if not updated_data:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': '更新通知状态失败'
-                }))
-                return
-            
             # 向发送组广播确认消息
-            await self.channel_layer.group_send(
-                notification_data['sender_group_name'],
+            await self.broadcast(
+                confirmed['sender_group_name'],
                 {
                     'type': 'notification_confirmed',
                     'message': {
-                        'id': updated_data['id'],
-                        'content': updated_data['content'],
-                        'confirmed_by': updated_data['confirmed_by_username'],
-                        'confirmed_at': updated_data['confirmed_at'],
-                        'receiver_group': notification_data['receiver_group_name']
+                        'id': confirmed['id'],
+                        'content': confirmed['content'],
+                        'confirmed_by': confirmed['confirmed_by_username'],
+                        'confirmed_at': confirmed['confirmed_at'],
+                        'receiver_group': confirmed['receiver_group_name']
                     }
                 }
             )
             
             # 向确认者返回成功消息
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'notification_confirmed',
                 'message': {
-                    'id': updated_data['id'],
-                    'content': updated_data['content'],
-                    'confirmed_by': updated_data['confirmed_by_username'],
-                    'confirmed_at': updated_data['confirmed_at']
+                    'id': confirmed['id'],
+                    'content': confirmed['content'],
+                    'confirmed_by': confirmed['confirmed_by_username'],
+                    'confirmed_at': confirmed['confirmed_at']
                 }
             }))
+            await self.publish_confirmed_counters([confirmed])
+        except NotificationError as e:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': f'确认通知时发生错误: {str(e)}'
             }))
     
+    @timed('send')
+    async def send_notifications(self, data):
+        """批量发送通知：一次写入全部通知，每个接收组只广播一条批量事件"""
+        contents = data.get('contents')
+        receiver_group_name = data.get('receiver_group')
+        
+        if not isinstance(contents, list) or not contents:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': '缺少必要参数: contents'
+            }))
+            return
+        if len(contents) > MAX_BATCH_SIZE:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': f'单次最多发送{MAX_BATCH_SIZE}条通知'
+            }))
+            return
+        
+        valid = [(index, content) for index, content in enumerate(contents) if content and isinstance(content, str)]
+        results = {
+            index: {'index': index, 'error': '缺少必要参数: content'}
+            for index in range(len(contents)) if not contents[index] or not isinstance(contents[index], str)
+        }
+        
+        try:
+            deliveries, counts = [], None
+            if valid:
+                deliveries, counts = await self.store_notifications([content for _, content in valid], receiver_group_name)
+            
+            batches = {}
+            for position, receiver_group_name, broadcast, sent in deliveries:
+                batches.setdefault(receiver_group_name, []).append(broadcast)
+                index = valid[position][0]
+                results.setdefault(index, {'index': index, 'notifications': []})['notifications'].append(sent)
+            
+            # 每个接收组一条批量广播
+            for receiver_group_name, messages in batches.items():
+                await self.broadcast(
+                    receiver_group_name,
+                    {
+                        'type': 'notification_batch',
+                        'messages': messages
+                    }
+                )
+            
+            await self.send(text_data=dumps({
+                'type': 'send_notifications_result',
+                'results': [results[index] for index in sorted(results)]
+            }))
+            if counts is not None:
+                await publish_counters(*counts)
+        except NotificationError as e:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
+        except Exception as e:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': f'批量创建通知时发生错误: {str(e)}'
+            }))
+    
+    @timed('confirm')
+    async def confirm_notifications(self, data):
+        """批量确认通知：一条条件 UPDATE 完成全部确认，每个发送组只广播一条批量事件"""
+        notification_ids = data.get('notification_ids')
+        
+        if not isinstance(notification_ids, list) or not notification_ids:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': '缺少通知ID列表'
+            }))
+            return
+        if len(notification_ids) > MAX_BATCH_SIZE:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': f'单次最多确认{MAX_BATCH_SIZE}条通知'
+            }))
+            return
+        
+        try:
+            if write_behind.is_pending(notification_ids):
+                await write_behind.flush()
+            confirmed, results = await self.confirm_notifications_atomic(
+                notification_ids=notification_ids,
+                user=self.user,
+                group_ids=self.state.group_ids
+            )
+            
+            batches = {}
+            for item in confirmed:
+                batches.setdefault(item['sender_group_name'], []).append({
+                    'id': item['id'],
+                    'content': item['content'],
+                    'confirmed_by': item['confirmed_by_username'],
+                    'confirmed_at': item['confirmed_at'],
+                    'receiver_group': item['receiver_group_name']
+                })
+            
+            # 每个发送组一条批量确认广播
+            for sender_group_name, messages in batches.items():
+                await self.broadcast(
+                    sender_group_name,
+                    {
+                        'type': 'notifications_confirmed',
+                        'messages': messages
+                    }
+                )
+            
+            await self.send(text_data=dumps({
+                'type': 'confirm_notifications_result',
+                'results': results
+            }))
+            await self.publish_confirmed_counters(confirmed)
+        except Exception as e:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': f'批量确认通知时发生错误: {str(e)}'
+            }))
+    
+    async def store_notifications(self, contents, receiver_group_name):
+        """保存通知，返回 ([(内容序号, 接收组名, 广播消息, 发送回执), ...], 待推送的计数)
+        
+        写后模式下计数随批量写入数据库时更新并推送，这里返回的计数为 None。
+        """
+        if not write_behind.enabled:
+            return await self.create_notification_payload(self.user, self.state, contents, receiver_group_name)
+        
+        # 写后模式：路由已加载时在内存中校验，ID取自预留的ID块，通知写入本地日志后即可广播
+        if group_router.loaded and group_router.targets(self.state.sender_group_name):
+            receivers = self.resolve_receivers(self.state, receiver_group_name)
+        else:
+            receivers = await self.resolve_receivers_in_pool(self.state, receiver_group_name)
+        ids = iter(await write_behind.allocate(len(contents) * len(receivers)))
+        now = timezone.now()
+        deliveries = [
+            (position, receiver_group_name, Notification(
+                id=next(ids),
+                content=content,
+                sender_id=self.user.id,
+                sender_group_id=self.state.sender_group_id,
+                receiver_group_id=receiver_group_id,
+                status='pending',
+                created_at=now,
+                updated_at=now
+            ))
+            for position, content in enumerate(contents)
+            for receiver_group_name, receiver_group_id in receivers
+        ]
+        await write_behind.submit([notification for _, _, notification in deliveries])
+        return self.notification_payloads(self.user, self.state, deliveries), None
+    
+    @timed('broadcast')
+    async def broadcast(self, group_name, event):
+        """通过频道层向组广播事件
+        
+        事件在发送端只序列化一次，频道层中传递的是现成的文本帧，各接收连接原样转发，
+        组内有 N 个连接时不再重复编码 N 次。group 供进程内扇出（fanout.py）查找本地连接。
+        """
+        await self.channel_layer.group_send(group_name, {
+            'type': event['type'],
+            'group': group_name,
+            'frame': dumps(event),
+            'count': len(event['messages']) if 'messages' in event else 1
+        })
+    
+    async def replay(self, data):
+        """按顺序补发断线期间错过的通知与确认，只查询 last_seen_id / last_confirmed_at 之后的行
+        
+        补发在加入频道组之后进行，因此与实时广播之间不会出现遗漏，但可能重复，客户端按通知ID去重。
+        """
+        try:
+            last_seen_id = int(data['last_seen_id']) if data.get('last_seen_id') not in (None, '') else None
+            last_confirmed_at = data.get('last_confirmed_at') or None
+            if last_confirmed_at is not None:
+                last_confirmed_at = parse_datetime(last_confirmed_at)
+                if last_confirmed_at is None:
+                    raise ValueError(data['last_confirmed_at'])
+                if timezone.is_naive(last_confirmed_at):
+                    last_confirmed_at = timezone.make_aware(last_confirmed_at)
+        except (TypeError, ValueError):
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': '无效的补发位置参数'
+            }))
+            return
+        
+        if write_behind.enabled:
+            # 补发只查询数据库，先写入缓冲中的通知
+            await write_behind.flush()
+        messages, confirmations, truncated = await self.load_replay(
+            list(self.subscriptions.values()), last_seen_id, last_confirmed_at
+        )
+        for message in messages:
+            await self.send(text_data=dumps({
+                'type': 'notification_message',
+                'message': message,
+                'replayed': True
+            }))
+        for message in confirmations:
+            await self.send(text_data=dumps({
+                'type': 'notification_confirmed',
+                'message': message,
+                'replayed': True
+            }))
+        await self.send(text_data=dumps({
+            'type': 'replay_complete',
+            'notifications': len(messages),
+            'confirmations': len(confirmations),
+            'last_seen_id': messages[-1]['id'] if messages else last_seen_id,
+            'last_confirmed_at': confirmations[-1]['confirmed_at'] if confirmations else data.get('last_confirmed_at'),
+            'truncated': truncated
+        }))
+    
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        """文本帧放入连接的有界发送队列，由写任务按顺序发送，慢客户端不会阻塞本连接读取通道层"""
+        if text_data is not None and not close:
+            self.outbound.put(text_data)
+        else:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+    
+    async def send_frame(self, frame):
+        """发送队列的写任务调用：把一帧文本写入 WebSocket"""
+        await super().send(text_data=frame)
+    
+    async def forward_frame(self, event):
+        """原样转发发送端预序列化的文本帧；队列满时这些帧可按策略合并"""
+        frame = event.get('frame')
+        self.outbound.put(frame if frame is not None else dumps(event), event['type'])
+    
     async def notification_message(self, event):
         """发送通知消息给客户端"""
-        await self.send(text_data=json.dumps(event))
+        await self.forward_frame(event)
+        metrics.count_messages('delivered')
     
     async def notification_confirmed(self, event):
         """发送确认消息给客户端"""
-        await self.send(text_data=json.dumps(event))
-    
-    @database_sync_to_async
-    def user_in_group(self, user, group_name):
-        """检查用户是否属于指定组"""
-        return user.groups.filter(name=group_name).exists()
-    
-    @database_sync_to_async
-    def get_user_group(self, user):
-        """获取用户所属的组，包括具体的运营组和财务组"""
-        groups = user.groups.all()
-        # 返回用户所属的第一个组
-        return groups[0] if groups else None
+        await self.forward_frame(event)
+    
+    async def notification_batch(self, event):
+        """发送批量通知消息给客户端"""
+        await self.forward_frame(event)
+        metrics.count_messages('delivered', event.get('count', 1))
+    
+    async def notifications_confirmed(self, event):
+        """发送批量确认消息给客户端"""
+        await self.forward_frame(event)
+    
+    async def counters(self, event):
+        """发送待确认计数更新给客户端"""
+        await self.forward_frame(event)
+    
+    async def publish_confirmed_counters(self, confirmed):
+        """推送确认后的计数；同一事务中的多条确认携带相同的最新计数"""
+        if not confirmed:
+            return
+        await publish_counters(
+            {item['receiver_group_id']: item['receiver_group_pending'] for item in confirmed},
+            {item['sender_id']: item['sender_pending'] for item in confirmed},
+            {item['receiver_group_id']: item['receiver_group_name'] for item in confirmed},
+        )
+    
+    async def membership_changed(self, event):
+        """用户的组成员关系发生变化，刷新连接缓存
         
-    @database_sync_to_async
-    def get_corresponding_group(self, group_name):
-        """获取对应的组，运营一组对应财务一组，运营二组对应财务二组"""
-        group_mapping = {
-            'operations_group_1': 'finance_group_1',
-            'finance_group_1': 'operations_group_1',
-            'operations_group_2': 'finance_group_2',
-            'finance_group_2': 'operations_group_2'
-        }
-        return group_mapping.get(group_name)
+        按组连接若已不属于当前组则断开连接；多路复用连接退订已不属于的组，跟随成员关系时订阅新加入的组。
+        """
+        self.state = await self.load_connection_state(self.user)
+        if self.group_name is not None:
+            if self.group_name not in self.state.group_names:
+                await self.close(code=4403)
+            return
+        removed = await self.unsubscribe_groups([name for name in self.subscriptions if name not in self.state.group_names])
+        added = []
+        if self.follows_membership:
+            added = await self.subscribe_groups([name for name in self.state.group_ids_by_name if name not in self.subscriptions])
+        for action, changed in (('unsubscribed', removed), ('subscribed', added)):
+            if changed:
+                await self.send(text_data=dumps({
+                    'type': action,
+                    'groups': changed,
+                    'subscriptions': list(self.subscriptions),
+                    'reason': 'membership_changed'
+                }))
     
-    @database_sync_to_async
-    def get_group_by_name(self, name):
-        """根据名称获取组"""
-        try:
-            return Group.objects.get(name=name)
-        except Group.DoesNotExist:
-            return None
-    
-    @database_sync_to_async
-    def create_notification(self, content, sender, sender_group, receiver_group):
-        """创建新通知"""
-        return Notification.objects.create(
-            content=content,
-            sender=sender,
-            sender_group=sender_group,
-            receiver_group=receiver_group
+    @timed('db')
+    @database_sync_to_pool
+    def load_connection_state(self, user):
+        """查询用户所属的组，返回（与同组连接共享的）连接级缓存"""
+        return ConnectionState.for_groups(tuple(Group.objects.filter(user=user.id).order_by('id').values_list('id', 'name')))
+    
+    @timed('db')
+    @database_sync_to_pool
+    def load_counters(self, groups):
+        """连接建立或订阅时的初始计数帧，读自计数缓存；groups 为 {组名: 组ID}"""
+        values = counter_cache.load([(GROUP, group_id) for group_id in groups.values()] + [(USER, self.user.id)])
+        return counters_frame(
+            groups={group_name: values[GROUP, group_id] for group_name, group_id in groups.items()},
+            sent_pending=values[USER, self.user.id]
         )
     
-    @database_sync_to_async
-    def update_notification_status(self, notification_id, user):
-        """更新通知状态为已确认，返回更新后的信息字典而不是对象"""
-        try:
-            notification = Notification.objects.get(id=notification_id)
-            # 检查用户是否属于接收组
-            if user.groups.filter(id=notification.receiver_group.id).exists():
-                notification.status = 'confirmed'
-                notification.confirmed_by = user
-                notification.confirmed_at = timezone.now()
-                notification.save()
-                # 返回字典而不是对象，避免在异步上下文中访问关系字段
-                return {
-                    'id': notification.id,
-                    'content': notification.content,
-                    'confirmed_by_username': user.username,
-                    'confirmed_at': notification.confirmed_at.isoformat()
+    @timed('db')
+    @database_sync_to_pool
+    def load_replay(self, group_ids, last_seen_id, last_confirmed_at):
+        """查询订阅的组内错过的消息，返回 (通知列表, 确认列表, 是否被截断)，每类最多 REPLAY_LIMIT 条
+        
+        通知：receiver_group_id = ? AND id > ? ORDER BY id，走接收组外键索引（SQLite 索引隐含 rowid）
+        确认：sender_group_id = ? AND status = 'confirmed' AND confirmed_at > ?，走 notif_confirmed_sender_idx 部分索引
+        多路复用连接订阅多个组时每个组各取一页再合并（per_group_pages）；通知ID与确认时间在各组之间可比较，
+        因此各组共用同一个补发位置。
+        """
+        messages, confirmations, truncated = [], [], False
+        if not group_ids:
+            return messages, confirmations, truncated
+        if last_seen_id is not None:
+            rows = list(
+                per_group_pages(
+                    Notification.objects.filter(id__gt=last_seen_id), 'receiver_group_id', group_ids,
+                    lambda page: page.order_by('id'), REPLAY_LIMIT + 1
+                )
+                .order_by('id')
+                .values(
+                    'id', 'content', 'sender__username', 'sender_group__name', 'receiver_group__name', 'created_at', 'status'
+                )[:REPLAY_LIMIT + 1]
+            )
+            truncated = len(rows) > REPLAY_LIMIT
+            messages = [
+                {
+                    'id': row['id'],
+                    'content': row['content'],
+                    'sender': row['sender__username'],
+                    'sender_group': row['sender_group__name'],
+                    'receiver_group': row['receiver_group__name'],
+                    'created_at': row['created_at'].isoformat(),
+                    'status': row['status']
                 }
-            return None
-        except Notification.DoesNotExist:
-            return None
+                for row in rows[:REPLAY_LIMIT]
+            ]
+        if last_confirmed_at is not None:
+            rows = list(
+                per_group_pages(
+                    Notification.objects.filter(status='confirmed', confirmed_at__gt=last_confirmed_at),
+                    'sender_group_id', group_ids, lambda page: page.order_by('confirmed_at', 'id'), REPLAY_LIMIT + 1
+                )
+                .order_by('confirmed_at', 'id')
+                .values('id', 'content', 'confirmed_by__username', 'confirmed_at', 'receiver_group__name')[:REPLAY_LIMIT + 1]
+            )
+            truncated = truncated or len(rows) > REPLAY_LIMIT
+            confirmations = [
+                {
+                    'id': row['id'],
+                    'content': row['content'],
+                    'confirmed_by': row['confirmed_by__username'],
+                    'confirmed_at': row['confirmed_at'].isoformat(),
+                    'receiver_group': row['receiver_group__name']
+                }
+                for row in rows[:REPLAY_LIMIT]
+            ]
+        return messages, confirmations, truncated
     
-    @database_sync_to_async
-    def get_notification_with_groups(self, notification_id):
-        """获取通知及其关联的组信息，避免在异步上下文中触发懒加载"""
-        try:
-            notification = Notification.objects.select_related('sender_group', 'receiver_group').get(id=notification_id)
-            return {
+    def resolve_receivers(self, state, receiver_group_name):
+        """根据路由表确定或校验接收组，返回 [(接收组名, 接收组ID), ...]；路由表查询为进程内存操作"""
+        sender_group_name = state.sender_group_name
+        if state.sender_group_id is None:
+            raise NotificationError('用户不属于任何组')
+        
+        targets = group_router.targets(sender_group_name)
+        if not receiver_group_name:
+            # 未指定接收组时按路由表扇出到全部接收组
+            if not targets:
+                raise NotificationError(f'无法确定与{sender_group_name}对应的组')
+            return list(targets.items())
+        if targets:
+            # 验证指定的接收组是否在路由表中
+            if receiver_group_name not in targets:
+                raise NotificationError(f'{sender_group_name}只能发送通知给{"、".join(targets)}')
+            return [(receiver_group_name, targets[receiver_group_name])]
+        # 发送组未配置路由时，只要求接收组存在
+        receiver_group_id = Group.objects.filter(name=receiver_group_name).values_list('id', flat=True).first()
+        if receiver_group_id is None:
+            raise NotificationError(f'接收组 {receiver_group_name} 不存在')
+        return [(receiver_group_name, receiver_group_id)]
+    
+    @timed('db')
+    @database_sync_to_pool
+    def resolve_receivers_in_pool(self, state, receiver_group_name):
+        """在数据库线程中解析接收组（路由表未加载或发送组未配置路由时需要查询数据库）"""
+        return self.resolve_receivers(state, receiver_group_name)
+    
+    @timed('db')
+    @database_sync_to_pool
+    def create_notification_payload(self, user, state, contents, receiver_group_name):
+        """在一个事务内校验接收组、创建通知并更新待确认计数，返回值同 store_notifications"""
+        with transaction.atomic():
+            receivers = self.resolve_receivers(state, receiver_group_name)
+            
+            deliveries = [
+                (position, receiver_group_name, Notification(
+                    content=content,
+                    sender_id=user.id,
+                    sender_group_id=state.sender_group_id,
+                    receiver_group_id=receiver_group_id
+                ))
+                for position, content in enumerate(contents)
+                for receiver_group_name, receiver_group_id in receivers
+            ]
+            notifications = [notification for _, _, notification in deliveries]
+            if len(notifications) == 1:
+                notifications[0].save()
+            else:
+                Notification.objects.bulk_create(notifications)
+            group_counts, user_counts = apply_deltas(*pending_deltas(
+                (notification.receiver_group_id, notification.sender_id) for notification in notifications
+            ))
+        group_names = {receiver_group_id: name for name, receiver_group_id in receivers}
+        return self.notification_payloads(user, state, deliveries), (group_counts, user_counts, group_names)
+    
+    def notification_payloads(self, user, state, deliveries):
+        """由已保存的通知构造广播消息与发送回执"""
+        payloads = []
+        for position, receiver_group_name, notification in deliveries:
+            created_at = notification.created_at.isoformat()
+            broadcast = {
                 'id': notification.id,
                 'content': notification.content,
-                'status': notification.status,
-                'sender_group_name': notification.sender_group.name,
-                'receiver_group_name': notification.receiver_group.name
+                'sender': user.username,
+                'sender_group': state.sender_group_name,
+                'receiver_group': receiver_group_name,
+                'created_at': created_at,
+                'status': notification.status
             }
-        except Notification.DoesNotExist:
-            return None
+            sent = {
+                'id': notification.id,
+                'content': notification.content,
+                'receiver_group': receiver_group_name,
+                'created_at': created_at,
+                'status': notification.status
+            }
+            payloads.append((position, receiver_group_name, broadcast, sent))
+        metrics.count_messages('sent', len(payloads))
+        return payloads
     
-    @database_sync_to_async
-    def get_notification(self, notification_id):
-        """获取通知"""
-        try:
-            return Notification.objects.get(id=notification_id)
-        except Notification.DoesNotExist:
-            return None
-    
-    @database_sync_to_async
-    def group_exists(self, group_name):
-        """检查组是否存在"""
-        return Group.objects.filter(name=group_name).exists()
\ No newline at end of file
+    def confirm_rows(self, notification_ids, user, group_ids):
+        """用一条条件 UPDATE 确认一批通知，返回 (成功确认的通知列表, 逐条结果)
+        
+        UPDATE ... WHERE id IN (...) AND status='pending' AND receiver_group_id IN (用户所在组)
+        以唯一的确认时间戳标记本次确认，随后的投影查询据此区分本次确认成功的行与失败原因，
+        因此并发确认同一通知时只有一个确认者成功。
+        """
+        ids = list(dict.fromkeys(int(notification_id) for notification_id in notification_ids))
+        now = timezone.now()
+        # 投影查询与 UPDATE 处于同一事务：投影失败时确认一并回滚，不会出现已确认却未广播的情况
+        with transaction.atomic():
+            Notification.objects.filter(
+                id__in=ids,
+                status='pending',
+                receiver_group_id__in=group_ids
+            ).update(status='confirmed', confirmed_by_id=user.id, confirmed_at=now, updated_at=now)
+            
+            rows = {
+                row['id']: row
+                for row in Notification.objects.filter(id__in=ids).values(
+                    'id', 'content', 'status', 'confirmed_by_id', 'confirmed_at', 'receiver_group_id', 'sender_id',
+                    'sender_group__name', 'receiver_group__name'
+                )
+            }
+            winners = {
+                notification_id for notification_id, row in rows.items()
+                if row['confirmed_by_id'] == user.id and row['confirmed_at'] == now
+            }
+            # 本次确认成功的通知从接收组与发送者的待确认计数中减去
+            group_counts, user_counts = apply_deltas(*pending_deltas(
+                ((rows[notification_id]['receiver_group_id'], rows[notification_id]['sender_id']) for notification_id in winners),
+                sign=-1
+            ))
+        
+        confirmed, results = [], []
+        for notification_id in ids:
+            row = rows.get(notification_id)
+            if row is None:
+                results.append({'id': notification_id, 'error': '通知不存在'})
+            elif notification_id in winners:
+                confirmed.append({
+                    'id': row['id'],
+                    'content': row['content'],
+                    'sender_group_name': row['sender_group__name'],
+                    'receiver_group_name': row['receiver_group__name'],
+                    'confirmed_by_username': user.username,
+                    'confirmed_at': now.isoformat(),
+                    'receiver_group_id': row['receiver_group_id'],
+                    'receiver_group_pending': group_counts[row['receiver_group_id']],
+                    'sender_id': row['sender_id'],
+                    'sender_pending': user_counts[row['sender_id']]
+                })
+                results.append({'id': notification_id, 'status': 'confirmed', 'confirmed_at': now.isoformat()})
+            elif row['status'] == 'confirmed':
+                results.append({'id': notification_id, 'error': '该通知已经被确认'})
+            else:
+                results.append({'id': notification_id, 'error': '您没有权限确认此通知'})
+        metrics.count_messages('confirmed', len(confirmed))
+        return confirmed, results
+    
+    @timed('db')
+    @database_sync_to_pool
+    def confirm_notification_atomic(self, notification_id, user, group_ids):
+        """确认单条通知，失败时抛出带原因的 NotificationError"""
+        confirmed, results = self.confirm_rows([notification_id], user, group_ids)
+        if not confirmed:
+            raise NotificationError(results[0]['error'])
+        return confirmed[0]
+    
+    @timed('db')
+    @database_sync_to_pool
+    def confirm_notifications_atomic(self, notification_ids, user, group_ids):
+        """批量确认通知"""
+        return self.confirm_rows(notification_ids, user, group_ids)
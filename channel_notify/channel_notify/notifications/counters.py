@@ -0,0 +1,151 @@
+"""待确认计数：组收到的待确认通知数与用户发送的待确认通知数
+
+计数保存在 NotificationCounter 表中，发送与确认时在同一事务内用一条 UPSERT 增量更新并取回新值；
+进程内缓存在事务提交后更新，缓存项在 TTL 后过期，以便读到其他工作进程的更新。
+更新后的计数通过频道层推送给订阅了计数的连接（连接时携带 counters=1 查询参数）。
+"""
+import threading
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .jsoncodec import dumps
+from .models import Notification, NotificationCounter
+
+GROUP = 'group'
+USER = 'user'
+
+
+def group_counter_channel(group_id):
+    """订阅某组待确认计数的频道层组名"""
+    return f'notify.counters.group.{group_id}'
+
+
+def user_counter_channel(user_id):
+    """订阅某用户发送的待确认计数的频道层组名"""
+    return f'notify.counters.user.{user_id}'
+
+
+class CounterCache:
+    """进程内计数缓存 {(scope, owner_id): (计数, 过期时间)}，视图线程与数据库线程都会访问"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def set_many(self, values):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = (value, expires)
+
+    def load(self, keys):
+        """返回 {(scope, owner_id): 计数}；缓存未命中的键按主键唯一索引查询一次，没有计数行的视为0"""
+        now = time.monotonic()
+        values, missing = {}, []
+        with self._lock:
+            for key in keys:
+                cached = self._values.get(key)
+                if cached is not None and cached[1] > now:
+                    values[key] = cached[0]
+                else:
+                    missing.append(key)
+        if missing:
+            loaded = {key: 0 for key in missing}
+            for scope in {scope for scope, _ in missing}:
+                rows = NotificationCounter.objects.filter(
+                    scope=scope, owner_id__in=[owner_id for s, owner_id in missing if s == scope]
+                ).values_list('owner_id', 'pending')
+                loaded.update({(scope, owner_id): pending for owner_id, pending in rows})
+            self.set_many(loaded)
+            values.update(loaded)
+        return values
+
+
+counter_cache = CounterCache(ttl=getattr(settings, 'NOTIFY_COUNTER_CACHE_TTL', 2))
+
+
+def pending_deltas(pairs, sign=1):
+    """按 (接收组ID, 发送者ID) 汇总通知数，返回 (组增量, 用户增量)；确认时 sign=-1"""
+    group_deltas, user_deltas = {}, {}
+    for receiver_group_id, sender_id in pairs:
+        group_deltas[receiver_group_id] = group_deltas.get(receiver_group_id, 0) + sign
+        user_deltas[sender_id] = user_deltas.get(sender_id, 0) + sign
+    return group_deltas, user_deltas
+
+
+def apply_deltas(group_deltas, user_deltas):
+    """在当前事务中按增量更新计数，返回更新后的 ({组ID: 待确认数}, {用户ID: 待确认数})
+
+    全部计数由一条 INSERT ... ON CONFLICT DO UPDATE ... RETURNING 完成（SQLite 3.35+ / PostgreSQL）。
+    """
+    rows = [(GROUP, owner_id, delta) for owner_id, delta in group_deltas.items() if delta]
+    rows += [(USER, owner_id, delta) for owner_id, delta in user_deltas.items() if delta]
+    if not rows:
+        return {}, {}
+    table = NotificationCounter._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (scope, owner_id, pending) VALUES {", ".join(["(%s, %s, %s)"] * len(rows))} '
+            f'ON CONFLICT (scope, owner_id) DO UPDATE SET pending = {table}.pending + excluded.pending '
+            'RETURNING scope, owner_id, pending',
+            [value for row in rows for value in row],
+        )
+        values = {(scope, owner_id): pending for scope, owner_id, pending in cursor.fetchall()}
+    transaction.on_commit(lambda: counter_cache.set_many(values))
+    return (
+        {owner_id: pending for (scope, owner_id), pending in values.items() if scope == GROUP},
+        {owner_id: pending for (scope, owner_id), pending in values.items() if scope == USER},
+    )
+
+
+def rebuild_counters():
+    """按通知表重新计算全部计数（计数与通知表不一致时使用，例如直接在数据库中删除了待确认通知）"""
+    pending = Notification.objects.filter(status='pending')
+    counters = [
+        NotificationCounter(scope=GROUP, owner_id=row['receiver_group_id'], pending=row['n'])
+        for row in pending.values('receiver_group_id').annotate(n=Count('id')).order_by()
+    ] + [
+        NotificationCounter(scope=USER, owner_id=row['sender_id'], pending=row['n'])
+        for row in pending.values('sender_id').annotate(n=Count('id')).order_by()
+    ]
+    with transaction.atomic():
+        NotificationCounter.objects.all().delete()
+        NotificationCounter.objects.bulk_create(counters, batch_size=500)
+    counter_cache.clear()
+    return len(counters)
+
+
+def counters_frame(groups=None, sent_pending=None):
+    """counters 事件：groups 为 {组名: 待确认数}，sent_pending 为用户发送的待确认数"""
+    frame = {'type': 'counters'}
+    if groups is not None:
+        frame['groups'] = groups
+    if sent_pending is not None:
+        frame['sent_pending'] = sent_pending
+    return frame
+
+
+async def publish_counters(group_counts, user_counts, group_names):
+    """把更新后的计数推送给订阅的连接；group_names 为 {组ID: 组名}"""
+    channel_layer = get_channel_layer()
+    for group_id, pending in group_counts.items():
+        group = group_counter_channel(group_id)
+        await channel_layer.group_send(group, {
+            'type': 'counters',
+            'group': group,
+            'frame': dumps(counters_frame(groups={group_names[group_id]: pending}))
+        })
+    for user_id, pending in user_counts.items():
+        await channel_layer.group_send(user_counter_channel(user_id), {
+            'type': 'counters',
+            'frame': dumps(counters_frame(sent_pending=pending))
+        })
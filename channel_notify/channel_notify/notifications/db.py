@@ -0,0 +1,64 @@
+"""消费者的数据库访问线程池
+
+channels 的 database_sync_to_async 默认是 thread_sensitive 的：进程内所有连接的数据库调用都排队在同一个线程上执行。
+Django 5.2 的异步 ORM（aget / acreate / aupdate ...）内部同样通过 thread_sensitive 的 sync_to_async 执行，
+换用异步 ORM 并不能解除这一串行化。因此消费者的数据库调用改为提交到一个独立的、大小可配置的线程池：
+
+- settings.NOTIFY_DB_THREADS > 0：在名为 notify-db-N 的专用线程池中执行，不阻塞认证中间件等其他 thread_sensitive 调用
+- settings.NOTIFY_DB_THREADS = 0：沿用 thread_sensitive 的默认行为（测试中 TestCase 的事务只在主线程连接上可见）
+
+每次调用前后都会清理本线程上过期的数据库连接，与 database_sync_to_async 一致。
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+
+_lock = threading.Lock()
+_executor = None
+_executor_size = 0
+
+
+def db_executor():
+    """返回按 NOTIFY_DB_THREADS 配置的线程池；配置为 0 时返回 None。配置变化时重建线程池"""
+    global _executor, _executor_size
+    size = getattr(settings, 'NOTIFY_DB_THREADS', 0)
+    if size == _executor_size:
+        return _executor
+    with _lock:
+        if size != _executor_size:
+            old = _executor
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='notify-db') if size else None
+            _executor_size = size
+            if old is not None:
+                old.shutdown(wait=False)
+    return _executor
+
+
+class PooledDatabaseSyncToAsync:
+    """database_sync_to_async 的线程池版本，每次调用时按当前配置选择执行位置"""
+
+    def __init__(self, func):
+        self.func = func
+        self._sensitive = DatabaseSyncToAsync(func)
+        self._pooled = None
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return functools.partial(self.__call__, instance)
+
+    async def __call__(self, *args, **kwargs):
+        executor = db_executor()
+        if executor is None:
+            return await self._sensitive(*args, **kwargs)
+        pooled = self._pooled
+        if pooled is None or pooled._executor is not executor:
+            pooled = self._pooled = DatabaseSyncToAsync(self.func, thread_sensitive=False, executor=executor)
+        return await pooled(*args, **kwargs)
+
+
+database_sync_to_pool = PooledDatabaseSyncToAsync
@@ -0,0 +1,21 @@
+"""SQLite 连接调优：通过 connection_created 钩子在每个新连接上执行 settings.NOTIFY_SQLITE_PRAGMAS
+
+journal_mode=WAL 下读不阻塞写、写不阻塞读；synchronous=NORMAL 在 WAL 下只在检查点时 fsync。
+settings.NOTIFY_READ_ONLY_DATABASES 中的连接别名额外开启 query_only，误写入会直接报错。
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """在新建的 SQLite 连接上执行配置的 PRAGMA，只读别名最后开启 query_only"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'NOTIFY_SQLITE_PRAGMAS', {}))
+    if connection.alias in getattr(settings, 'NOTIFY_READ_ONLY_DATABASES', ()):
+        pragmas['query_only'] = 'ON'
+    # 直接在底层连接上执行，不计入查询日志
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
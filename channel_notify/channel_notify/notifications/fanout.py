@@ -0,0 +1,136 @@
+"""进程内的组广播扇出
+
+默认每个连接各自加入频道层的组：一次 group_send 要为组内 N 个连接各投递一份消息（内存频道层为每个连接深拷贝一次
+消息、创建一个投递任务，channels_redis 为每个连接写一次队列），每个连接的协程再各自被唤醒、分发一次。
+
+启用 settings.NOTIFY_LOCAL_FANOUT 后，组广播与组计数改由进程内的 LocalFanout 扇出：
+- 每个进程只有一个扇出频道，按组登记本进程的本地连接；扇出频道在组内有本地连接期间留在频道层的组中（定期续期），
+  最后一个离开时退出，频道层中的组成员关系按进程而不是按连接维护
+- 一次广播在频道层中每个进程只投递一次，扇出任务收到后把同一个（不可变的）文本帧放入各本地连接的发送队列，
+  不再逐连接拷贝消息、唤醒连接协程
+
+经扇出的频道层消息须带 group 字段（组名）与预序列化的 frame，与各连接上的处理器（forward_frame）等价。
+按用户的频道（成员变更、本人发送的计数）仍由各连接自己订阅。
+
+与逐连接订阅的差别：广播不经过接收连接自己的协程，发送者本身也订阅接收组时，广播可能先于 notification_sent 到达；
+握手完成（accept）之前到达的广播不会写给该连接。
+"""
+import asyncio
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 计入 delivered 消息数的事件类型
+DELIVERED_EVENTS = ('notification_message', 'notification_batch')
+
+
+class LocalFanout:
+    """本进程的组 -> 本地连接登记表与扇出任务，只在事件循环线程中使用
+
+    连接需提供 accepted 属性与 outbound 发送队列。
+    频道层的组成员关系会在 group_expiry 后过期：每个本地连接加入时重新执行一次 group_add，
+    另有刷新任务每 group_expiry / 2 秒为全部有本地连接的组续期，长期有人在线的组不会因过期而收不到广播。
+    """
+
+    # 接收频道层消息出错后的重试间隔（秒）
+    retry_delay = 1.0
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.groups = {}
+        self.layer = None
+        self.channel_name = None
+        self.task = None
+        self.refresher = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(getattr(settings, 'NOTIFY_LOCAL_FANOUT', False))
+
+    async def start(self):
+        """在当前事件循环中创建扇出频道、接收任务与续期任务"""
+        loop = asyncio.get_running_loop()
+        layer = get_channel_layer()
+        if self.running(loop, layer):
+            return
+        channel_name = await layer.new_channel()
+        if self.running(loop, layer):
+            # 等待期间另一个连接已完成启动
+            return
+        if self.task is None or self.task.get_loop() is not loop or self.layer is not layer:
+            # 旧事件循环（或已替换的频道层）中的连接不会再收到消息，也不会注销
+            self.groups = {}
+        if self.refresher is not None and not self.refresher.done():
+            self.refresher.cancel()
+        self.layer, self.channel_name = layer, channel_name
+        self.task = loop.create_task(self.run(layer, channel_name))
+        self.refresher = loop.create_task(self.refresh(layer, channel_name))
+        # 同一事件循环中接收任务意外退出后重建：已登记的连接保留，各组以新的扇出频道重新加入
+        for group in list(self.groups):
+            await layer.group_add(group, channel_name)
+
+    def running(self, loop, layer):
+        return self.task is not None and not self.task.done() and self.task.get_loop() is loop and self.layer is layer
+
+    async def add(self, group, consumer):
+        """登记本地连接，并（重新）把扇出频道加入频道层的组"""
+        await self.start()
+        self.groups.setdefault(group, set()).add(consumer)
+        await self.layer.group_add(group, self.channel_name)
+
+    async def discard(self, group, consumer):
+        """注销本地连接；组内最后一个本地连接离开时扇出频道退出频道层的组"""
+        members = self.groups.get(group)
+        if members is None or consumer not in members:
+            return
+        members.discard(consumer)
+        if not members:
+            del self.groups[group]
+            await self.layer.group_discard(group, self.channel_name)
+
+    async def run(self, layer, channel_name):
+        while True:
+            try:
+                message = await layer.receive(channel_name)
+            except Exception:
+                logger.exception('local_fanout_receive_failed')
+                await asyncio.sleep(self.retry_delay)
+                continue
+            try:
+                self.deliver(message)
+            except Exception:
+                logger.exception('local_fanout_failed')
+
+    async def refresh(self, layer, channel_name):
+        """在频道层的组成员关系过期之前为全部有本地连接的组续期"""
+        interval = getattr(layer, 'group_expiry', 86400) / 2
+        while True:
+            await asyncio.sleep(interval)
+            for group in list(self.groups):
+                try:
+                    await layer.group_add(group, channel_name)
+                except Exception:
+                    logger.exception('local_fanout_refresh_failed')
+
+    def deliver(self, message):
+        """把一条组消息的文本帧放入该组全部本地连接的发送队列"""
+        members = self.groups.get(message.get('group'))
+        if not members:
+            return
+        kind, frame = message['type'], message['frame']
+        delivered = 0
+        for consumer in members:
+            # 连接在 accept 之前登记，握手完成前的广播不写出（重连时由补发覆盖）
+            if consumer.accepted:
+                consumer.outbound.put(frame, kind)
+                delivered += 1
+        if kind in DELIVERED_EVENTS:
+            metrics.count_messages('delivered', delivered * message.get('count', 1))
+
+
+local_fanout = LocalFanout.from_settings()
@@ -0,0 +1,182 @@
+"""WebSocket 握手认证：按会话键缓存解析出的用户及其所属组
+
+channels 的 AuthMiddlewareStack 在每次握手时读取一次会话（数据库会话引擎下查询会话表）并查询一次用户，
+连接建立后消费者还要再查询一次用户所属的组。部署或网络抖动后成千上万的客户端在几秒内同时重连，
+这些查询会占满 SQLite。HandshakeAuthMiddleware 替代 AuthMiddlewareStack：解析结果保存在有界的
+TTL + LRU 缓存中，命中时握手不访问会话存储与数据库；未命中时在数据库线程池中读取会话、校验会话认证哈希，
+并查询用户及其组。解析出的组以 scope['notify_groups'] 交给消费者，消费者据此构造连接状态。
+scope['user'] 为只含ID与用户名的 ConnectionUser：scope 在连接存续期间一直被各层 ASGI 协程引用，
+不在其中放 User 模型实例与整个 Cookie 字典。
+
+缓存的键是会话 Cookie 值的摘要，与会话引擎无关（db / cached_db / cache / signed_cookies 均可）：
+signed_cookies 引擎下 Cookie 就是签名后的会话数据；登录时 Django 总会更换会话键，因此未登录的结果也可以缓存。
+
+失效（signals.py）：
+- 登出：丢弃该会话键
+- 用户保存或删除（修改密码、停用等）、用户组成员关系变更：丢弃该用户的全部会话键
+- 组改名或删除：清空缓存
+信号只在发生变更的工作进程内触发：执行变更的进程立即失效本进程的缓存，事务提交后再经频道层广播失效消息
+（invalidation.py），其他工作进程收到后同样失效；会话只广播摘要，不在频道层中传递会话凭据。
+频道层不可用时其他进程依靠 TTL 过期。缓存项的有效期同时不超过会话本身的剩余有效期。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from importlib import import_module
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+from django.http.cookie import parse_cookie
+
+from .consumers import ConnectionUser
+from .db import database_sync_to_pool
+from .invalidation import InvalidationListenerMiddleware
+from .metrics import metrics
+
+
+class HandshakeAuthCache:
+    """会话键摘要 -> (用户, 组列表, 过期时间) 的 LRU 缓存，另维护 用户ID -> 会话键摘要集合 以便按用户失效
+
+    握手在事件循环线程中读取，失效来自信号（可能在任意线程），读写在锁内完成。
+    """
+
+    def __init__(self, max_entries, ttl, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        # 每次失效递增；解析期间发生过失效的结果不写入缓存，避免把失效前读到的旧数据放回去
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = {'MAX_ENTRIES': 10000, 'TTL': 60}
+        config.update(getattr(settings, 'NOTIFY_HANDSHAKE_AUTH_CACHE', {}))
+        return cls(config['MAX_ENTRIES'], config['TTL'])
+
+    @staticmethod
+    def digest(session_key):
+        # 固定长度的摘要作为键：signed_cookies 的会话键可能很长，缓存中也不保留会话凭据本身
+        return hashlib.blake2b(session_key.encode(), digest_size=16).digest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_key):
+        """返回 (用户, 组列表)，未命中或已过期时返回 None"""
+        key = self.digest(session_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def set(self, session_key, user, groups, ttl, generation):
+        """缓存解析结果，ttl 为会话剩余有效秒数；generation 为开始解析前读取的 self.generation"""
+        if not self.max_entries or ttl <= 0:
+            return
+        key = self.digest(session_key)
+        expires = self.clock() + min(self.ttl, ttl)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (user, groups, expires)
+            if user.is_authenticated:
+                self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or not entry[0].is_authenticated:
+            return
+        keys = self._keys_by_user.get(entry[0].pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[0].pk]
+
+    def invalidate_session(self, session_key):
+        self.invalidate_digest(self.digest(session_key))
+
+    def invalidate_digest(self, key):
+        """按会话键摘要失效，用于其他进程广播的登出"""
+        with self._lock:
+            self.generation += 1
+            self._remove(key)
+
+    def invalidate_users(self, user_ids):
+        with self._lock:
+            self.generation += 1
+            for user_id in user_ids:
+                for key in list(self._keys_by_user.get(user_id, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+
+handshake_cache = HandshakeAuthCache.from_settings()
+
+
+@database_sync_to_pool
+def resolve_session(session_key):
+    """读取会话并解析用户，返回 (用户, 组列表, 会话剩余有效秒数)"""
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    # auth.get_user 只读取 request.session：按会话中的认证后端取回用户并校验会话认证哈希，失败时返回 AnonymousUser
+    user = auth.get_user(SimpleNamespace(session=session))
+    groups = ()
+    if user.is_authenticated:
+        groups = tuple(user.groups.order_by('id').values_list('id', 'name'))
+    return ConnectionUser.from_user(user), groups, session.get_expiry_age()
+
+
+def cookie_session_key(scope):
+    """从握手请求的 Cookie 头取出会话键"""
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            return parse_cookie(value.decode('latin1')).get(settings.SESSION_COOKIE_NAME)
+    return None
+
+
+class HandshakeAuthMiddleware:
+    """以缓存的会话解析结果填充 scope['user'] 与 scope['notify_groups']"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        user, groups = await self.resolve(cookie_session_key(scope))
+        return await self.inner(dict(scope, user=user, notify_groups=groups), receive, send)
+
+    @staticmethod
+    async def resolve(session_key):
+        if not session_key:
+            return AnonymousUser(), ()
+        cached = handshake_cache.get(session_key)
+        if cached is not None:
+            metrics.handshake('hit')
+            return cached
+        metrics.handshake('miss')
+        generation = handshake_cache.generation
+        user, groups, ttl = await resolve_session(session_key)
+        handshake_cache.set(session_key, user, groups, ttl, generation)
+        return user, groups
+
+
+def HandshakeAuthMiddlewareStack(inner):
+    # 自行解析 Cookie 头，不需要 CookieMiddleware / SessionMiddleware；同时确保本进程接收其他进程广播的缓存失效
+    return InvalidationListenerMiddleware(HandshakeAuthMiddleware(inner))
@@ -0,0 +1,100 @@
+"""服务端应用层心跳与失效连接回收
+
+浏览器只有在 onclose 时才发现连接断开；半开的 TCP 连接（客户端断网、休眠、NAT 表项过期）在服务端看来仍然存活，
+继续留在频道层的组中，每次 group_send 都要为它们投递消息并占用内存，直到频道层的组过期时间（300 秒）之后。
+
+每个进程只有一个心跳任务（HeartbeatWheel）：连接分布在 SLOTS 个槽中，任务每 INTERVAL / SLOTS 秒推进一个槽，
+每个连接每 INTERVAL 秒被访问一次，ping 帧均匀分散在整个周期内，不为每个连接创建定时任务。
+访问连接时，若它已连续 MISSES 次没有响应就回收：立即退出频道层的组并关闭连接；否则发送
+{"type": "ping", "interval": INTERVAL} 并记一次未响应。连接收到客户端的任意帧（包括 {"type": "pong"}）时清零。
+半开连接最迟在 (MISSES + 1) * INTERVAL 秒后被回收。
+
+配置 settings.NOTIFY_HEARTBEAT：{'INTERVAL': 30, 'MISSES': 2}，INTERVAL 为 0 时关闭心跳。
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+
+from .jsoncodec import dumps
+
+logger = logging.getLogger(__name__)
+
+# 心跳超时回收连接时使用的关闭码
+HEARTBEAT_CLOSE_CODE = 4009
+
+# 时间轮的槽数：每次推进访问约 1/SLOTS 的连接
+SLOTS = 10
+
+
+class HeartbeatWheel:
+    """按槽轮转的共享心跳定时器，只在事件循环线程中使用
+
+    连接需提供 heartbeat_slot / heartbeat_misses 属性、outbound 发送队列与 reap() 协程。
+    没有连接时任务退出，下一个连接注册时重新启动。
+    """
+
+    def __init__(self, interval, misses, slots=SLOTS):
+        self.interval = interval
+        self.misses = misses
+        self.slots = [set() for _ in range(slots)]
+        self.cursor = 0
+        self.task = None
+        self.ping_frame = dumps({'type': 'ping', 'interval': interval})
+
+    @classmethod
+    def from_settings(cls):
+        config = {'INTERVAL': 30, 'MISSES': 2}
+        config.update(getattr(settings, 'NOTIFY_HEARTBEAT', {}))
+        return cls(config['INTERVAL'], config['MISSES'])
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def register(self, consumer):
+        """加入心跳；放入刚访问过的槽，一个完整周期后第一次访问"""
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            if self.task is not None and self.task.get_loop() is not loop:
+                # 旧事件循环中的连接不会再收到消息，也不会注销
+                for slot in self.slots:
+                    slot.clear()
+            self.task = loop.create_task(self.run())
+        consumer.heartbeat_slot = (self.cursor - 1) % len(self.slots)
+        consumer.heartbeat_misses = 0
+        self.slots[consumer.heartbeat_slot].add(consumer)
+
+    def unregister(self, consumer):
+        slot = getattr(consumer, 'heartbeat_slot', None)
+        if slot is not None:
+            self.slots[slot].discard(consumer)
+
+    async def run(self):
+        tick = self.interval / len(self.slots)
+        while any(self.slots):
+            await asyncio.sleep(tick)
+            slot = self.slots[self.cursor]
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            await self.visit(slot)
+
+    async def visit(self, slot):
+        """向槽中的连接发送 ping，回收连续 misses 次未响应的连接"""
+        dead = []
+        for consumer in slot:
+            if consumer.heartbeat_misses >= self.misses:
+                dead.append(consumer)
+            else:
+                consumer.heartbeat_misses += 1
+                consumer.outbound.put(self.ping_frame)
+        if not dead:
+            return
+        slot.difference_update(dead)
+        results = await asyncio.gather(*(consumer.reap() for consumer in dead), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error('heartbeat_reap_failed', exc_info=result)
+
+
+heartbeat = HeartbeatWheel.from_settings()
@@ -0,0 +1,124 @@
+"""进程级缓存的跨进程失效广播
+
+组路由表（router.py）等缓存保存在各工作进程的内存中，变更信号只在执行变更的进程内触发。
+signals.py 在事务提交后经频道层向 INVALIDATION_GROUP 组广播一条失效消息，每个工作进程有一个失效频道加入该组，
+收到后按消息的 kind 调用登记的处理器丢弃本进程的缓存（执行变更的进程本身也会收到，重复失效无副作用）。
+
+失效频道在进程处理第一个 ASGI 请求（HTTP 或 WebSocket）时由 InvalidationListenerMiddleware 启动。
+纯 WSGI 进程没有事件循环，不接收失效广播，只能依靠本进程的信号。
+"""
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_GROUP = 'notify.invalidation'
+
+
+class InvalidationListener:
+    """本进程的失效频道与接收任务，只在事件循环线程中启动
+
+    与进程内扇出相同，频道层的组成员关系会在 group_expiry 后过期，另有刷新任务每 group_expiry / 2 秒续期一次。
+    """
+
+    # 接收频道层消息出错后的重试间隔（秒）
+    retry_delay = 1.0
+
+    def __init__(self):
+        self.handlers = {}
+        self.layer = None
+        self.channel_name = None
+        self.task = None
+        self.refresher = None
+
+    def register(self, kind, handler):
+        """登记 kind 类型失效消息的处理器，处理器以整条消息为参数"""
+        self.handlers[kind] = handler
+
+    async def start(self):
+        """在当前事件循环中创建失效频道、接收任务与续期任务并加入失效组"""
+        loop = asyncio.get_running_loop()
+        layer = get_channel_layer()
+        if layer is None or self.running(loop, layer):
+            return
+        channel_name = await layer.new_channel()
+        if self.running(loop, layer):
+            # 等待期间另一个请求已完成启动
+            return
+        for task in (self.task, self.refresher):
+            if task is not None and task.get_loop() is loop:
+                task.cancel()
+        previous = self.channel_name if self.layer is layer else None
+        self.layer, self.channel_name = layer, channel_name
+        self.task = loop.create_task(self.run(layer, channel_name))
+        self.refresher = loop.create_task(self.refresh(layer, channel_name))
+        try:
+            if previous is not None:
+                # 旧事件循环（或已退出的接收任务）的频道不会再接收消息
+                await layer.group_discard(INVALIDATION_GROUP, previous)
+            await layer.group_add(INVALIDATION_GROUP, channel_name)
+        except Exception:
+            # 未能加入失效组：停止任务，下次调用时重新启动
+            self.task.cancel()
+            self.refresher.cancel()
+            raise
+
+    def running(self, loop, layer):
+        return self.task is not None and not self.task.done() and self.task.get_loop() is loop and self.layer is layer
+
+    async def run(self, layer, channel_name):
+        while True:
+            try:
+                message = await layer.receive(channel_name)
+            except Exception:
+                logger.exception('invalidation_receive_failed')
+                await asyncio.sleep(self.retry_delay)
+                continue
+            try:
+                self.handle(message)
+            except Exception:
+                logger.exception('invalidation_failed', extra={'fields': {'kind': message.get('kind')}})
+
+    async def refresh(self, layer, channel_name):
+        """在频道层的组成员关系过期之前续期"""
+        interval = getattr(layer, 'group_expiry', 86400) / 2
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await layer.group_add(INVALIDATION_GROUP, channel_name)
+            except Exception:
+                logger.exception('invalidation_refresh_failed')
+
+    def handle(self, message):
+        handler = self.handlers.get(message.get('kind'))
+        if handler is not None:
+            handler(message)
+
+
+listener = InvalidationListener()
+
+
+def publish(kind, **fields):
+    """向全部工作进程广播一条失效消息，需在同步上下文中调用（通常在事务提交后）"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(INVALIDATION_GROUP, {'type': 'notify.invalidate', 'kind': kind, **fields})
+
+
+class InvalidationListenerMiddleware:
+    """ASGI 中间件：确保本进程的失效频道已在当前事件循环中运行"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await listener.start()
+        except Exception:
+            # 频道层暂时不可用时照常处理请求，下一个请求再尝试启动
+            logger.exception('invalidation_start_failed')
+        return await self.inner(scope, receive, send)
@@ -0,0 +1,23 @@
+"""JSON 编解码：安装了 orjson 时使用 orjson，否则回退到标准库 json
+
+dumps 返回 str，可直接作为 WebSocket 文本帧发送；两种后端都输出紧凑、不转义非 ASCII 字符的 JSON。
+loads 解析失败时抛出的异常都是 json.JSONDecodeError 的子类。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+else:  # pragma: no cover - 取决于运行环境
+    BACKEND = 'json'
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    loads = json.loads
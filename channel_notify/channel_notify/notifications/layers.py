@@ -0,0 +1,249 @@
+"""跨进程通道层：以共享 SQLite 文件作为消息总线，无需外部服务即可支持多个 daphne 工作进程
+
+生产环境推荐使用 channels_redis；本通道层用于单机多进程部署与测试，所有进程需指向同一文件。
+消息以 JSON 序列化，因此只支持可 JSON 序列化的消息（本项目的所有通道消息均满足）。
+"""
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .jsoncodec import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS layer_message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS layer_message_channel_idx ON layer_message (channel, id);
+CREATE TABLE IF NOT EXISTS layer_group (
+    grp TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (grp, channel)
+);
+'''
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """基于共享 SQLite 文件（WAL 模式）的通道层
+
+    - 所有数据库操作在通道层专属的单线程执行器中完成，不占用 Django 的数据库线程
+    - 进程内的全部专属通道（specific.xxx!yyy）共用一个轮询任务，一次取回该进程的全部消息后分发到本地队列，
+      轮询间隔在空闲时从 poll_interval 指数退避到 max_poll_interval；数据库出错（如锁超时）时记录日志并按最大间隔重试
+    - group_send 为一条 INSERT ... SELECT，在数据库内完成组成员展开与容量检查
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path=None,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.05,
+        batch_size=100,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = str(path or Path(tempfile.gettempdir()) / 'channel_notify_layer.sqlite3')
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.batch_size = batch_size
+        self.client_prefix = uuid.uuid4().hex
+        self._connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+        self._buffers = {}
+        self._poller = None
+        self._last_purge = 0.0
+
+    # 数据库访问（仅在执行器线程中调用）
+
+    def _db(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _purge_expired(self, now):
+        """定期清理过期消息与过期的组成员关系"""
+        if now - self._last_purge < 1:
+            return
+        self._last_purge = now
+        db = self._db()
+        db.execute('DELETE FROM layer_message WHERE expires < ?', (now,))
+        db.execute('DELETE FROM layer_group WHERE expires < ?', (now,))
+
+    def _send(self, channel, body, capacity):
+        now = time.time()
+        self._purge_expired(now)
+        cursor = self._db().execute(
+            'INSERT INTO layer_message (channel, expires, body) '
+            'SELECT ?, ?, ? WHERE (SELECT COUNT(*) FROM layer_message WHERE channel = ? AND expires >= ?) < ?',
+            (channel, now + self.expiry, body, channel, now, capacity),
+        )
+        return cursor.rowcount
+
+    def _group_send(self, group, body):
+        now = time.time()
+        self._purge_expired(now)
+        # 已满的通道静默跳过，与 channels_redis 的组发送语义一致
+        self._db().execute(
+            'INSERT INTO layer_message (channel, expires, body) '
+            'SELECT g.channel, ?, ? FROM layer_group g WHERE g.grp = ? AND g.expires >= ? '
+            'AND (SELECT COUNT(*) FROM layer_message m WHERE m.channel = g.channel AND m.expires >= ?) < ?',
+            (now + self.expiry, body, group, now, now, self.capacity),
+        )
+
+    def _fetch_prefix(self, prefix):
+        """取出（并删除）发往本进程专属通道的一批消息"""
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._db().execute(
+            'DELETE FROM layer_message WHERE id IN ('
+            'SELECT id FROM layer_message WHERE channel >= ? AND channel < ? ORDER BY id LIMIT ?'
+            ') RETURNING id, channel, expires, body',
+            (prefix, upper, self.batch_size),
+        ).fetchall()
+        rows.sort()
+        return rows
+
+    def _fetch_channel(self, channel):
+        return self._db().execute(
+            'DELETE FROM layer_message WHERE id = ('
+            'SELECT id FROM layer_message WHERE channel = ? ORDER BY id LIMIT 1'
+            ') RETURNING expires, body',
+            (channel,),
+        ).fetchone()
+
+    # 通道层 API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+        sent = await self._run(self._send, channel, dumps(message), self.get_capacity(channel))
+        if not sent:
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        if '!' not in channel:
+            return await self._receive_direct(channel)
+
+        queue = self._buffers.get(channel)
+        if queue is None:
+            queue = self._buffers[channel] = asyncio.Queue()
+        self._ensure_poller(channel[:channel.index('!') + 1])
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            # 连接关闭时释放本地缓冲区，其中尚未取出的消息与之后到达的消息都将被丢弃
+            self._buffers.pop(channel, None)
+            raise
+
+    async def _receive_direct(self, channel):
+        delay = self.poll_interval
+        while True:
+            row = await self._run(self._fetch_channel, channel)
+            if row is not None and row[0] >= time.time():
+                return loads(row[1])
+            if row is None:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval)
+
+    def _ensure_poller(self, prefix):
+        loop = asyncio.get_running_loop()
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+            self._poller = loop.create_task(self._poll(prefix))
+
+    async def _poll(self, prefix):
+        """本进程唯一的轮询任务：没有等待中的本地通道时退出"""
+        delay = self.poll_interval
+        while self._buffers:
+            try:
+                rows = await self._run(self._fetch_prefix, prefix)
+            except sqlite3.Error:
+                # 数据库暂时不可用（如锁超时）：记录日志，等待最长轮询间隔后重试，轮询任务不退出
+                logger.exception('channel_layer_poll_failed', extra={'fields': {'path': self.path}})
+                await asyncio.sleep(self.max_poll_interval)
+                delay = self.poll_interval
+                continue
+            now = time.time()
+            for _, channel, expires, body in rows:
+                queue = self._buffers.get(channel)
+                if queue is not None and expires >= now:
+                    queue.put_nowait(loads(body))
+            if rows:
+                delay = self.poll_interval
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval)
+
+    async def new_channel(self, prefix='specific'):
+        return f'{prefix}.{self.client_prefix}!{uuid.uuid4().hex}'
+
+    # 组扩展
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(
+            lambda: self._db().execute(
+                'INSERT OR REPLACE INTO layer_group (grp, channel, expires) VALUES (?, ?, ?)',
+                (group, channel, time.time() + self.group_expiry),
+            )
+        )
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(
+            lambda: self._db().execute('DELETE FROM layer_group WHERE grp = ? AND channel = ?', (group, channel))
+        )
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        await self._run(self._group_send, group, dumps(message))
+
+    # 清空扩展
+
+    async def flush(self):
+        def flush():
+            db = self._db()
+            db.execute('DELETE FROM layer_message')
+            db.execute('DELETE FROM layer_group')
+        await self._run(flush)
+        for queue in self._buffers.values():
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+        def close():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        await self._run(close)
@@ -0,0 +1,13 @@
+"""结构化日志：将 extra={'fields': {...}} 中的字段以 key=value 形式追加到日志消息后"""
+import logging
+
+
+class KeyValueFormatter(logging.Formatter):
+    """输出形如 `2024-01-01 12:00:00 INFO channel_notify.notifications.consumers websocket_rejected group=fin1 reason=not_in_group`"""
+
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return message
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from channel_notify.notifications.archive import archive_config, archive_notifications
+
+
+class Command(BaseCommand):
+    help = '把创建时间超过指定天数的已确认通知分块移入归档表（历史API仍可查询到）'
+
+    def add_arguments(self, parser):
+        config = archive_config()
+        parser.add_argument('--days', type=int, default=config['AFTER_DAYS'], help='归档创建时间早于多少天的已确认通知')
+        parser.add_argument('--batch-size', type=int, default=config['BATCH_SIZE'], help='每个事务移动的行数')
+
+    def handle(self, *args, **options):
+        moved = archive_notifications(timedelta(days=options['days']), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'已归档 {moved} 条通知'))
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from channel_notify.notifications import jsoncodec
+from channel_notify.notifications.consumers import NotificationConsumer
+from channel_notify.notifications.outbound import DROP_OLDEST, OutboundQueue
+
+
+class Command(BaseCommand):
+    help = '测量一次组广播在接收端的 CPU 开销随组规模的变化（逐连接编码 vs 预序列化帧）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,2000', help='逗号分隔的组规模')
+        parser.add_argument('--rounds', type=int, default=20, help='每种规模重复广播的次数')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        report = async_to_sync(self.run)(sizes, options['rounds'])
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def run(self, sizes, rounds):
+        event = {
+            'type': 'notification_message',
+            'message': {
+                'id': 123456,
+                'content': '请于今天下班前确认本月报销单据，逾期将顺延至下月处理。' * 4,
+                'sender': 'bench_op1_0',
+                'sender_group': 'operations_group_1',
+                'created_at': '2024-01-01T12:00:00.123456+00:00',
+                'status': 'pending',
+            },
+        }
+        results = []
+        for size in sizes:
+            consumers = [self.make_consumer() for _ in range(size)]
+            results.append({
+                'group_size': size,
+                'per_receiver_json_us': await self.measure(consumers, rounds, self.legacy_fanout, event, json.dumps),
+                'per_receiver_fast_us': await self.measure(consumers, rounds, self.legacy_fanout, event, jsoncodec.dumps),
+                'preserialized_us': await self.measure(consumers, rounds, self.frame_fanout, event, jsoncodec.dumps),
+            })
+        return {'json_backend': jsoncodec.BACKEND, 'rounds': rounds, 'cpu_per_broadcast': results}
+
+    @staticmethod
+    def make_consumer():
+        consumer = NotificationConsumer()
+
+        async def base_send(message):
+            pass
+
+        consumer.base_send = base_send
+        consumer.outbound = OutboundQueue(consumer.send_frame, consumer.close, max_frames=1000, policy=DROP_OLDEST)
+        return consumer
+
+    @staticmethod
+    async def legacy_fanout(consumers, event, encode):
+        # 旧实现：每个接收连接各自序列化整个事件
+        for consumer in consumers:
+            await consumer.send(text_data=encode(event))
+
+    @staticmethod
+    async def frame_fanout(consumers, event, encode):
+        # 发送端序列化一次，接收端原样转发
+        layer_event = {'type': event['type'], 'frame': encode(event), 'count': 1}
+        for consumer in consumers:
+            await consumer.forward_frame(layer_event)
+
+    @staticmethod
+    async def measure(consumers, rounds, fanout, event, encode):
+        """返回一次广播的平均 CPU 时间（微秒）"""
+        start = time.process_time()
+        for _ in range(rounds):
+            await fanout(consumers, event, encode)
+            # 让各连接的发送队列写任务把帧写出
+            await asyncio.sleep(0)
+        return (time.process_time() - start) / rounds * 1e6
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.auth import AuthMiddlewareStack
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from channel_notify.notifications.bench import bench_database, seed_clients, login_cookie, measure, percentile
+from channel_notify.notifications.handshake import HandshakeAuthMiddlewareStack, handshake_cache
+from channel_notify.notifications.routing import websocket_urlpatterns
+
+
+class Command(BaseCommand):
+    help = '模拟重连风暴：大量已登录客户端同时重新握手，比较 AuthMiddlewareStack 与握手认证缓存的握手速率，输出JSON报告'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='同时重连的客户端数')
+        parser.add_argument('--rounds', type=int, default=3, help='重连风暴的轮数（第一轮握手缓存为冷缓存）')
+        parser.add_argument('--concurrency', type=int, default=200, help='同时进行中的握手数')
+        parser.add_argument('--on-disk', action='store_true', help='使用文件 SQLite 库（默认内存库）')
+
+    def handle(self, *args, **options):
+        with bench_database(on_disk=options['on_disk']):
+            (_, fin_users, _, fin_group), = seed_clients(1, 0, options['clients'])
+            cookies = [login_cookie(user) for user in fin_users]
+            report = {
+                'clients': len(cookies),
+                'rounds': options['rounds'],
+                'concurrency': options['concurrency'],
+                'auth_middleware_stack': async_to_sync(self.run)(
+                    AuthMiddlewareStack(URLRouter(websocket_urlpatterns)), fin_group.name, cookies, options
+                ),
+            }
+            handshake_cache.clear()
+            report['handshake_cache'] = async_to_sync(self.run)(
+                HandshakeAuthMiddlewareStack(URLRouter(websocket_urlpatterns)), fin_group.name, cookies, options
+            )
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def run(self, application, group_name, cookies, options):
+        concurrency = asyncio.Semaphore(options['concurrency'])
+        latencies = []
+
+        async def handshake(cookie):
+            async with concurrency:
+                communicator = WebsocketCommunicator(application, f'/ws/notifications/{group_name}/', headers=[cookie])
+                start = time.perf_counter()
+                connected, code = await communicator.connect(timeout=60)
+                if not connected:
+                    raise RuntimeError(f'握手失败: {code}')
+                await communicator.receive_from(timeout=60)
+                latencies.append(time.perf_counter() - start)
+                return communicator
+
+        rounds = []
+        for _ in range(options['rounds']):
+            latencies.clear()
+            with measure() as totals:
+                communicators = await asyncio.gather(*(handshake(cookie) for cookie in cookies))
+            # 断开不计入握手时间：风暴中客户端的旧连接早已断开
+            await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+            rounds.append({
+                'seconds': totals['elapsed'],
+                'handshakes_per_sec': len(cookies) / totals['elapsed'],
+                'queries_per_handshake': totals['queries'] / len(cookies),
+                'app_hops_per_handshake': totals['app_hops'] / len(cookies),
+                'latency_ms': {
+                    name: percentile(latencies, pct) * 1000 for name, pct in (('p50', 50), ('p99', 99), ('max', 100))
+                },
+            })
+        return rounds
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connections
+from django.db.models import Q
+
+from channel_notify.notifications.bench import bench_database, seed_pairs, percentile
+from channel_notify.notifications.models import Notification
+from channel_notify.notifications.views import received_page_queryset
+
+
+class Command(BaseCommand):
+    help = '在文件数据库上并发执行历史查询与通知写入，测量当前数据库配置档（DATABASE_PROFILE）下的读写吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='并发执行历史查询的线程数')
+        parser.add_argument('--writers', type=int, default=4, help='并发写入通知的线程数')
+        parser.add_argument('--seconds', type=float, default=3, help='测量时长（秒）')
+        parser.add_argument('--rows', type=int, default=5000, help='预先写入的历史通知数')
+
+    def handle(self, *args, **options):
+        with bench_database(on_disk=True):
+            ops_users, _, ops_group, fin_group = seed_pairs()[0]
+            Notification.objects.bulk_create([
+                Notification(content=f'history {i}', sender=ops_users[0], sender_group=ops_group, receiver_group=fin_group)
+                for i in range(options['rows'])
+            ])
+            with connections['default'].cursor() as cursor:
+                journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            connections.close_all()
+            report = self.run(ops_users[0], ops_group, fin_group, options)
+        self.stdout.write(json.dumps(dict(profile=settings.DATABASE_PROFILE, journal_mode=journal_mode, **report), indent=2))
+
+    def run(self, sender, ops_group, fin_group, options):
+        using = settings.NOTIFY_HISTORY_DATABASE
+        deadline = time.perf_counter() + options['seconds']
+        latencies = {'reads': [], 'writes': []}
+        errors = {'reads': 0, 'writes': 0}
+        lock = threading.Lock()
+
+        def read():
+            list(received_page_queryset([fin_group.id], Q(), None, 50, using))
+
+        def write():
+            Notification.objects.create(
+                content='bench write', sender=sender, sender_group=ops_group, receiver_group=fin_group
+            )
+
+        def worker(kind, operation):
+            # 每次操作前后与消费者的线程池调用一样清理过期连接，CONN_MAX_AGE=0 时每次都会新建连接
+            samples, failed = [], 0
+            while time.perf_counter() < deadline:
+                close_old_connections()
+                start = time.perf_counter()
+                try:
+                    operation()
+                except OperationalError:
+                    failed += 1
+                else:
+                    samples.append(time.perf_counter() - start)
+                close_old_connections()
+            connections.close_all()
+            with lock:
+                latencies[kind] += samples
+                errors[kind] += failed
+
+        threads = (
+            [threading.Thread(target=worker, args=('reads', read)) for _ in range(options['readers'])]
+            + [threading.Thread(target=worker, args=('writes', write)) for _ in range(options['writers'])]
+        )
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return {
+            kind: {
+                'threads': options['readers'] if kind == 'reads' else options['writers'],
+                'per_sec': len(samples) / elapsed,
+                'errors': errors[kind],
+                'latency_ms': {
+                    'p50': percentile(samples, 50) * 1000 if samples else None,
+                    'p99': percentile(samples, 99) * 1000 if samples else None,
+                },
+            }
+            for kind, samples in latencies.items()
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+from channel_notify.notifications import consumers
+from channel_notify.notifications.consumers import NotificationConsumer
+from channel_notify.notifications.fanout import LocalFanout
+from channel_notify.notifications.outbound import DROP_OLDEST, OutboundQueue
+
+
+class Command(BaseCommand):
+    help = '一次组广播扇出到大量本地订阅者的耗时：逐连接加入频道层的组 vs 进程内扇出（NOTIFY_LOCAL_FANOUT），输出JSON报告'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10000, help='本进程中订阅同一组的连接数')
+        parser.add_argument(
+            '--baseline-subscribers', type=int, default=2000,
+            help='逐连接订阅（对照组）的连接数，0 为不运行；内存频道层每次接收都要遍历全部频道清理过期消息，'
+                 '一次广播的耗时随连接数平方增长，10000 个连接时整个对照组需要运行很长时间'
+        )
+        parser.add_argument('--rounds', type=int, default=5, help='广播次数')
+
+    def handle(self, *args, **options):
+        report = {'rounds': options['rounds']}
+        modes = [('local_fanout', True, options['subscribers'])]
+        if options['baseline_subscribers']:
+            modes.insert(0, ('channel_layer', False, options['baseline_subscribers']))
+        original = consumers.local_fanout
+        try:
+            for mode, enabled, subscribers in modes:
+                consumers.local_fanout = LocalFanout(enabled)
+                report[mode] = async_to_sync(self.run)(subscribers, options['rounds'])
+        finally:
+            consumers.local_fanout = original
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def run(self, subscribers, rounds):
+        layer = get_channel_layer()
+        written = [0]
+        all_written = asyncio.Event()
+
+        async def base_send(message):
+            # 模拟 WebSocket 写出：统计写出的帧数，本轮全部连接都写出后结束计时
+            written[0] += 1
+            if written[0] == subscribers:
+                all_written.set()
+
+        # 订阅连接为真实的 NotificationConsumer，只替换 ASGI 发送端；逐连接模式下各连接与 channels 一样
+        # 在自己的任务中接收频道层消息并分发给处理器
+        receivers = []
+        for _ in range(subscribers):
+            consumer = NotificationConsumer()
+            consumer.base_send = base_send
+            consumer.channel_layer = layer
+            consumer.channel_name = await layer.new_channel()
+            consumer.accepted = True
+            consumer.outbound = OutboundQueue(consumer.send_frame, consumer.close, max_frames=1000, policy=DROP_OLDEST)
+            receivers.append(consumer)
+
+        async def dispatch_loop(consumer):
+            while True:
+                await consumer.dispatch(await layer.receive(consumer.channel_name))
+
+        start = time.perf_counter()
+        for consumer in receivers:
+            await consumer.add_to_group('finance_group_1')
+        subscribe_seconds = time.perf_counter() - start
+        loops = [] if consumers.local_fanout.enabled else [asyncio.ensure_future(dispatch_loop(c)) for c in receivers]
+
+        sender = NotificationConsumer()
+        sender.channel_layer = layer
+        event = {
+            'type': 'notification_message',
+            'message': {
+                'id': 123456,
+                'content': '请于今天下班前确认本月报销单据，逾期将顺延至下月处理。',
+                'sender': 'bench_op1_0',
+                'sender_group': 'operations_group_1',
+                'receiver_group': 'finance_group_1',
+                'created_at': '2024-01-01T12:00:00.123456+00:00',
+                'status': 'pending',
+            },
+        }
+        latencies, cpu = [], []
+        for _ in range(rounds):
+            written[0] = 0
+            all_written.clear()
+            start, cpu_start = time.perf_counter(), time.process_time()
+            await sender.broadcast('finance_group_1', event)
+            await all_written.wait()
+            latencies.append(time.perf_counter() - start)
+            cpu.append(time.process_time() - cpu_start)
+
+        for task in loops:
+            task.cancel()
+        for consumer in receivers:
+            await consumer.discard_from_group('finance_group_1')
+        if consumers.local_fanout.task is not None:
+            consumers.local_fanout.task.cancel()
+        return {
+            'subscribers': subscribers,
+            'subscribe_seconds': subscribe_seconds,
+            'layer_deliveries_per_broadcast': 1 if consumers.local_fanout.enabled else subscribers,
+            'broadcast_ms': {
+                'p50': statistics.median(latencies) * 1000,
+                'max': max(latencies) * 1000,
+            },
+            'cpu_ms_per_broadcast': statistics.mean(cpu) * 1000,
+            'us_per_subscriber': statistics.median(latencies) / subscribers * 1e6,
+            'frames_per_second': subscribers * rounds / sum(latencies),
+        }
@@ -0,0 +1,79 @@
+import asyncio
+import gc
+import json
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.core.management.base import BaseCommand
+
+from channel_notify.notifications.bench import bench_database, login_cookie, measure
+from channel_notify.notifications.handshake import handshake_cache
+
+
+class Command(BaseCommand):
+    help = '比较每组一个 WebSocket 与多路复用连接（ws/notifications/）的连接数、握手开销与内存占用，输出JSON报告'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='在线用户数')
+        parser.add_argument('--groups', type=int, default=3, help='每个用户所属的组数')
+        parser.add_argument('--concurrency', type=int, default=100, help='同时进行中的握手数')
+
+    def handle(self, *args, **options):
+        from channel_notify.asgi import application
+
+        with bench_database():
+            groups = [Group.objects.create(name=f'finance_group_{n}') for n in range(1, options['groups'] + 1)]
+            password = make_password(None)
+            users = User.objects.bulk_create([
+                User(username=f'multi_fin_{i}', password=password) for i in range(options['users'])
+            ])
+            Membership = User.groups.through
+            Membership.objects.bulk_create([
+                Membership(user_id=user.id, group_id=group.id) for user in users for group in groups
+            ])
+            cookies = [login_cookie(user) for user in users]
+            group_names = [group.name for group in groups]
+            report = {'users': len(users), 'groups_per_user': len(groups)}
+            for mode, paths in (
+                ('per_group', [f'/ws/notifications/{name}/' for name in group_names]),
+                ('multiplexed', ['/ws/notifications/']),
+            ):
+                handshake_cache.clear()
+                report[mode] = async_to_sync(self.run)(application, cookies, paths, options['concurrency'])
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def run(self, application, cookies, paths, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def connect(cookie, path):
+            async with semaphore:
+                communicator = WebsocketCommunicator(
+                    application, path, headers=[cookie, (b'origin', b'http://localhost'), (b'host', b'localhost')]
+                )
+                connected, code = await communicator.connect(timeout=60)
+                if not connected:
+                    raise RuntimeError(f'连接 {path} 失败: {code}')
+                await communicator.receive_from(timeout=60)
+                return communicator
+
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        with measure() as totals:
+            communicators = await asyncio.gather(*(connect(cookie, path) for cookie in cookies for path in paths))
+        gc.collect()
+        # 包含消费者、发送队列、频道层组成员关系与测试通信器本身，两种模式下通信器开销相同
+        held = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+        return {
+            'connections': len(communicators),
+            'connect_seconds': totals['elapsed'],
+            'queries': totals['queries'],
+            'queries_per_user': totals['queries'] / len(cookies),
+            'memory_bytes': held,
+            'memory_bytes_per_user': held / len(cookies),
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from channel_notify.notifications.bench import bench_database, seed_clients, login_cookie, measure, percentile
+from channel_notify.notifications.jsoncodec import loads
+
+
+class BenchClient:
+    """一个已认证的 WebSocket 压测客户端：后台任务持续读取帧，投递事件计入延迟，其余帧作为请求回执排队"""
+
+    def __init__(self, application, group_name, cookie, on_delivery):
+        self.group_name = group_name
+        self.communicator = WebsocketCommunicator(
+            application, f'/ws/notifications/{group_name}/',
+            headers=[cookie, (b'origin', b'http://localhost'), (b'host', b'localhost')],
+        )
+        self.replies = asyncio.Queue()
+        self.on_delivery = on_delivery
+        self.reader = None
+
+    async def connect(self):
+        connected, code = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise RuntimeError(f'连接 {self.group_name} 失败: {code}')
+        await self.communicator.receive_from(timeout=30)
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        while True:
+            frame = loads(await self.communicator.receive_from(timeout=3600))
+            kind = frame['type']
+            if kind == 'notification_message':
+                self.on_delivery(frame['message'])
+            elif kind == 'notification_batch':
+                for message in frame['messages']:
+                    self.on_delivery(message)
+            elif kind == 'notification_confirmed' and 'receiver_group' in frame['message']:
+                # 发送组收到的确认广播
+                pass
+            else:
+                self.replies.put_nowait(frame)
+
+    async def request(self, payload):
+        await self.communicator.send_json_to(payload)
+        return await asyncio.wait_for(self.replies.get(), 30)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+class Command(BaseCommand):
+    help = '在进程内启动完整的 ASGI 应用，用大量已认证的 WebSocket 客户端压测发送/确认流程，输出JSON报告'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=2, help='运营组/财务组的对数')
+        parser.add_argument('--clients', type=int, default=1000, help='财务组接收客户端总数（平均分配到各财务组）')
+        parser.add_argument('--senders', type=int, default=2, help='每个运营组的发送客户端数')
+        parser.add_argument('--messages', type=int, default=50, help='发送的通知总数')
+        parser.add_argument('--confirm-ratio', type=float, default=0.5, help='被确认的通知比例（0~1）')
+        parser.add_argument('--concurrency', type=int, default=20, help='同时进行中的发送/确认/连接请求数')
+
+    def handle(self, *args, **options):
+        from channel_notify.asgi import application
+
+        with bench_database():
+            receivers_per_group = max(1, options['clients'] // options['pairs'])
+            seeded = seed_clients(options['pairs'], options['senders'], receivers_per_group)
+            cookies = {
+                user.id: login_cookie(user)
+                for ops_users, fin_users, _, _ in seeded
+                for user in ops_users + fin_users
+            }
+            report = async_to_sync(self.run)(application, seeded, cookies, options)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def run(self, application, seeded, cookies, options):
+        concurrency = asyncio.Semaphore(options['concurrency'])
+        # 通知ID在发送回执前未知，因此发送端按序号记录时间，接收端用内容中的序号匹配
+        sent_at = {}
+        latencies = []
+
+        def on_delivery(message):
+            seq = int(message['content'].rsplit(':', 1)[1])
+            latencies.append(time.perf_counter() - sent_at[seq])
+
+        senders, receivers = [], {}
+        for ops_users, fin_users, ops_group, fin_group in seeded:
+            senders += [BenchClient(application, ops_group.name, cookies[user.id], on_delivery) for user in ops_users]
+            receivers[fin_group.name] = [
+                BenchClient(application, fin_group.name, cookies[user.id], on_delivery) for user in fin_users
+            ]
+        clients = senders + [client for group_clients in receivers.values() for client in group_clients]
+
+        async def limited(coroutine):
+            async with concurrency:
+                return await coroutine
+
+        # 连接阶段
+        with measure() as connect_totals:
+            await asyncio.gather(*(limited(client.connect()) for client in clients))
+
+        # 发送阶段
+        messages = options['messages']
+        expected = sum(len(receivers[client_group]) for client_group in self.targets(senders, seeded, messages))
+        sent = []
+
+        async def send(seq):
+            client = senders[seq % len(senders)]
+            sent_at[seq] = time.perf_counter()
+            reply = await client.request({'type': 'send_notification', 'content': f'bench:{seq}'})
+            if reply['type'] != 'notification_sent':
+                raise RuntimeError(f'发送失败: {reply}')
+            sent.append(reply['message'])
+
+        with measure() as send_totals:
+            await asyncio.gather(*(limited(send(seq)) for seq in range(messages)))
+            deadline = time.perf_counter() + 60
+            while len(latencies) < expected and time.perf_counter() < deadline:
+                await asyncio.sleep(0.01)
+
+        # 确认阶段：由接收组的第一个客户端确认
+        to_confirm = sent[:int(len(sent) * options['confirm_ratio'])]
+        confirm_latencies = []
+
+        async def confirm(message):
+            client = receivers[message['receiver_group']][0]
+            start = time.perf_counter()
+            reply = await client.request({'type': 'confirm_notification', 'notification_id': message['id']})
+            if reply['type'] != 'notification_confirmed':
+                raise RuntimeError(f'确认失败: {reply}')
+            confirm_latencies.append(time.perf_counter() - start)
+
+        with measure() as confirm_totals:
+            await asyncio.gather(*(limited(confirm(message)) for message in to_confirm))
+
+        for client in clients:
+            await client.close()
+
+        return {
+            'clients': len(clients),
+            'groups': len(seeded) * 2,
+            'connect': {
+                'seconds': connect_totals['elapsed'],
+                'per_sec': len(clients) / connect_totals['elapsed'],
+                'queries_per_connect': connect_totals['queries'] / len(clients),
+            },
+            'send': {
+                'messages': messages,
+                'deliveries': len(latencies),
+                'expected_deliveries': expected,
+                'seconds': send_totals['elapsed'],
+                'sends_per_sec': messages / send_totals['elapsed'],
+                'deliveries_per_sec': len(latencies) / send_totals['elapsed'],
+                'queries_per_send': send_totals['queries'] / max(messages, 1),
+                'app_hops_per_send': send_totals['app_hops'] / max(messages, 1),
+                # channels 每处理一帧都会经线程池调用一次 close_old_connections，投递到客户端的每条消息都要付出这一跳
+                'framework_hops_per_delivery': (send_totals['hops'] - send_totals['app_hops']) / max(len(latencies), 1),
+                'delivery_latency_ms': self.latency_summary(latencies),
+            },
+            'confirm': {
+                'confirms': len(to_confirm),
+                'seconds': confirm_totals['elapsed'],
+                'confirms_per_sec': len(to_confirm) / confirm_totals['elapsed'] if to_confirm else 0,
+                'queries_per_confirm': confirm_totals['queries'] / max(len(to_confirm), 1),
+                'round_trip_latency_ms': self.latency_summary(confirm_latencies),
+            },
+        }
+
+    @staticmethod
+    def targets(senders, seeded, messages):
+        """每条通知的接收组（运营组 N 按路由发送给财务组 N）"""
+        receiver_of = {ops_group.name: fin_group.name for _, _, ops_group, fin_group in seeded}
+        return [receiver_of[senders[seq % len(senders)].group_name] for seq in range(messages)]
+
+    @staticmethod
+    def latency_summary(samples):
+        return {
+            name: (percentile(samples, pct) * 1000 if samples else None)
+            for name, pct in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+        }
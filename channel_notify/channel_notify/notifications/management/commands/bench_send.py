@@ -0,0 +1,100 @@
+import asyncio
+import json
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from channel_notify.notifications.bench import bench_database, seed_pairs, measure, percentile, SimulatedLatency
+from channel_notify.notifications import consumers
+from channel_notify.notifications.consumers import NotificationConsumer
+from channel_notify.notifications.writebehind import WriteBehind
+
+
+class Command(BaseCommand):
+    help = '测量通知发送路径的线程池跳转次数、SQL 查询数、延迟，以及吞吐量随并发发送者数和数据库线程数的变化'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='每种配置发送的通知总数')
+        parser.add_argument('--senders', default='1', help='逗号分隔的并发发送连接数，如 1,4,16')
+        parser.add_argument('--threads', default='0', help='逗号分隔的 NOTIFY_DB_THREADS 取值，0 表示 thread_sensitive 单线程')
+        parser.add_argument('--write-behind', action='store_true', help='同时测量写后模式（日志 fsync + 后台批量写入）')
+        parser.add_argument('--db-latency', type=float, default=0, help='模拟的每条 SQL 往返延迟（毫秒），用于估计网络数据库下的表现')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        senders = [int(n) for n in options['senders'].split(',')]
+        threads = [int(n) for n in options['threads'].split(',')]
+        results = []
+        modes = (False, True) if options['write_behind'] else (False,)
+        # 写后模式的对比需要真实的提交 fsync，因此使用文件数据库
+        with bench_database(on_disk=any(threads) or options['write_behind']):
+            ops_users, _, ops_group, fin_group = seed_pairs(users_per_group=max(senders))[0]
+            with SimulatedLatency(options['db_latency'] / 1000):
+                for write_behind in modes:
+                    results += self.run_matrix(ops_users, ops_group, fin_group, count, senders, threads, write_behind)
+        self.stdout.write(json.dumps(results[0] if len(results) == 1 else results, indent=2))
+
+    def run_matrix(self, ops_users, ops_group, fin_group, count, senders, threads, write_behind=False):
+        results = []
+        for db_threads in threads:
+            with override_settings(NOTIFY_DB_THREADS=db_threads):
+                for n in senders:
+                    with tempfile.TemporaryDirectory() as journal_dir:
+                        original = consumers.write_behind
+                        consumers.write_behind = WriteBehind(enabled=write_behind, journal_dir=journal_dir)
+                        try:
+                            report = async_to_sync(self.run)(ops_users[:n], ops_group.name, fin_group.name, count)
+                        finally:
+                            consumers.write_behind = original
+                    results.append(dict(write_behind=write_behind, db_threads=db_threads, senders=n, **report))
+        return results
+
+    async def connect(self, user, group_name):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/{group_name}/')
+        communicator.scope['url_route'] = {'kwargs': {'group_name': group_name}}
+        communicator.scope['user'] = user
+        await communicator.connect()
+        await communicator.receive_json_from()
+        return communicator
+
+    async def run(self, users, sender_group_name, receiver_group_name, count):
+        communicators = [await self.connect(user, sender_group_name) for user in users]
+        per_sender = count // len(communicators)
+        latencies = []
+
+        async def drive(communicator):
+            for i in range(per_sender):
+                start = time.perf_counter()
+                await communicator.send_json_to({
+                    'type': 'send_notification',
+                    'content': f'bench {i}',
+                    'receiver_group': receiver_group_name,
+                })
+                response = await communicator.receive_json_from(timeout=30)
+                latencies.append(time.perf_counter() - start)
+                if response['type'] != 'notification_sent':
+                    raise RuntimeError(f'发送失败: {response}')
+
+        with measure() as totals:
+            await asyncio.gather(*(drive(communicator) for communicator in communicators))
+            # 写后模式的吞吐量包含把缓冲全部写入数据库的时间
+            await consumers.write_behind.close()
+        for communicator in communicators:
+            await communicator.disconnect()
+
+        sends = per_sender * len(communicators)
+        return {
+            'sends': sends,
+            'hops_per_send': totals['hops'] / sends,
+            'app_hops_per_send': totals['app_hops'] / sends,
+            'queries_per_send': totals['queries'] / sends,
+            'sends_per_sec': sends / totals['elapsed'],
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+            },
+        }
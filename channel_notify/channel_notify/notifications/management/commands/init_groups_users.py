@@ -1,35 +1,40 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User, Group
+from channel_notify.notifications.models import GroupRoute
 
 class Command(BaseCommand):
-    help = '初始化通知系统所需的组和用户'
+    help = '初始化通知系统所需的组、组间路由和用户'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=2, help='创建的运营组/财务组对数')
 
     def handle(self, *args, **kwargs):
-        # 创建组
+        # 创建组及组间路由
         self.stdout.write('正在创建组...')
-        operations_group_1, created = Group.objects.get_or_create(name='operations_group_1')
-        if created:
-            self.stdout.write(self.style.SUCCESS(f'创建运营一组: {operations_group_1.name}'))
-        else:
-            self.stdout.write(self.style.WARNING(f'运营一组已存在: {operations_group_1.name}'))
-        
-        operations_group_2, created = Group.objects.get_or_create(name='operations_group_2')
-        if created:
-            self.stdout.write(self.style.SUCCESS(f'创建运营二组: {operations_group_2.name}'))
-        else:
-            self.stdout.write(self.style.WARNING(f'运营二组已存在: {operations_group_2.name}'))
-        
-        finance_group_1, created = Group.objects.get_or_create(name='finance_group_1')
-        if created:
-            self.stdout.write(self.style.SUCCESS(f'创建财务一组: {finance_group_1.name}'))
-        else:
-            self.stdout.write(self.style.WARNING(f'财务一组已存在: {finance_group_1.name}'))
+        groups = {}
+        # 演示用户依赖前两对组，因此至少创建两对
+        pairs = max(kwargs.get('pairs', 2), 2)
+        for n in range(1, pairs + 1):
+            for prefix, label in (('operations', '运营'), ('finance', '财务')):
+                group, created = Group.objects.get_or_create(name=f'{prefix}_group_{n}')
+                groups[group.name] = group
+                if created:
+                    self.stdout.write(self.style.SUCCESS(f'创建{label}{n}组: {group.name}'))
+                else:
+                    self.stdout.write(self.style.WARNING(f'{label}{n}组已存在: {group.name}'))
+            
+            route, created = GroupRoute.objects.get_or_create(
+                sender_group=groups[f'operations_group_{n}'],
+                receiver_group=groups[f'finance_group_{n}'],
+                defaults={'bidirectional': True}
+            )
+            if created:
+                self.stdout.write(self.style.SUCCESS(f'创建组路由: {route}'))
         
-        finance_group_2, created = Group.objects.get_or_create(name='finance_group_2')
-        if created:
-            self.stdout.write(self.style.SUCCESS(f'创建财务二组: {finance_group_2.name}'))
-        else:
-            self.stdout.write(self.style.WARNING(f'财务二组已存在: {finance_group_2.name}'))
+        operations_group_1 = groups['operations_group_1']
+        operations_group_2 = groups['operations_group_2']
+        finance_group_1 = groups['finance_group_1']
+        finance_group_2 = groups['finance_group_2']
         
         # 创建用户
         self.stdout.write('\n正在创建用户...')
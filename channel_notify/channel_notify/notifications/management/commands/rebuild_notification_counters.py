@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from channel_notify.notifications.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = '按通知表重新计算待确认计数（其他工作进程的计数缓存在 NOTIFY_COUNTER_CACHE_TTL 秒后更新）'
+
+    def handle(self, *args, **options):
+        rows = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f'已重建 {rows} 个计数'))
@@ -0,0 +1,236 @@
+"""进程内的轻量级指标：各阶段耗时直方图、按组的活跃连接数与消息计数，以 Prometheus 文本格式导出
+
+通过 settings.NOTIFY_METRICS_ENABLED 开启；关闭时 timed() 包装的函数只多一次属性判断。
+指标按进程统计，多进程部署时由 Prometheus 分别抓取各工作进程后聚合。
+"""
+import bisect
+import functools
+import threading
+import time
+
+from django.conf import settings
+
+# 直方图桶上界（秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# 发送队列深度直方图的桶上界（帧）
+DEPTH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# 消息速率统计窗口（秒）
+RATE_WINDOW = 60
+
+
+def label(value):
+    """转义 Prometheus 标签值中的反斜杠、双引号与换行（组名来自用户数据）"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """固定桶的直方图，桶计数非累积存储，导出时再累加"""
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    """指标注册表，所有更新在锁内完成（事件循环线程与数据库线程都会写入）"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.connections = {}
+            self.messages = {}
+            self._rate = {}
+            self.outbound_depth = Histogram(DEPTH_BUCKETS)
+            self.outbound_queued = 0
+            self.outbound_overflows = {}
+            self.handshakes = {}
+            self.reaped = 0
+
+    def observe(self, stage, seconds):
+        """记录某阶段一次耗时"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def connection_opened(self, group_name):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.connections[group_name] = self.connections.get(group_name, 0) + 1
+
+    def connection_closed(self, group_name):
+        if not self.enabled:
+            return
+        with self._lock:
+            remaining = self.connections.get(group_name, 0) - 1
+            if remaining > 0:
+                self.connections[group_name] = remaining
+            else:
+                self.connections.pop(group_name, None)
+
+    def count_messages(self, kind, n=1):
+        """累加消息计数（sent / confirmed / delivered / throttled / flushed / rejected），并计入该类的每秒速率窗口"""
+        if not self.enabled or not n:
+            return
+        second = int(time.monotonic())
+        with self._lock:
+            self.messages[kind] = self.messages.get(kind, 0) + n
+            rate = self._rate.setdefault(kind, {})
+            rate[second] = rate.get(second, 0) + n
+            if len(rate) > RATE_WINDOW:
+                for stale in [s for s in rate if s <= second - RATE_WINDOW]:
+                    del rate[stale]
+
+    def outbound_enqueued(self, depth):
+        """连接发送队列入队一帧，depth 为入队后的队列深度"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.outbound_depth.observe(depth)
+            self.outbound_queued += 1
+
+    def outbound_removed(self, n):
+        """n 帧离开发送队列（已发送、被合并、被丢弃或连接关闭）"""
+        if not self.enabled or not n:
+            return
+        with self._lock:
+            self.outbound_queued -= n
+
+    def outbound_overflow(self, policy):
+        """发送队列已满，按 policy（coalesce / drop_oldest / disconnect）处理了一次"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.outbound_overflows[policy] = self.outbound_overflows.get(policy, 0) + 1
+
+    def handshake(self, result):
+        """一次 WebSocket 握手认证，result 为 hit（命中会话缓存）或 miss（读取了会话与数据库）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.handshakes[result] = self.handshakes.get(result, 0) + 1
+
+    def connection_reaped(self):
+        """心跳超时回收了一个连接"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.reaped += 1
+
+    def message_rates(self):
+        """最近 RATE_WINDOW 秒内各类消息的平均数/秒，{类型: 速率}"""
+        cutoff = int(time.monotonic()) - RATE_WINDOW
+        with self._lock:
+            return {
+                kind: sum(n for s, n in rate.items() if s > cutoff) / RATE_WINDOW
+                for kind, rate in self._rate.items()
+            }
+
+    def render(self):
+        """以 Prometheus 文本格式（0.0.4）导出全部指标"""
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.total, h.count) for stage, h in self.histograms.items()}
+            connections = dict(self.connections)
+            messages = dict(self.messages)
+            depth = (list(self.outbound_depth.counts), self.outbound_depth.total, self.outbound_depth.count)
+            queued = self.outbound_queued
+            overflows = dict(self.outbound_overflows)
+            handshakes = dict(self.handshakes)
+            reaped = self.reaped
+        lines = [
+            '# HELP notify_stage_seconds 各处理阶段耗时',
+            '# TYPE notify_stage_seconds histogram',
+        ]
+        for stage, (counts, total, count) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f'notify_stage_seconds_bucket{{stage="{label(stage)}",le="{bound}"}} {cumulative}')
+            lines.append(f'notify_stage_seconds_sum{{stage="{label(stage)}"}} {total}')
+            lines.append(f'notify_stage_seconds_count{{stage="{label(stage)}"}} {count}')
+        lines += [
+            '# HELP notify_active_connections 按组统计的活跃 WebSocket 连接数',
+            '# TYPE notify_active_connections gauge',
+        ]
+        for group_name, n in sorted(connections.items()):
+            lines.append(f'notify_active_connections{{group="{label(group_name)}"}} {n}')
+        lines += [
+            '# HELP notify_messages_total 处理的消息总数',
+            '# TYPE notify_messages_total counter',
+        ]
+        for kind, n in sorted(messages.items()):
+            lines.append(f'notify_messages_total{{kind="{label(kind)}"}} {n}')
+        counts, total, count = depth
+        lines += [
+            '# HELP notify_outbound_queue_depth 入队时连接发送队列的深度',
+            '# TYPE notify_outbound_queue_depth histogram',
+        ]
+        cumulative = 0
+        for bound, n in zip(DEPTH_BUCKETS + ('+Inf',), counts):
+            cumulative += n
+            lines.append(f'notify_outbound_queue_depth_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f'notify_outbound_queue_depth_sum {total}',
+            f'notify_outbound_queue_depth_count {count}',
+            '# HELP notify_outbound_queued 全部连接发送队列中待发送的帧数',
+            '# TYPE notify_outbound_queued gauge',
+            f'notify_outbound_queued {queued}',
+            '# HELP notify_outbound_overflow_total 发送队列溢出次数（按处理策略）',
+            '# TYPE notify_outbound_overflow_total counter',
+        ]
+        for policy, n in sorted(overflows.items()):
+            lines.append(f'notify_outbound_overflow_total{{policy="{label(policy)}"}} {n}')
+        lines += [
+            '# HELP notify_handshakes_total WebSocket 握手认证次数（按会话缓存是否命中）',
+            '# TYPE notify_handshakes_total counter',
+        ]
+        for result, n in sorted(handshakes.items()):
+            lines.append(f'notify_handshakes_total{{result="{label(result)}"}} {n}')
+        lines += [
+            '# HELP notify_reaped_connections_total 心跳超时被回收的连接数',
+            '# TYPE notify_reaped_connections_total counter',
+            f'notify_reaped_connections_total {reaped}',
+            f'# HELP notify_messages_per_second 最近{RATE_WINDOW}秒各类消息的平均速率',
+            '# TYPE notify_messages_per_second gauge',
+        ]
+        for kind, rate in sorted(self.message_rates().items()):
+            lines.append(f'notify_messages_per_second{{kind="{label(kind)}"}} {rate}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(enabled=getattr(settings, 'NOTIFY_METRICS_ENABLED', False))
+
+
+def timed(stage):
+    """记录异步函数耗时的装饰器；指标关闭时直接调用原函数"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                metrics.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# 原先在代码中硬编码的组对应关系
+LEGACY_ROUTES = [
+    ('operations_group_1', 'finance_group_1'),
+    ('operations_group_2', 'finance_group_2'),
+]
+
+
+def seed_legacy_routes(apps, schema_editor):
+    """为已存在的组写入原有的双向路由"""
+    Group = apps.get_model('auth', 'Group')
+    GroupRoute = apps.get_model('notifications', 'GroupRoute')
+    groups = dict(Group.objects.filter(
+        name__in=[name for pair in LEGACY_ROUTES for name in pair]
+    ).values_list('name', 'id'))
+    for sender_name, receiver_name in LEGACY_ROUTES:
+        if sender_name in groups and receiver_name in groups:
+            GroupRoute.objects.get_or_create(
+                sender_group_id=groups[sender_name],
+                receiver_group_id=groups[receiver_name],
+                defaults={'bidirectional': True},
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupRoute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bidirectional', models.BooleanField(default=True, verbose_name='双向路由')),
+                ('receiver_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='incoming_routes', to='auth.group', verbose_name='接收组')),
+                ('sender_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outgoing_routes', to='auth.group', verbose_name='发送组')),
+            ],
+            options={
+                'verbose_name': '组路由',
+                'verbose_name_plural': '组路由',
+                'constraints': [models.UniqueConstraint(fields=('sender_group', 'receiver_group'), name='unique_group_route')],
+            },
+        ),
+        migrations.RunPython(seed_legacy_routes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('notifications', '0004_notification_replay_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedNotification',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='通知ID')),
+                ('content', models.TextField(verbose_name='通知内容')),
+                ('status', models.CharField(choices=[('pending', '待确认'), ('confirmed', '已确认')], default='confirmed', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(verbose_name='创建时间')),
+                ('confirmed_at', models.DateTimeField(blank=True, null=True, verbose_name='确认时间')),
+                ('confirmed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_confirmed_notifications', to=settings.AUTH_USER_MODEL, verbose_name='确认者')),
+                ('receiver_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_received_notifications', to='auth.group', verbose_name='接收者组')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_sent_notifications', to=settings.AUTH_USER_MODEL, verbose_name='发送者')),
+                ('sender_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_sent_notifications', to='auth.group', verbose_name='发送者组')),
+            ],
+            options={
+                'verbose_name': '归档通知',
+                'verbose_name_plural': '归档通知',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['receiver_group', 'created_at'], name='archive_receiver_created_idx'), models.Index(fields=['sender', 'created_at'], name='archive_sender_created_idx'), models.Index(fields=['created_at'], name='archive_created_idx')],
+            },
+        ),
+    ]
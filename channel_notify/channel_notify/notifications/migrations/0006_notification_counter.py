@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:31
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    """按现有的待确认通知初始化计数"""
+    Notification = apps.get_model('notifications', 'Notification')
+    NotificationCounter = apps.get_model('notifications', 'NotificationCounter')
+    pending = Notification.objects.filter(status='pending')
+    counters = [
+        NotificationCounter(scope='group', owner_id=row['receiver_group_id'], pending=row['n'])
+        for row in pending.values('receiver_group_id').annotate(n=Count('id')).order_by()
+    ] + [
+        NotificationCounter(scope='user', owner_id=row['sender_id'], pending=row['n'])
+        for row in pending.values('sender_id').annotate(n=Count('id')).order_by()
+    ]
+    NotificationCounter.objects.bulk_create(counters, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_archived_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('group', '组'), ('user', '用户')], max_length=10, verbose_name='范围')),
+                ('owner_id', models.BigIntegerField(verbose_name='组或用户ID')),
+                ('pending', models.IntegerField(default=0, verbose_name='待确认数')),
+            ],
+            options={
+                'verbose_name': '待确认计数',
+                'verbose_name_plural': '待确认计数',
+                'constraints': [models.UniqueConstraint(fields=('scope', 'owner_id'), name='notif_counter_owner_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -22,6 +22,27 @@ class Notification(models.Model):
         verbose_name = '通知'
         verbose_name_plural = '通知'
         ordering = ['-created_at']
+        indexes = [
+            # 已接收通知历史：按接收组过滤、按创建时间倒序分页（SQLite 索引隐含 rowid，可同时满足 id 排序）
+            models.Index(fields=['receiver_group', 'created_at'], name='notif_receiver_created_idx'),
+            # 已发送通知历史
+            models.Index(fields=['sender', 'created_at'], name='notif_sender_created_idx'),
+            # 按状态过滤的待确认通知：待确认只占一小部分，部分索引体积小且写入成本低
+            models.Index(
+                fields=['receiver_group', 'created_at'],
+                name='notif_pending_recv_idx',
+                condition=models.Q(status='pending'),
+            ),
+            # 增量同步与 ETag：按接收组/发送者读取某时间之后更新的通知，以及每组最新的更新时间
+            models.Index(fields=['receiver_group', 'updated_at'], name='notif_receiver_updated_idx'),
+            models.Index(fields=['sender', 'updated_at'], name='notif_sender_updated_idx'),
+            # 断线重连补发：按发送组查询某时间之后的确认
+            models.Index(
+                fields=['sender_group', 'confirmed_at'],
+                name='notif_confirmed_sender_idx',
+                condition=models.Q(status='confirmed'),
+            ),
+        ]
     
     def __str__(self):
         return f'从{self.sender_group.name}到{self.receiver_group.name}: {self.content[:20]}...'
@@ -31,3 +52,73 @@ class Notification(models.Model):
         if self.status == 'confirmed' and not self.confirmed_at:
             self.confirmed_at = self.updated_at
         super().save(*args, **kwargs)
+
+
+class ArchivedNotification(models.Model):
+    """归档的已确认通知，结构与 Notification 的查询字段一致，历史API可用同一投影读取"""
+    id = models.BigIntegerField(primary_key=True, verbose_name='通知ID')
+    content = models.TextField(verbose_name='通知内容')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_sent_notifications', verbose_name='发送者')
+    sender_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='archived_sent_notifications', verbose_name='发送者组')
+    receiver_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='archived_received_notifications', verbose_name='接收者组')
+    status = models.CharField(max_length=20, choices=Notification.STATUS_CHOICES, default='confirmed', verbose_name='状态')
+    confirmed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_confirmed_notifications', verbose_name='确认者')
+    created_at = models.DateTimeField(verbose_name='创建时间')
+    confirmed_at = models.DateTimeField(null=True, blank=True, verbose_name='确认时间')
+    
+    class Meta:
+        verbose_name = '归档通知'
+        verbose_name_plural = '归档通知'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['receiver_group', 'created_at'], name='archive_receiver_created_idx'),
+            models.Index(fields=['sender', 'created_at'], name='archive_sender_created_idx'),
+            # 归档水位（最新的归档创建时间），决定历史查询是否需要读取归档表
+            models.Index(fields=['created_at'], name='archive_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f'[归档] {self.content[:20]}...'
+
+
+class NotificationCounter(models.Model):
+    """待确认计数：组收到的待确认通知数（scope=group）与用户发送的待确认通知数（scope=user）
+    
+    发送与确认时在同一事务内增量更新，读取计数无需聚合查询。
+    """
+    SCOPE_CHOICES = (
+        ('group', '组'),
+        ('user', '用户'),
+    )
+    
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES, verbose_name='范围')
+    owner_id = models.BigIntegerField(verbose_name='组或用户ID')
+    pending = models.IntegerField(default=0, verbose_name='待确认数')
+    
+    class Meta:
+        verbose_name = '待确认计数'
+        verbose_name_plural = '待确认计数'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'owner_id'], name='notif_counter_owner_uniq'),
+        ]
+    
+    def __str__(self):
+        return f'{self.scope}:{self.owner_id} = {self.pending}'
+
+
+class GroupRoute(models.Model):
+    """组间路由，定义发送组可以向哪些接收组发送通知；一个发送组可对应多个接收组"""
+    sender_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='outgoing_routes', verbose_name='发送组')
+    receiver_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='incoming_routes', verbose_name='接收组')
+    bidirectional = models.BooleanField(default=True, verbose_name='双向路由')
+    
+    class Meta:
+        verbose_name = '组路由'
+        verbose_name_plural = '组路由'
+        constraints = [
+            models.UniqueConstraint(fields=['sender_group', 'receiver_group'], name='unique_group_route'),
+        ]
+    
+    def __str__(self):
+        arrow = '<->' if self.bidirectional else '->'
+        return f'{self.sender_group.name} {arrow} {self.receiver_group.name}'
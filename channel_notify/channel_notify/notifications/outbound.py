@@ -0,0 +1,170 @@
+"""每个连接的有界发送队列
+
+消费者的事件循环若直接 await self.send，网络差的客户端会使它停止读取通道层收件箱，
+积压的消息最终被通道层的容量上限或 expiry 静默丢弃。本模块把发往客户端的帧放入有界队列，
+由每个连接的写任务按顺序发送，消费者的事件循环只负责入队；队列满时按策略处理：
+
+- coalesce：把队列中相邻的通知合并为 notification_batch、相邻的确认合并为 notifications_confirmed、
+  计数合并为一帧最新计数；无可合并的帧或合并后的批量超过 MAX_COALESCED 条时退化为 drop_oldest
+- drop_oldest：丢弃最旧的帧，下一帧之前发送 {"type": "gap", "dropped": N}，客户端据此发送 resume 补发
+- disconnect：以 4008 关闭连接，客户端重连后通过补发恢复
+
+写任务与队列缓冲区只在有待发送的帧时存在，空闲连接不占用任务，也不占用 deque 的内存块。
+"""
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+
+from .jsoncodec import dumps, loads
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+COALESCE = 'coalesce'
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+POLICIES = (COALESCE, DROP_OLDEST, DISCONNECT)
+
+# 队列溢出按 disconnect 策略关闭连接时使用的关闭码
+OVERFLOW_CLOSE_CODE = 4008
+
+# coalesce 策略下单个合并帧最多包含的消息数，超过后丢弃最旧的帧，保证内存有界
+MAX_COALESCED = 500
+
+# 可合并的事件类型 -> (合并后的类型, 帧内的消息字段)
+MERGEABLE = {
+    'notification_message': ('notification_batch', 'message'),
+    'notification_batch': ('notification_batch', 'messages'),
+    'notification_confirmed': ('notifications_confirmed', 'message'),
+    'notifications_confirmed': ('notifications_confirmed', 'messages'),
+}
+
+
+def outbound_config():
+    config = {'MAX_FRAMES': 256, 'POLICY': DROP_OLDEST}
+    config.update(getattr(settings, 'NOTIFY_OUTBOUND_QUEUE', {}))
+    if config['POLICY'] not in POLICIES:
+        raise ValueError(f'无效的发送队列策略: {config["POLICY"]}')
+    return config
+
+
+def coalesce(items):
+    """合并队列中的帧，返回新的 [(类型, 帧), ...]
+
+    只合并相邻的同类帧，通知与确认之间的先后顺序保持不变：客户端先处理了某条通知的确认、
+    再收到这条通知时，会把它当作待确认一直显示。计数帧是绝对值，合并为一帧放在最后一个计数帧的位置，
+    不再隔开前后的通知。合并后的批量超过 MAX_COALESCED 条时返回 None。
+    """
+    merged, counters, counters_at = [], None, None
+    for kind, frame in items:
+        if kind in MERGEABLE:
+            batch_type, field = MERGEABLE[kind]
+            event = loads(frame)
+            messages = event[field] if field == 'messages' else [event[field]]
+            if merged and merged[-1][0] == batch_type and isinstance(merged[-1][1], list):
+                merged[-1][1].extend(messages)
+            else:
+                merged.append((batch_type, list(messages)))
+        elif kind == 'counters':
+            event = loads(frame)
+            if counters is None:
+                counters = {'type': 'counters'}
+            counters.setdefault('groups', {}).update(event.get('groups', {}))
+            if 'sent_pending' in event:
+                counters['sent_pending'] = event['sent_pending']
+            if not counters['groups']:
+                del counters['groups']
+            counters_at = len(merged)
+        else:
+            merged.append((kind, frame))
+    if any(isinstance(value, list) and len(value) > MAX_COALESCED for _, value in merged):
+        return None
+    result = [
+        (kind, dumps({'type': kind, 'messages': value}) if isinstance(value, list) else value)
+        for kind, value in merged
+    ]
+    if counters is not None:
+        result.insert(counters_at, ('counters', dumps(counters)))
+    return result
+
+
+class OutboundQueue:
+    """单个连接的有界发送队列；send_frame 发送一帧文本，close 关闭连接（均为协程函数）"""
+    __slots__ = ('send_frame', 'close', 'max_frames', 'policy', 'items', 'dropped', 'writer', 'closed')
+
+    def __init__(self, send_frame, close, max_frames, policy):
+        self.send_frame = send_frame
+        self.close = close
+        self.max_frames = max_frames
+        self.policy = policy
+        self.items = None
+        self.dropped = 0
+        self.writer = None
+        self.closed = False
+
+    @classmethod
+    def from_settings(cls, send_frame, close):
+        config = outbound_config()
+        return cls(send_frame, close, config['MAX_FRAMES'], config['POLICY'])
+
+    def put(self, frame, kind=None):
+        """入队一帧；kind 为可合并的事件类型时 coalesce 策略才会合并它"""
+        if self.closed:
+            return
+        if self.items is None:
+            self.items = deque()
+        elif len(self.items) >= self.max_frames and not self.overflow():
+            return
+        self.items.append((kind, frame))
+        metrics.outbound_enqueued(len(self.items))
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.get_running_loop().create_task(self.write())
+
+    def overflow(self):
+        """队列已满时按策略腾出空间，返回本帧是否还应入队"""
+        depth = len(self.items)
+        if self.policy == COALESCE:
+            merged = coalesce(self.items)
+            if merged is not None and len(merged) < depth:
+                self.items = deque(merged)
+                metrics.outbound_removed(depth - len(merged))
+                metrics.outbound_overflow(COALESCE)
+                return True
+        if self.policy in (COALESCE, DROP_OLDEST):
+            self.items.popleft()
+            self.dropped += 1
+            metrics.outbound_removed(1)
+            metrics.outbound_overflow(DROP_OLDEST)
+            return True
+        logger.info('outbound_queue_overflow', extra={'fields': {'depth': depth, 'policy': self.policy}})
+        metrics.outbound_overflow(DISCONNECT)
+        self.discard()
+        asyncio.get_running_loop().create_task(self.close(OVERFLOW_CLOSE_CODE))
+        return False
+
+    async def write(self):
+        while self.items:
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                await self.send_frame(dumps({
+                    'type': 'gap',
+                    'dropped': dropped,
+                    'message': f'连接过慢，已丢弃 {dropped} 条消息，请发送 resume 补发'
+                }))
+                continue
+            _, frame = self.items.popleft()
+            metrics.outbound_removed(1)
+            await self.send_frame(frame)
+        # 队列已空，释放缓冲区
+        self.items = None
+
+    def discard(self):
+        """连接关闭时丢弃未发送的帧并停止写任务"""
+        self.closed = True
+        if self.items:
+            metrics.outbound_removed(len(self.items))
+        self.items = None
+        if self.writer is not None and not self.writer.done() and self.writer is not asyncio.current_task():
+            self.writer.cancel()
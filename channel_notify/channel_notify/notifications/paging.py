@@ -0,0 +1,18 @@
+"""按组分页的查询改写，历史接口（views.py）与断线补发（consumers.py）共用"""
+from django.db.models import Q
+
+
+def per_group_pages(queryset, field, group_ids, page, limit):
+    """把 field IN (组ID...) 的查询改写为每个组各自按索引取一页ID后合并
+
+    page 把单个组的查询集变为有序的一页（加游标条件与 order_by），limit 为每个组取的行数。
+    单个组时直接返回 page(field = ?)，排序由索引满足；多个组时返回 id IN (各组的一页) 的查询集，
+    调用方对其排序并取页，外层只对最多 组数×limit 行排序，而不是对 IN 条件命中的全部行排序。
+    group_ids 不能为空。
+    """
+    if len(group_ids) == 1:
+        return page(queryset.filter(**{field: group_ids[0]}))
+    pages = Q()
+    for group_id in group_ids:
+        pages |= Q(id__in=page(queryset.filter(**{field: group_id})).values('id')[:limit])
+    return queryset.model.objects.using(queryset.db).filter(pages)
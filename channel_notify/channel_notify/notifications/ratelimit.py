@@ -0,0 +1,131 @@
+"""发送通知的令牌桶限流
+
+每个用户与每个发送组各有一个令牌桶，桶以 RATE 个/秒的速度补充，最多积累 BURST 个令牌；
+发送一条通知消耗一个令牌（批量发送按条数计），两个桶都有足够令牌时才放行。
+桶保存在进程内存中，每次检查只访问两个桶（O(1)），多进程部署时每个工作进程分别限流。
+
+配置 settings.NOTIFY_RATE_LIMITS：
+
+    {
+        'USER': {'RATE': 20, 'BURST': 500},     # 每个用户
+        'GROUP': {'RATE': 100, 'BURST': 1000},  # 每个发送组（组内全部用户合计）
+        'GROUPS': {                             # 按发送组覆盖，可只覆盖 USER 或 GROUP
+            'operations_group_1': {'USER': {'RATE': 5, 'BURST': 50}},
+        },
+    }
+
+RATE 为 0 或未配置 USER / GROUP 时不限制对应维度。
+"""
+import threading
+import time
+
+from django.conf import settings
+
+# 空闲桶的清理间隔（秒）：补满的桶与新建的桶等价，可以丢弃
+SWEEP_INTERVAL = 60
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost):
+        """取出 cost 个令牌还需等待的秒数，0 表示可以立即取出"""
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class Throttled(Exception):
+    """超出限流；scope 为 user / group，retry_after 为建议的重试等待秒数（超过桶容量时为 None）"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(scope, retry_after)
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """按用户与发送组的令牌桶限流器，桶表的读写在锁内完成"""
+
+    def __init__(self, config=None, clock=time.monotonic):
+        config = config or {}
+        self.user_limit = self._limit(config.get('USER'))
+        self.group_limit = self._limit(config.get('GROUP'))
+        self.overrides = {
+            group_name: (
+                self._limit(override['USER']) if 'USER' in override else self.user_limit,
+                self._limit(override['GROUP']) if 'GROUP' in override else self.group_limit,
+            )
+            for group_name, override in config.get('GROUPS', {}).items()
+        }
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._swept = clock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(getattr(settings, 'NOTIFY_RATE_LIMITS', {}))
+
+    @staticmethod
+    def _limit(limit):
+        if not limit or not limit.get('RATE'):
+            return None
+        return limit['RATE'], limit.get('BURST', limit['RATE'])
+
+    def _bucket(self, key, limit, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit, now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def acquire(self, user_id, group_name, cost=1):
+        """为 user_id 从 group_name 发送 cost 条通知取出令牌，超出限流时抛出 Throttled 且不消耗令牌"""
+        user_limit, group_limit = self.overrides.get(group_name, (self.user_limit, self.group_limit))
+        if not user_limit and not group_limit:
+            return
+        with self._lock:
+            now = self.clock()
+            if now - self._swept > SWEEP_INTERVAL:
+                self._sweep(now)
+            buckets = []
+            if user_limit:
+                buckets.append(('user', self._bucket(('user', user_id), user_limit, now)))
+            if group_limit:
+                buckets.append(('group', self._bucket(('group', group_name), group_limit, now)))
+            for scope, bucket in buckets:
+                if cost > bucket.burst:
+                    raise Throttled(scope, None)
+            waits = [(bucket.wait_time(cost), scope) for scope, bucket in buckets]
+            retry_after, scope = max(waits)
+            if retry_after:
+                raise Throttled(scope, retry_after)
+            for _, bucket in buckets:
+                bucket.tokens -= cost
+
+    def _sweep(self, now):
+        """丢弃已补满的桶，用户数很多时内存不随历史用户增长"""
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.is_full(now)}
+        self._swept = now
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+rate_limiter = RateLimiter.from_settings()
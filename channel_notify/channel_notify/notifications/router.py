@@ -0,0 +1,71 @@
+import threading
+from types import MappingProxyType
+
+from .models import GroupRoute
+
+EMPTY_TARGETS = MappingProxyType({})
+
+
+class GroupRouter:
+    """进程级组路由表：启动后从 GroupRoute 加载为不可变映射，路由变更时整体替换
+
+    路由表结构为 {发送组名: {接收组名: 接收组ID}}，查询为纯内存 O(1) 操作。
+    路由或组变更后，各工作进程由 signals.py 经频道层广播的失效消息丢弃各自的路由表（见 invalidation.py）。
+    """
+
+    def __init__(self):
+        self._table = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_table():
+        """从数据库读取全部路由，构造不可变查找表（双向路由同时生成反向条目）"""
+        routes = {}
+        rows = GroupRoute.objects.values_list(
+            'sender_group_id', 'sender_group__name',
+            'receiver_group_id', 'receiver_group__name',
+            'bidirectional',
+        ).order_by('id')
+        for sender_id, sender_name, receiver_id, receiver_name, bidirectional in rows:
+            routes.setdefault(sender_name, {})[receiver_name] = receiver_id
+            if bidirectional:
+                routes.setdefault(receiver_name, {})[sender_name] = sender_id
+        return MappingProxyType({
+            sender_name: MappingProxyType(targets) for sender_name, targets in routes.items()
+        })
+
+    def load(self):
+        """(重新)加载路由表并原子地替换当前引用，需在同步上下文中调用"""
+        generation = self._generation
+        table = self.build_table()
+        with self._lock:
+            # 加载期间若路由再次变更，则不发布可能已过期的表
+            if generation == self._generation:
+                self._table = table
+        return table
+
+    def invalidate(self):
+        """丢弃当前路由表，下次查询时重新加载"""
+        with self._lock:
+            self._generation += 1
+            self._table = None
+
+    @property
+    def loaded(self):
+        """路由表是否已在内存中（查询不会访问数据库）"""
+        return self._table is not None
+
+    @property
+    def table(self):
+        table = self._table
+        if table is None:
+            table = self.load()
+        return table
+
+    def targets(self, group_name):
+        """返回发送组可路由到的 {接收组名: 接收组ID}，未配置路由时返回空映射"""
+        return self.table.get(group_name, EMPTY_TARGETS)
+
+
+group_router = GroupRouter()
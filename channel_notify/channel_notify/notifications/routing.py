@@ -3,4 +3,6 @@ from .consumers import NotificationConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/notifications/(?P<group_name>[^/]+)/$', NotificationConsumer.as_asgi()),
+    # 多路复用：一个连接订阅用户的全部组
+    re_path(r'ws/notifications/$', NotificationConsumer.as_asgi()),
 ]
\ No newline at end of file
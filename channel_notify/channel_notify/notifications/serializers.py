@@ -0,0 +1,54 @@
+import base64
+import binascii
+
+from django.utils.dateparse import parse_datetime
+
+# 通知列表的字段投影，通过 values() 一次性取出关联的用户名和组名
+NOTIFICATION_FIELDS = (
+    'id',
+    'content',
+    'sender__username',
+    'sender_group__name',
+    'receiver_group__name',
+    'status',
+    'created_at',
+    'confirmed_by__username',
+    'confirmed_at',
+)
+
+
+def serialize_notification(row):
+    """将 NOTIFICATION_FIELDS 投影得到的字典序列化为API输出格式；增量同步的投影另带 updated_at"""
+    data = {
+        'id': row['id'],
+        'content': row['content'],
+        'sender': row['sender__username'],
+        'sender_group': row['sender_group__name'],
+        'receiver_group': row['receiver_group__name'],
+        'status': row['status'],
+        'created_at': row['created_at'].isoformat(),
+        'confirmed_by': row['confirmed_by__username'],
+        'confirmed_at': row['confirmed_at'].isoformat() if row['confirmed_at'] else None
+    }
+    if 'updated_at' in row:
+        data['updated_at'] = row['updated_at'].isoformat()
+    return data
+
+
+def encode_cursor(row, field='created_at'):
+    """根据 (created_at, id) 生成不透明的分页游标；增量同步使用 (updated_at, id)"""
+    raw = f"{row[field].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """解析分页游标，返回 (created_at, id)；格式无效时抛出 ValueError"""
+    try:
+        created_at, notification_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        notification_id = int(notification_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('无效的分页游标')
+    if created_at is None:
+        raise ValueError('无效的分页游标')
+    return created_at, notification_id
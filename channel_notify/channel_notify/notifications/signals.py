@@ -0,0 +1,97 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User, Group
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .consumers import user_channel_group
+from .handshake import handshake_cache
+from .invalidation import listener, publish
+from .models import GroupRoute
+from .router import group_router
+
+
+def broadcast_membership_changed(user_ids):
+    """事务提交后通知这些用户的所有WebSocket连接刷新组缓存"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not user_ids:
+        return
+    for user_id in user_ids:
+        async_to_sync(channel_layer.group_send)(
+            user_channel_group(user_id),
+            {'type': 'membership_changed'}
+        )
+
+
+# 其他工作进程广播的失效消息
+listener.register('routes', lambda message: group_router.invalidate())
+listener.register('users', lambda message: handshake_cache.invalidate_users(message['user_ids']))
+listener.register('session', lambda message: handshake_cache.invalidate_digest(bytes.fromhex(message['digest'])))
+listener.register('groups', lambda message: handshake_cache.clear())
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """User.groups 变更时广播失效消息；反向操作（group.user_set）时 pk_set 为用户ID"""
+    if action == 'pre_clear' and reverse:
+        # 清空前记录受影响的用户，post_clear 时已无法查询
+        instance._notify_cleared_user_ids = list(instance.user_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'post_clear':
+        user_ids = getattr(instance, '_notify_cleared_user_ids', [])
+    else:
+        user_ids = list(pk_set or ())
+    
+    handshake_cache.invalidate_users(user_ids)
+    transaction.on_commit(lambda: handshake_cache.invalidate_users(user_ids))
+    transaction.on_commit(lambda: publish('users', user_ids=user_ids))
+    transaction.on_commit(lambda: broadcast_membership_changed(user_ids))
+
+
+@receiver([post_save, post_delete], sender=GroupRoute)
+@receiver([post_save, post_delete], sender=Group)
+def routes_changed(sender, **kwargs):
+    """路由或组名变更时丢弃进程内路由表；提交后再次丢弃，避免事务未提交期间重新加载到旧数据，并通知其他工作进程丢弃"""
+    group_router.invalidate()
+    transaction.on_commit(group_router.invalidate)
+    transaction.on_commit(lambda: publish('routes'))
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    """用户保存（修改密码、停用等）或删除后丢弃其缓存的握手认证结果；提交后再次丢弃并通知其他工作进程，理由同上"""
+    handshake_cache.invalidate_users([instance.pk])
+    transaction.on_commit(lambda: handshake_cache.invalidate_users([instance.pk]))
+    transaction.on_commit(lambda: publish('users', user_ids=[instance.pk]))
+
+
+@receiver([post_save, post_delete], sender=Group)
+def group_changed(sender, **kwargs):
+    """组改名或删除后缓存的组名失效（全部工作进程）"""
+    handshake_cache.clear()
+    transaction.on_commit(handshake_cache.clear)
+    transaction.on_commit(lambda: publish('groups'))
+
+
+@receiver(user_logged_out)
+def session_logged_out(sender, request, user, **kwargs):
+    """登出时丢弃握手认证结果（logout() 在清空会话之前发出此信号）
+
+    signed_cookies 引擎的 session_key 由会话数据重新签名得到，与客户端持有的 Cookie 不同，
+    因此同时丢弃该用户的全部会话键，其他会话下次握手时重新解析即可。
+    """
+    if user is not None:
+        handshake_cache.invalidate_users([user.pk])
+        transaction.on_commit(lambda: publish('users', user_ids=[user.pk]))
+    elif request.session.session_key:
+        key = handshake_cache.digest(request.session.session_key)
+        handshake_cache.invalidate_digest(key)
+        # 只广播摘要，不在频道层中传递会话键
+        transaction.on_commit(lambda: publish('session', digest=key.hex()))
@@ -1,12 +1,77 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 from django.contrib.auth.models import User, Group
+from django.contrib.auth.signals import user_logged_out
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
+from django.db import connection, OperationalError
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+import asyncio
+import gc
 import json
-from .models import Notification
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+from .models import Notification, ArchivedNotification, GroupRoute, NotificationCounter
+from .router import group_router
 from channels.testing import WebsocketCommunicator
-from .consumers import NotificationConsumer
+from .consumers import ConnectionUser, NotificationConsumer, NotificationError
+from .bench import HopCounter, QueryCounter, login_cookie
+from .metrics import RATE_WINDOW, metrics
+from .db import database_sync_to_pool
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.test import override_settings
+from .layers import SQLiteChannelLayer
+from .writebehind import WriteBehind, Journal, journal_line, reserve_ids
+from .archive import archive_notifications
+from .counters import apply_deltas, counter_cache
+from .ratelimit import RateLimiter, Throttled
+from .outbound import OVERFLOW_CLOSE_CODE, coalesce
+from .jsoncodec import dumps
+from .heartbeat import HeartbeatWheel
+from .fanout import LocalFanout
+from .invalidation import INVALIDATION_GROUP, InvalidationListenerMiddleware, listener
+from .handshake import HandshakeAuthCache, HandshakeAuthMiddleware, HandshakeAuthMiddlewareStack, handshake_cache
+from .routing import websocket_urlpatterns
+from channels.routing import URLRouter
+from django.core.management import call_command
+
+
+class RoutedGroupsMixin:
+    """operations_group_1 -> finance_group_1 的路由、两组各一名用户（op1 / fin1）及建立 WebSocket 连接的辅助方法"""
+    
+    def setUp(self):
+        super().setUp()
+        self.ops_group = Group.objects.create(name='operations_group_1')
+        self.fin_group = Group.objects.create(name='finance_group_1')
+        GroupRoute.objects.create(sender_group=self.ops_group, receiver_group=self.fin_group)
+        self.op_user = User.objects.create_user(username='op1', password='testpass')
+        self.op_user.groups.add(self.ops_group)
+        self.fin_user = User.objects.create_user(username='fin1', password='testpass')
+        self.fin_user.groups.add(self.fin_group)
+        # 测试之间回滚的数据不触发失效信号，丢弃之前的测试加载的路由表
+        group_router.invalidate()
+        self.addCleanup(group_router.invalidate)
+    
+    async def connect(self, user, group_name, query=''):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/{group_name}/{query}')
+        communicator.scope['url_route'] = {'kwargs': {'group_name': group_name}}
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_established')
+        return communicator
+
 
 class NotificationModelTests(TestCase):
     """测试通知模型的基本功能"""
@@ -117,6 +182,320 @@ class NotificationAPITests(TestCase):
         self.assertEqual(len(data['sent_notifications']), 1)
         self.assertEqual(len(data['received_notifications']), 0)
 
+class NotificationHistoryAPITests(RoutedGroupsMixin, TestCase):
+    """测试分页的通知历史API"""
+    
+    def create_notifications(self, count, **kwargs):
+        return [
+            Notification.objects.create(
+                sender=self.op_user,
+                content=f'历史通知{i}',
+                sender_group=self.ops_group,
+                receiver_group=self.fin_group,
+                **kwargs
+            )
+            for i in range(count)
+        ]
+    
+    def get(self, **params):
+        response = self.client.get(reverse('get_notifications'), params)
+        return response.status_code, json.loads(response.content)
+    
+    def test_cursor_pagination_walks_all_rows_in_order(self):
+        """按游标翻页可以不重复、不遗漏地遍历全部通知"""
+        created = self.create_notifications(7)
+        self.client.login(username='fin1', password='testpass')
+        
+        seen, cursor = [], None
+        while True:
+            params = {'direction': 'received', 'limit': 3}
+            if cursor:
+                params['received_cursor'] = cursor
+            status, data = self.get(**params)
+            self.assertEqual(status, 200)
+            self.assertNotIn('sent_notifications', data)
+            seen.extend(item['id'] for item in data['received_notifications'])
+            cursor = data['next_received_cursor']
+            if not cursor:
+                break
+        
+        self.assertEqual(seen, [n.id for n in reversed(created)])
+    
+    def test_status_and_since_filters(self):
+        """status 与 since 过滤条件生效，非法参数返回400"""
+        old = self.create_notifications(2, status='confirmed', confirmed_by=self.fin_user)
+        Notification.objects.filter(id__in=[n.id for n in old]).update(
+            created_at=timezone.now() - timedelta(days=30)
+        )
+        self.create_notifications(3)
+        self.client.login(username='fin1', password='testpass')
+        
+        _, data = self.get(status='pending')
+        self.assertEqual(len(data['received_notifications']), 3)
+        
+        _, data = self.get(since=(timezone.now() - timedelta(days=1)).isoformat())
+        self.assertEqual(len(data['received_notifications']), 3)
+        
+        _, data = self.get(status='confirmed')
+        self.assertEqual(data['received_notifications'][0]['confirmed_by'], 'fin1')
+        
+        self.assertEqual(self.get(status='unknown')[0], 400)
+        self.assertEqual(self.get(received_cursor='bad')[0], 400)
+    
+    def test_query_count_is_constant(self):
+        """查询次数与通知数量无关，不存在逐行懒加载"""
+        self.client.login(username='fin1', password='testpass')
+        self.create_notifications(1)
+        with CaptureQueriesContext(connection) as small:
+            self.get()
+        
+        self.create_notifications(40)
+        with self.assertNumQueries(len(small.captured_queries)):
+            status, data = self.get()
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['received_notifications']), 41)
+    
+    def test_etag_returns_not_modified_until_notifications_change(self):
+        """携带 If-None-Match 且数据未变化时返回304；确认通知后 ETag 改变"""
+        notification = self.create_notifications(3)[0]
+        self.client.login(username='fin1', password='testpass')
+        
+        response = self.client.get(reverse('get_notifications'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        
+        response = self.client.get(reverse('get_notifications'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # 不同的查询参数对应不同的 ETag
+        response = self.client.get(reverse('get_notifications'), {'limit': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        
+        notification.status = 'confirmed'
+        notification.confirmed_by = self.fin_user
+        notification.save()
+        response = self.client.get(reverse('get_notifications'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_updated_since_returns_only_changed_rows(self):
+        """updated_since 只返回之后新建或确认的通知，按更新时间正序并可翻页"""
+        old = self.create_notifications(5)
+        Notification.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        checkpoint = timezone.now()
+        new = self.create_notifications(2)
+        Notification.objects.filter(id=old[0].id).update(
+            status='confirmed', confirmed_by=self.fin_user, confirmed_at=timezone.now(), updated_at=timezone.now()
+        )
+        self.client.login(username='fin1', password='testpass')
+        
+        _, data = self.get(direction='received', updated_since=checkpoint.isoformat(), limit=2)
+        self.assertEqual([item['id'] for item in data['received_notifications']], [new[0].id, new[1].id])
+        self.assertIn('updated_at', data['received_notifications'][0])
+        _, data = self.get(
+            direction='received', updated_since=checkpoint.isoformat(), limit=2,
+            received_cursor=data['next_received_cursor']
+        )
+        self.assertEqual([item['id'] for item in data['received_notifications']], [old[0].id])
+        self.assertEqual(data['received_notifications'][0]['status'], 'confirmed')
+        self.assertIsNone(data['next_received_cursor'])
+        
+        _, data = self.get(updated_since=timezone.now().isoformat())
+        self.assertEqual((data['sent_notifications'], data['received_notifications']), ([], []))
+        self.assertEqual(self.get(updated_since='yesterday')[0], 400)
+
+
+class ArchiveTests(RoutedGroupsMixin, TestCase):
+    """测试已确认通知的归档与历史API的透明读取"""
+    
+    def create_notification(self, days_ago, confirmed=True):
+        notification = Notification.objects.create(
+            content=f'{days_ago}天前', sender=self.op_user, sender_group=self.ops_group, receiver_group=self.fin_group,
+            status='confirmed' if confirmed else 'pending', confirmed_by=self.fin_user if confirmed else None
+        )
+        Notification.objects.filter(id=notification.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return notification.id
+    
+    def test_old_confirmed_notifications_move_in_chunks(self):
+        """只移动超过期限的已确认通知，按块提交，字段原样保留"""
+        old = [self.create_notification(days) for days in (100, 120, 150)]
+        old_pending = self.create_notification(200, confirmed=False)
+        recent = self.create_notification(1)
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(archive_notifications(timedelta(days=30), batch_size=2), 3)
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('DELETE')]), 2)
+        self.assertEqual(sorted(Notification.objects.values_list('id', flat=True)), [old_pending, recent])
+        archived = ArchivedNotification.objects.get(id=old[0])
+        self.assertEqual(archived.confirmed_by, self.fin_user)
+        self.assertEqual(archived.content, '100天前')
+        
+        self.create_notification(400)
+        call_command('archive_notifications', days=30, stdout=open(os.devnull, 'w'))
+        self.assertEqual(ArchivedNotification.objects.count(), 4)
+    
+    def test_history_reads_archive_only_when_needed(self):
+        """最近的整页不查询归档表，翻页到归档范围时透明合并归档数据"""
+        archived = [self.create_notification(days) for days in (100, 101)]
+        live = [self.create_notification(days) for days in (0, 1, 2)]
+        old_pending = self.create_notification(365, confirmed=False)
+        archive_notifications(timedelta(days=30))
+        self.client.login(username='fin1', password='testpass')
+        
+        def get(**params):
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(reverse('get_notifications'), dict(direction='received', **params)).json()
+            archive_reads = [
+                q for q in queries.captured_queries if 'notifications_archivednotification' in q['sql'] and 'MAX(' not in q['sql']
+            ]
+            return data, len(archive_reads)
+        
+        data, archive_reads = get(limit=2)
+        self.assertEqual([item['id'] for item in data['received_notifications']], live[:2])
+        self.assertEqual(archive_reads, 0)
+        
+        data, archive_reads = get(since=(timezone.now() - timedelta(days=30)).isoformat())
+        self.assertEqual(len(data['received_notifications']), 3)
+        self.assertEqual(archive_reads, 0)
+        
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['received_cursor'] = cursor
+            data, _ = get(**params)
+            seen += [item['id'] for item in data['received_notifications']]
+            cursor = data['next_received_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, live + archived + [old_pending])
+
+
+class NotificationQueryPlanTests(TestCase):
+    """在大数据量的SQLite表上用 EXPLAIN QUERY PLAN 检查API和消费者的查询都走索引"""
+    
+    ROWS = 20000
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.groups = [Group.objects.create(name=f'operations_group_{i}') for i in range(10)]
+        cls.groups += [Group.objects.create(name=f'finance_group_{i}') for i in range(10)]
+        for i in range(10):
+            GroupRoute.objects.create(sender_group=cls.groups[i], receiver_group=cls.groups[10 + i])
+        cls.users = [User.objects.create_user(username=f'user{i}', password='testpass') for i in range(20)]
+        for user, group in zip(cls.users, cls.groups):
+            user.groups.add(group)
+        # 一个同时属于多个财务组的用户
+        cls.users[10].groups.add(cls.groups[11], cls.groups[12])
+        
+        now = timezone.now()
+        Notification.objects.bulk_create([
+            Notification(
+                content=f'通知{i}',
+                sender=cls.users[i % 10],
+                sender_group=cls.groups[i % 10],
+                receiver_group=cls.groups[10 + i % 10],
+                status='pending' if i % 10 == 0 else 'confirmed',
+                confirmed_by=None if i % 10 == 0 else cls.users[10 + i % 10],
+                created_at=now - timedelta(minutes=i)
+            )
+            for i in range(cls.ROWS)
+        ], batch_size=2000)
+    
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+    
+    def assert_queries_indexed(self, queries):
+        """不允许全表扫描；通知表上的排序必须由索引满足（多组合并时只对各组有界的一页排序）"""
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            # 路由表按设计整体加载到进程内存，允许全表读取
+            if 'FROM "notifications_grouproute"' in sql:
+                continue
+            plan = self.explain(sql)
+            checked += 1
+            for line in plan:
+                self.assertFalse(line.startswith('SCAN'), f'全表扫描: {line}\n{sql}')
+            if 'notifications_notification' in sql and 'MULTI-INDEX OR' not in plan:
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, sql)
+        self.assertGreater(checked, 0)
+    
+    def test_history_api_queries_use_indexes(self):
+        """历史API在各种过滤与翻页条件下都走索引"""
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        for user, params in [
+            (self.users[0], {}),
+            (self.users[0], {'direction': 'sent', 'status': 'pending'}),
+            (self.users[10], {}),
+            (self.users[11], {'direction': 'received', 'status': 'pending'}),
+            (self.users[11], {'direction': 'received', 'status': 'confirmed', 'since': since}),
+            (self.users[10], {'updated_since': since, 'limit': 5}),
+            (self.users[0], {'direction': 'sent', 'updated_since': since, 'limit': 5}),
+        ]:
+            self.client.force_login(user)
+            first = self.client.get(reverse('get_notifications'), params).json()
+            params = dict(params, sent_cursor=first.get('next_sent_cursor') or '',
+                          received_cursor=first.get('next_received_cursor') or '')
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(reverse('get_notifications'), {k: v for k, v in params.items() if v})
+            self.assertEqual(response.status_code, 200)
+            self.assert_queries_indexed(captured.captured_queries)
+    
+    def test_consumer_queries_use_indexes(self):
+        """连接、发送与确认通知时消费者执行的查询都走索引"""
+        async def flow():
+            sender = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/operations_group_1/')
+            sender.scope['url_route'] = {'kwargs': {'group_name': 'operations_group_1'}}
+            sender.scope['user'] = self.users[1]
+            await sender.connect()
+            await sender.receive_json_from()
+            await sender.send_json_to({'type': 'send_notification', 'content': '查询计划'})
+            sent = await sender.receive_json_from()
+            
+            confirmer = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/finance_group_1/')
+            confirmer.scope['url_route'] = {'kwargs': {'group_name': 'finance_group_1'}}
+            confirmer.scope['user'] = self.users[11]
+            await confirmer.connect()
+            await confirmer.receive_json_from()
+            await confirmer.send_json_to({'type': 'confirm_notification', 'notification_id': sent['message']['id']})
+            confirmed = await confirmer.receive_json_from()
+            self.assertEqual(confirmed['type'], 'notification_confirmed')
+            await sender.disconnect()
+            await confirmer.disconnect()
+        
+        with CaptureQueriesContext(connection) as captured:
+            async_to_sync(flow)()
+        self.assert_queries_indexed(captured.captured_queries)
+    
+    def test_replay_queries_use_indexes(self):
+        """断线重连补发的查询走索引且有界"""
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        
+        async def flow():
+            # 最后一个为多路复用连接：一次补发用户所在的三个财务组
+            for user, group_name in ((self.users[11], 'finance_group_1'), (self.users[1], 'operations_group_1'), (self.users[10], None)):
+                path = f'{group_name}/' if group_name else ''
+                communicator = WebsocketCommunicator(
+                    NotificationConsumer.as_asgi(),
+                    f'/ws/notifications/{path}?last_seen_id=100&last_confirmed_at={since.replace("+", "%2B")}'
+                )
+                communicator.scope['url_route'] = {'kwargs': {'group_name': group_name} if group_name else {}}
+                communicator.scope['user'] = user
+                await communicator.connect()
+                while (await communicator.receive_json_from())['type'] != 'replay_complete':
+                    pass
+                await communicator.disconnect()
+        
+        with CaptureQueriesContext(connection) as captured:
+            async_to_sync(flow)()
+        self.assert_queries_indexed(captured.captured_queries)
+
+
 class NotificationWebSocketTests(TestCase):
     """测试WebSocket功能"""
     
@@ -175,6 +554,1688 @@ class NotificationWebSocketTests(TestCase):
         
         await communicator.disconnect()
 
+class NotificationSendPipelineTests(RoutedGroupsMixin, TestCase):
+    """测试合并后的通知发送路径"""
+    
+    def setUp(self):
+        super().setUp()
+        Group.objects.create(name='finance_group_2')
+    
+    async def test_send_uses_single_db_hop_and_broadcasts_payload(self):
+        """发送通知只进行一次数据库线程池调用，并广播完整序列化的消息"""
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        receiver = await self.connect(self.fin_user, 'finance_group_1')
+        
+        with HopCounter() as hops:
+            await sender.send_json_to({'type': 'send_notification', 'content': '合并发送测试'})
+            response = await sender.receive_json_from()
+        
+        self.assertEqual(response['type'], 'notification_sent')
+        self.assertEqual(response['message']['receiver_group'], 'finance_group_1')
+        self.assertEqual(hops.app_hops, 1)
+        
+        event = await receiver.receive_json_from()
+        self.assertEqual(event['type'], 'notification_message')
+        self.assertEqual(event['message']['sender'], 'op1')
+        self.assertEqual(event['message']['sender_group'], 'operations_group_1')
+        self.assertEqual(event['message']['status'], 'pending')
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+    
+    async def test_broadcast_is_serialized_once_for_all_receivers(self):
+        """组广播在发送端只编码一次，各接收连接转发相同的文本帧"""
+        from . import consumers
+        receivers = [await self.connect(self.fin_user, 'finance_group_1') for _ in range(3)]
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        encoded = []
+        original = consumers.dumps
+        
+        def counting_dumps(obj):
+            encoded.append(obj.get('type'))
+            return original(obj)
+        
+        consumers.dumps = counting_dumps
+        try:
+            await sender.send_json_to({'type': 'send_notification', 'content': '一次编码'})
+            await sender.receive_json_from()
+            frames = [await receiver.receive_from() for receiver in receivers]
+        finally:
+            consumers.dumps = original
+        
+        self.assertEqual(encoded.count('notification_message'), 1)
+        self.assertEqual(len(set(frames)), 1)
+        self.assertEqual(json.loads(frames[0])['message']['content'], '一次编码')
+        for communicator in receivers + [sender]:
+            await communicator.disconnect()
+    
+    async def test_send_rejects_mismatched_receiver_group(self):
+        """发送给非对应组时返回错误且不写入通知"""
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        
+        await sender.send_json_to({
+            'type': 'send_notification',
+            'content': '错误的接收组',
+            'receiver_group': 'finance_group_2'
+        })
+        response = await sender.receive_json_from()
+        
+        self.assertEqual(response['type'], 'error')
+        self.assertEqual(response['message'], 'operations_group_1只能发送通知给finance_group_1')
+        self.assertFalse(await Notification.objects.aexists())
+        
+        await sender.disconnect()
+
+class BatchFrameTests(RoutedGroupsMixin, TestCase):
+    """测试批量发送/确认消息类型"""
+    
+    async def test_send_notifications_writes_once_and_broadcasts_one_batch(self):
+        """批量发送在一次数据库调用内写入全部通知，接收组只收到一条批量事件"""
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        receiver = await self.connect(self.fin_user, 'finance_group_1')
+        
+        with HopCounter() as hops:
+            await sender.send_json_to({'type': 'send_notifications', 'contents': ['第一条', '', '第三条']})
+            response = await sender.receive_json_from()
+        
+        self.assertEqual(response['type'], 'send_notifications_result')
+        self.assertEqual([result['index'] for result in response['results']], [0, 1, 2])
+        self.assertEqual(response['results'][1]['error'], '缺少必要参数: content')
+        self.assertEqual(response['results'][2]['notifications'][0]['content'], '第三条')
+        self.assertEqual(hops.app_hops, 1)
+        self.assertEqual(await Notification.objects.acount(), 2)
+        
+        event = await receiver.receive_json_from()
+        self.assertEqual(event['type'], 'notification_batch')
+        self.assertEqual([message['content'] for message in event['messages']], ['第一条', '第三条'])
+        self.assertTrue(await receiver.receive_nothing())
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+    
+    async def test_confirm_notifications_reports_each_item(self):
+        """批量确认逐条返回结果，发送组只收到一条批量确认事件"""
+        pending = [
+            await Notification.objects.acreate(
+                content=f'待确认{i}', sender=self.op_user, sender_group=self.ops_group, receiver_group=self.fin_group
+            )
+            for i in range(3)
+        ]
+        already = await Notification.objects.acreate(
+            content='已确认', sender=self.op_user, sender_group=self.ops_group, receiver_group=self.fin_group,
+            status='confirmed', confirmed_by=self.fin_user
+        )
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        receiver = await self.connect(self.fin_user, 'finance_group_1')
+        ids = [n.id for n in pending] + [already.id, 999999]
+        
+        with HopCounter() as hops:
+            await receiver.send_json_to({'type': 'confirm_notifications', 'notification_ids': ids})
+            response = await receiver.receive_json_from()
+        
+        self.assertEqual(response['type'], 'confirm_notifications_result')
+        self.assertEqual([result.get('status') for result in response['results'][:3]], ['confirmed'] * 3)
+        self.assertEqual(response['results'][3]['error'], '该通知已经被确认')
+        self.assertEqual(response['results'][4]['error'], '通知不存在')
+        self.assertEqual(hops.app_hops, 1)
+        
+        event = await sender.receive_json_from()
+        self.assertEqual(event['type'], 'notifications_confirmed')
+        self.assertEqual([message['id'] for message in event['messages']], [n.id for n in pending])
+        self.assertEqual(event['messages'][0]['confirmed_by'], 'fin1')
+        self.assertTrue(await sender.receive_nothing())
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+
+class MultiplexedConnectionTests(TestCase):
+    """测试多路复用连接 ws/notifications/"""
+    
+    def setUp(self):
+        self.ops_group = Group.objects.create(name='operations_group_1')
+        self.fin_groups = [Group.objects.create(name=f'finance_group_{n}') for n in (1, 2)]
+        for fin_group in self.fin_groups:
+            GroupRoute.objects.create(sender_group=self.ops_group, receiver_group=fin_group)
+        self.op_user = User.objects.create_user(username='op1', password='testpass')
+        self.op_user.groups.add(self.ops_group)
+        self.fin_user = User.objects.create_user(username='fin1', password='testpass')
+        self.fin_user.groups.add(*self.fin_groups)
+        group_router.invalidate()
+        self.addCleanup(group_router.invalidate)
+    
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/{query}')
+        communicator.scope['url_route'] = {'kwargs': {}}
+        communicator.scope['user'] = self.fin_user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        established = await communicator.receive_json_from()
+        self.assertEqual(established['type'], 'connection_established')
+        return communicator, established
+    
+    async def test_one_connection_receives_every_group(self):
+        """一个连接订阅用户的全部组，并收到各组的计数与通知"""
+        receiver, established = await self.connect('?counters=1')
+        self.assertEqual(established['subscriptions'], ['finance_group_1', 'finance_group_2'])
+        counters = await receiver.receive_json_from()
+        self.assertEqual(counters['groups'], {'finance_group_1': 0, 'finance_group_2': 0})
+        
+        sender = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/operations_group_1/')
+        sender.scope['url_route'] = {'kwargs': {'group_name': 'operations_group_1'}}
+        sender.scope['user'] = self.op_user
+        await sender.connect()
+        await sender.receive_json_from()
+        await sender.send_json_to({'type': 'send_notification', 'content': '报销', 'receiver_group': 'finance_group_2'})
+        
+        frames = [await receiver.receive_json_from() for _ in range(2)]
+        message = next(frame for frame in frames if frame['type'] == 'notification_message')
+        self.assertEqual(message['message']['receiver_group'], 'finance_group_2')
+        self.assertIn({'type': 'counters', 'groups': {'finance_group_2': 1}}, frames)
+        await sender.disconnect()
+        await receiver.disconnect()
+    
+    async def test_subscribe_and_unsubscribe(self):
+        """subscribe / unsubscribe 帧增减订阅，不能订阅用户不在的组"""
+        communicator, established = await self.connect('?groups=finance_group_1')
+        self.assertEqual(established['subscriptions'], ['finance_group_1'])
+        
+        await communicator.send_json_to({'type': 'subscribe', 'groups': ['finance_group_2']})
+        reply = await communicator.receive_json_from()
+        self.assertEqual((reply['type'], reply['subscriptions']), ('subscribed', ['finance_group_1', 'finance_group_2']))
+        await communicator.send_json_to({'type': 'subscribe', 'groups': ['operations_group_1']})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        await communicator.send_json_to({'type': 'unsubscribe', 'groups': ['finance_group_1']})
+        reply = await communicator.receive_json_from()
+        self.assertEqual((reply['groups'], reply['subscriptions']), (['finance_group_1'], ['finance_group_2']))
+        
+        channel_layer = get_channel_layer()
+        for group_name in ('finance_group_1', 'finance_group_2'):
+            await channel_layer.group_send(group_name, {
+                'type': 'notification_message', 'group': group_name,
+                'frame': json.dumps({'type': 'notification_message', 'group': group_name})
+            })
+        self.assertEqual((await communicator.receive_json_from())['group'], 'finance_group_2')
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+    
+    async def test_follows_membership_changes(self):
+        """未指定 groups 的连接随组成员关系自动订阅新组、退订离开的组"""
+        communicator, _ = await self.connect()
+        
+        def change(action):
+            with self.captureOnCommitCallbacks(execute=True):
+                action()
+        await database_sync_to_async(change)(lambda: self.fin_user.groups.add(self.ops_group))
+        reply = await communicator.receive_json_from()
+        self.assertEqual((reply['type'], reply['groups']), ('subscribed', ['operations_group_1']))
+        
+        await database_sync_to_async(change)(lambda: self.fin_user.groups.remove(self.fin_groups[0]))
+        reply = await communicator.receive_json_from()
+        self.assertEqual((reply['type'], reply['groups']), ('unsubscribed', ['finance_group_1']))
+        self.assertEqual(reply['subscriptions'], ['finance_group_2', 'operations_group_1'])
+        await communicator.disconnect()
+    
+    async def test_rejects_groups_outside_membership(self):
+        """握手时指定用户不在的组被拒绝；按组连接不接受 subscribe 帧"""
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/?groups=operations_group_1')
+        communicator.scope['url_route'] = {'kwargs': {}}
+        communicator.scope['user'] = self.fin_user
+        self.assertEqual(await communicator.connect(), (False, 403))
+        
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/finance_group_1/')
+        communicator.scope['url_route'] = {'kwargs': {'group_name': 'finance_group_1'}}
+        communicator.scope['user'] = self.fin_user
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'subscribe', 'groups': ['finance_group_2']})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        await communicator.disconnect()
+    
+    async def test_rejects_connection_without_groups(self):
+        """握手时没有可订阅的组（groups 为空或用户不属于任何组）的连接被拒绝，不会空闲占用连接"""
+        loner = await database_sync_to_async(User.objects.create_user)(username='loner', password='testpass')
+        for user, query in ((self.fin_user, '?groups=,'), (loner, ''), (loner, '?groups=')):
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/{query}')
+            communicator.scope['url_route'] = {'kwargs': {}}
+            communicator.scope['user'] = user
+            with self.assertLogs('channel_notify.notifications.consumers', 'INFO') as logs:
+                self.assertEqual(await communicator.connect(), (False, 403))
+            self.assertEqual(logs.records[0].fields['reason'], 'no_groups')
+
+class ReplayTests(RoutedGroupsMixin, TestCase):
+    """测试断线重连时的消息补发"""
+    
+    def setUp(self):
+        super().setUp()
+        other_group = Group.objects.create(name='finance_group_2')
+        self.notifications = [
+            Notification.objects.create(
+                content=f'通知{i}', sender=self.op_user, sender_group=self.ops_group, receiver_group=self.fin_group
+            )
+            for i in range(5)
+        ]
+        # 其他组的通知不应被补发
+        Notification.objects.create(content='其他组', sender=self.op_user, sender_group=self.ops_group, receiver_group=other_group)
+    
+    async def receive_until_complete(self, communicator):
+        frames = []
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == 'replay_complete':
+                return frames, frame
+            frames.append(frame)
+    
+    async def test_replays_only_missed_notifications_in_order(self):
+        """只补发 last_seen_id 之后发往当前组的通知"""
+        last_seen_id = self.notifications[1].id
+        with HopCounter() as hops:
+            communicator = await self.connect(self.fin_user, 'finance_group_1', f'?last_seen_id={last_seen_id}')
+            frames, complete = await self.receive_until_complete(communicator)
+        
+        # 加载连接状态与补发查询各一次线程池跳转，补发的消息数不影响跳转次数
+        self.assertEqual(hops.app_hops, 2)
+        self.assertEqual([frame['message']['id'] for frame in frames], [n.id for n in self.notifications[2:]])
+        self.assertTrue(all(frame['type'] == 'notification_message' and frame['replayed'] for frame in frames))
+        self.assertEqual(complete['last_seen_id'], self.notifications[-1].id)
+        self.assertFalse(complete['truncated'])
+        await communicator.disconnect()
+    
+    async def test_replays_missed_confirmations_via_resume_frame(self):
+        """发送方通过 resume 帧补发 last_confirmed_at 之后的确认"""
+        before = timezone.now()
+        for notification in self.notifications[:2]:
+            notification.status = 'confirmed'
+            notification.confirmed_by = self.fin_user
+            notification.confirmed_at = timezone.now()
+            await notification.asave()
+        communicator = await self.connect(self.op_user, 'operations_group_1')
+        
+        await communicator.send_json_to({'type': 'resume', 'last_confirmed_at': before.isoformat()})
+        frames, complete = await self.receive_until_complete(communicator)
+        
+        self.assertEqual([frame['type'] for frame in frames], ['notification_confirmed'] * 2)
+        self.assertEqual([frame['message']['id'] for frame in frames], [n.id for n in self.notifications[:2]])
+        self.assertEqual(frames[0]['message']['confirmed_by'], 'fin1')
+        self.assertEqual(complete['confirmations'], 2)
+        await communicator.disconnect()
+    
+    async def test_replay_is_bounded(self):
+        """错过的消息超过上限时只补发一页并标记 truncated"""
+        from . import consumers
+        communicator = await self.connect(self.fin_user, 'finance_group_1')
+        original = consumers.REPLAY_LIMIT
+        consumers.REPLAY_LIMIT = 3
+        try:
+            await communicator.send_json_to({'type': 'resume', 'last_seen_id': 0})
+            frames, complete = await self.receive_until_complete(communicator)
+        finally:
+            consumers.REPLAY_LIMIT = original
+        
+        self.assertEqual(len(frames), 3)
+        self.assertTrue(complete['truncated'])
+        self.assertEqual(complete['last_seen_id'], self.notifications[2].id)
+        await communicator.disconnect()
+
+class MetricsTests(RoutedGroupsMixin, TestCase):
+    """测试结构化日志与 Prometheus 指标"""
+    
+    def setUp(self):
+        super().setUp()
+        enabled = metrics.enabled
+        self.addCleanup(setattr, metrics, 'enabled', enabled)
+        self.addCleanup(metrics.reset)
+        metrics.reset()
+    
+    def test_metrics_endpoint_exports_stage_histograms_and_counters(self):
+        """开启指标后导出各阶段耗时、活跃连接数与消息计数"""
+        metrics.enabled = True
+        
+        async def flow():
+            sender = await self.connect(self.op_user, 'operations_group_1')
+            receiver = await self.connect(self.fin_user, 'finance_group_1')
+            await sender.send_json_to({'type': 'send_notification', 'content': '指标'})
+            await sender.receive_json_from()
+            await receiver.receive_json_from()
+            await receiver.disconnect()
+            response = await database_sync_to_async(self.client.get)(reverse('metrics'))
+            await sender.disconnect()
+            return response
+        response = async_to_sync(flow)()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        for stage in ('connect', 'send', 'db', 'broadcast'):
+            self.assertIn(f'notify_stage_seconds_bucket{{stage="{stage}",le="+Inf"}}', body)
+        self.assertIn('notify_stage_seconds_count{stage="send"} 1', body)
+        self.assertIn('notify_active_connections{group="operations_group_1"} 1', body)
+        self.assertNotIn('group="finance_group_1"', body)
+        self.assertIn('notify_messages_total{kind="sent"} 1', body)
+        self.assertIn('notify_messages_total{kind="delivered"} 1', body)
+        self.assertEqual(metrics.connections, {})
+    
+    def test_message_rates_per_kind_and_escaped_labels(self):
+        """速率按消息类型分别统计，限流与写后写入不计入发送速率；标签值中的特殊字符被转义"""
+        metrics.enabled = True
+        metrics.count_messages('sent', 3)
+        metrics.count_messages('throttled', 5)
+        metrics.count_messages('flushed', 3)
+        metrics.connection_opened('财务"组\\1\n')
+        
+        self.assertEqual(metrics.message_rates(), {'sent': 3 / RATE_WINDOW, 'throttled': 5 / RATE_WINDOW, 'flushed': 3 / RATE_WINDOW})
+        body = metrics.render()
+        self.assertIn(f'notify_messages_per_second{{kind="sent"}} {3 / RATE_WINDOW}', body)
+        self.assertIn('notify_active_connections{group="财务\\"组\\\\1\\n"} 1', body)
+    
+    def test_disabled_metrics_record_nothing(self):
+        """关闭指标时不记录任何数据，端点返回404"""
+        metrics.enabled = False
+        
+        async def flow():
+            communicator = await self.connect(self.op_user, 'operations_group_1')
+            await communicator.disconnect()
+        async_to_sync(flow)()
+        
+        self.assertEqual(metrics.histograms, {})
+        self.assertEqual(metrics.connections, {})
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+    
+    async def test_rejection_is_logged_with_fields(self):
+        """拒绝连接时记录带字段的结构化日志"""
+        with self.assertLogs('channel_notify.notifications.consumers', 'INFO') as logs:
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/finance_group_1/')
+            communicator.scope['url_route'] = {'kwargs': {'group_name': 'finance_group_1'}}
+            communicator.scope['user'] = self.op_user
+            connected, _ = await communicator.connect()
+        
+        self.assertFalse(connected)
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), 'websocket_rejected')
+        self.assertEqual(record.fields['reason'], 'not_in_group')
+
+class GroupRouterTests(TestCase):
+    """测试数据驱动的组路由表"""
+    
+    def setUp(self):
+        self.ops_group = Group.objects.create(name='operations_group_1')
+        self.fin_group_1 = Group.objects.create(name='finance_group_1')
+        self.fin_group_2 = Group.objects.create(name='finance_group_2')
+        self.audit_group = Group.objects.create(name='audit')
+        GroupRoute.objects.create(sender_group=self.ops_group, receiver_group=self.fin_group_1)
+        GroupRoute.objects.create(sender_group=self.ops_group, receiver_group=self.fin_group_2)
+        GroupRoute.objects.create(sender_group=self.ops_group, receiver_group=self.audit_group, bidirectional=False)
+    
+    def test_fan_out_and_reverse_routes(self):
+        """一个发送组可路由到多个接收组，双向路由生成反向条目，单向路由不生成"""
+        self.assertEqual(
+            dict(group_router.targets('operations_group_1')),
+            {'finance_group_1': self.fin_group_1.id, 'finance_group_2': self.fin_group_2.id, 'audit': self.audit_group.id}
+        )
+        self.assertEqual(dict(group_router.targets('finance_group_1')), {'operations_group_1': self.ops_group.id})
+        self.assertEqual(dict(group_router.targets('audit')), {})
+    
+    def test_lookup_does_not_query_and_route_change_swaps_table(self):
+        """路由表加载后查询不访问数据库，路由变更后替换为新表"""
+        group_router.load()
+        with self.assertNumQueries(0):
+            group_router.targets('operations_group_1')
+        
+        GroupRoute.objects.filter(receiver_group=self.audit_group).delete()
+        self.assertNotIn('audit', group_router.targets('operations_group_1'))
+    
+    def test_route_change_is_broadcast_to_other_processes(self):
+        """路由变更在事务提交后向失效组广播 routes 消息"""
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(INVALIDATION_GROUP, channel)
+        self.addCleanup(async_to_sync(layer.group_discard), INVALIDATION_GROUP, channel)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            GroupRoute.objects.filter(receiver_group=self.audit_group).delete()
+        
+        self.assertEqual(async_to_sync(layer.receive)(channel), {'type': 'notify.invalidate', 'kind': 'routes'})
+    
+    async def test_broadcast_invalidation_drops_table(self):
+        """其他进程广播的失效消息丢弃本进程已加载的路由表"""
+        async def app(scope, receive, send):
+            pass
+        
+        await InvalidationListenerMiddleware(app)({'type': 'http'}, None, None)
+        self.assertTrue(listener.running(asyncio.get_running_loop(), get_channel_layer()))
+        await database_sync_to_async(group_router.load)()
+        
+        await get_channel_layer().group_send(INVALIDATION_GROUP, {'type': 'notify.invalidate', 'kind': 'routes'})
+        for _ in range(100):
+            if not group_router.loaded:
+                break
+            await asyncio.sleep(0.01)
+        self.assertFalse(group_router.loaded)
+    
+    async def test_send_without_receiver_fans_out(self):
+        """未指定接收组时，通知扇出到路由表中的全部接收组"""
+        op_user = await User.objects.acreate(username='op1')
+        await self.ops_group.user_set.aadd(op_user)
+        receiver = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/finance_group_2/')
+        fin_user = await User.objects.acreate(username='fin2')
+        await self.fin_group_2.user_set.aadd(fin_user)
+        receiver.scope['url_route'] = {'kwargs': {'group_name': 'finance_group_2'}}
+        receiver.scope['user'] = fin_user
+        await receiver.connect()
+        await receiver.receive_json_from()
+        
+        sender = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/operations_group_1/')
+        sender.scope['url_route'] = {'kwargs': {'group_name': 'operations_group_1'}}
+        sender.scope['user'] = op_user
+        await sender.connect()
+        await sender.receive_json_from()
+        
+        await sender.send_json_to({'type': 'send_notification', 'content': '扇出通知'})
+        sent_to = {(await sender.receive_json_from())['message']['receiver_group'] for _ in range(3)}
+        
+        self.assertEqual(sent_to, {'finance_group_1', 'finance_group_2', 'audit'})
+        self.assertEqual(await Notification.objects.acount(), 3)
+        event = await receiver.receive_json_from()
+        self.assertEqual(event['message']['content'], '扇出通知')
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+
+
+class AtomicConfirmTests(TransactionTestCase):
+    """测试条件更新的确认路径"""
+    
+    CONFIRMERS = 8
+    
+    def setUp(self):
+        self.ops_group = Group.objects.create(name='operations_group_1')
+        self.fin_group = Group.objects.create(name='finance_group_1')
+        self.other_group = Group.objects.create(name='finance_group_2')
+        self.op_user = User.objects.create_user(username='op1', password='testpass')
+        self.confirmers = [
+            User.objects.create_user(username=f'fin{i}', password='testpass')
+            for i in range(self.CONFIRMERS)
+        ]
+        self.notification = Notification.objects.create(
+            content='并发确认', sender=self.op_user, sender_group=self.ops_group, receiver_group=self.fin_group
+        )
+    
+    def confirm(self, user, group_ids):
+        return async_to_sync(NotificationConsumer().confirm_notification_atomic)(
+            self.notification.id, user, group_ids
+        )
+    
+    def test_exactly_one_concurrent_confirmer_wins(self):
+        """N个确认者同时确认同一通知，只有一个成功，其余都得到已确认错误"""
+        barrier = threading.Barrier(self.CONFIRMERS)
+        results = []
+        
+        def worker(user):
+            barrier.wait()
+            try:
+                for attempt in range(100):
+                    try:
+                        results.append(('ok', self.confirm(user, {self.fin_group.id})))
+                        break
+                    except OperationalError as e:
+                        # 测试用的共享缓存内存库遇到表锁立即报错，重试以模拟文件库的 busy_timeout
+                        if 'locked' not in str(e):
+                            raise
+            except NotificationError as e:
+                results.append(('error', str(e)))
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=worker, args=(user,)) for user in self.confirmers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        winners = [result for status, result in results if status == 'ok']
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(
+            [result for status, result in results if status == 'error'],
+            ['该通知已经被确认'] * (self.CONFIRMERS - 1)
+        )
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'confirmed')
+        self.assertEqual(self.notification.confirmed_by.username, winners[0]['confirmed_by_username'])
+    
+    def test_confirm_rejects_other_groups_and_uses_one_update(self):
+        """非接收组成员无法确认；成功确认只需一个事务内的一条UPDATE和一条投影查询"""
+        with self.assertRaisesMessage(NotificationError, '您没有权限确认此通知'):
+            self.confirm(self.confirmers[0], {self.other_group.id})
+        
+        with CaptureQueriesContext(connection) as captured:
+            confirmed = self.confirm(self.confirmers[0], {self.fin_group.id})
+        statements = [query['sql'].split()[0].upper() for query in captured.captured_queries]
+        self.assertEqual([s for s in statements if s in ('SELECT', 'UPDATE')], ['UPDATE', 'SELECT'])
+        self.assertEqual(confirmed['sender_group_name'], 'operations_group_1')
+        self.assertEqual(confirmed['receiver_group_name'], 'finance_group_1')
+        
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.updated_at, self.notification.confirmed_at)
+
+
+class DatabasePoolTests(TransactionTestCase):
+    """测试消费者数据库调用的专用线程池"""
+    
+    def test_pool_runs_calls_concurrently_on_dedicated_threads(self):
+        """配置线程池后，数据库调用在 notify-db 线程上并行执行，不再串行排队"""
+        barrier = threading.Barrier(2, timeout=5)
+        
+        @database_sync_to_pool
+        def wait_for_peer():
+            barrier.wait()
+            return threading.current_thread().name
+        
+        async def run_pair():
+            return await asyncio.gather(wait_for_peer(), wait_for_peer())
+        
+        with override_settings(NOTIFY_DB_THREADS=2):
+            names = async_to_sync(run_pair)()
+        self.assertTrue(all(name.startswith('notify-db') for name in names), names)
+        
+        with override_settings(NOTIFY_DB_THREADS=0):
+            name = async_to_sync(database_sync_to_pool(lambda: threading.current_thread().name))()
+        self.assertFalse(name.startswith('notify-db'))
+    
+    def test_consumer_send_and_confirm_through_pool(self):
+        """消费者的发送与确认在线程池中完成，数据对其他连接可见"""
+        ops_group = Group.objects.create(name='operations_group_1')
+        fin_group = Group.objects.create(name='finance_group_1')
+        GroupRoute.objects.create(sender_group=ops_group, receiver_group=fin_group)
+        op_user = User.objects.create_user(username='op1', password='testpass')
+        op_user.groups.add(ops_group)
+        fin_user = User.objects.create_user(username='fin1', password='testpass')
+        fin_user.groups.add(fin_group)
+        
+        async def connect(user, group_name):
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/{group_name}/')
+            communicator.scope['url_route'] = {'kwargs': {'group_name': group_name}}
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()
+            return communicator
+        
+        async def flow():
+            sender = await connect(op_user, 'operations_group_1')
+            receiver = await connect(fin_user, 'finance_group_1')
+            await sender.send_json_to({'type': 'send_notification', 'content': '线程池'})
+            sent = await sender.receive_json_from()
+            await receiver.receive_json_from()
+            await receiver.send_json_to({'type': 'confirm_notification', 'notification_id': sent['message']['id']})
+            confirmed = await receiver.receive_json_from()
+            await sender.disconnect()
+            await receiver.disconnect()
+            return confirmed
+        
+        with override_settings(NOTIFY_DB_THREADS=2):
+            confirmed = async_to_sync(flow)()
+        
+        self.assertEqual(confirmed['type'], 'notification_confirmed')
+        self.assertEqual(Notification.objects.get().status, 'confirmed')
+
+class ConnectionStateCacheTests(TestCase):
+    """测试连接级组缓存及其失效"""
+    
+    def setUp(self):
+        self.ops_group = Group.objects.create(name='operations_group_1')
+        self.fin_group = Group.objects.create(name='finance_group_1')
+        self.fin_user = User.objects.create_user(username='fin1', password='testpass')
+        self.fin_user.groups.add(self.fin_group)
+    
+    async def connect(self):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/finance_group_1/')
+        communicator.scope['url_route'] = {'kwargs': {'group_name': 'finance_group_1'}}
+        communicator.scope['user'] = self.fin_user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        return communicator
+    
+    def change_groups(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+    
+    async def test_confirm_uses_cached_membership(self):
+        """确认通知时不再查询用户的组成员关系"""
+        op_user = await User.objects.acreate(username='op1')
+        notification = await Notification.objects.acreate(
+            content='待确认', sender=op_user, sender_group=self.ops_group, receiver_group=self.fin_group
+        )
+        communicator = await self.connect()
+        
+        with HopCounter() as hops:
+            await communicator.send_json_to({'type': 'confirm_notification', 'notification_id': notification.id})
+            response = await communicator.receive_json_from()
+        
+        self.assertEqual(response['type'], 'notification_confirmed')
+        self.assertEqual(hops.app_hops, 1)
+        await communicator.disconnect()
+    
+    async def test_removed_membership_closes_connection(self):
+        """用户被移出当前组后，连接收到失效广播并被关闭"""
+        communicator = await self.connect()
+        
+        await database_sync_to_async(self.change_groups)(lambda: self.fin_user.groups.remove(self.fin_group))
+        
+        output = await communicator.receive_output()
+        self.assertEqual(output['type'], 'websocket.close')
+        self.assertEqual(output['code'], 4403)
+    
+    async def test_reverse_membership_clear_closes_connection(self):
+        """通过 group.user_set 清空成员同样会使连接缓存失效"""
+        communicator = await self.connect()
+        
+        await database_sync_to_async(self.change_groups)(lambda: self.fin_group.user_set.clear())
+        
+        output = await communicator.receive_output()
+        self.assertEqual(output['type'], 'websocket.close')
+        self.assertEqual(output['code'], 4403)
+
+# 工作进程：加入组后打印 ready，收到一条组消息后打印消息内容
+LAYER_WORKER_SCRIPT = """
+import asyncio, json, sys
+from channel_notify.notifications.layers import SQLiteChannelLayer
+
+async def main(path, group):
+    layer = SQLiteChannelLayer(path=path)
+    channel = await layer.new_channel()
+    await layer.group_add(group, channel)
+    print('ready', flush=True)
+    message = await asyncio.wait_for(layer.receive(channel), 20)
+    print(json.dumps(message), flush=True)
+    await layer.close()
+
+asyncio.run(main(sys.argv[1], sys.argv[2]))
+"""
+
+
+class SQLiteChannelLayerTests(TestCase):
+    """测试跨进程 SQLite 通道层"""
+    
+    WORKERS = 4
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'layer.sqlite3')
+        self.addCleanup(self.tmpdir.cleanup)
+    
+    def test_group_send_reaches_every_worker_process(self):
+        """一个进程的组广播送达其他全部工作进程"""
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-c', LAYER_WORKER_SCRIPT, self.path, 'notify.finance'],
+                cwd=settings.BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            )
+            for _ in range(self.WORKERS)
+        ]
+        try:
+            for worker in workers:
+                self.assertEqual(worker.stdout.readline().strip(), 'ready', worker.stderr.read() if worker.poll() else '')
+            
+            layer = SQLiteChannelLayer(path=self.path)
+            async_to_sync(layer.group_send)('notify.finance', {'type': 'notification_message', 'message': {'id': 1}})
+            
+            for worker in workers:
+                output, errors = worker.communicate(timeout=30)
+                self.assertEqual(worker.returncode, 0, errors)
+                self.assertEqual(json.loads(output), {'type': 'notification_message', 'message': {'id': 1}})
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.kill()
+                    worker.communicate()
+    
+    def test_capacity_and_group_discard(self):
+        """通道满时 send 抛出 ChannelFull，退出组后不再收到组消息"""
+        from channels.exceptions import ChannelFull
+        
+        async def flow():
+            layer = SQLiteChannelLayer(path=self.path, capacity=2)
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'a'})
+            await layer.send(channel, {'type': 'b'})
+            with self.assertRaises(ChannelFull):
+                await layer.send(channel, {'type': 'c'})
+            self.assertEqual(await layer.receive(channel), {'type': 'a'})
+            self.assertEqual(await layer.receive(channel), {'type': 'b'})
+            
+            await layer.group_add('g', channel)
+            await layer.group_discard('g', channel)
+            await layer.group_send('g', {'type': 'd'})
+            await layer.send(channel, {'type': 'e'})
+            self.assertEqual(await layer.receive(channel), {'type': 'e'})
+            await layer.close()
+        
+        async_to_sync(flow)()
+    
+    def test_poll_survives_database_error(self):
+        """轮询时数据库出错（如锁超时）只记录日志，轮询任务继续运行"""
+        async def flow():
+            layer = SQLiteChannelLayer(path=self.path, poll_interval=0.001, max_poll_interval=0.01)
+            channel = await layer.new_channel()
+            fetch_prefix = layer._fetch_prefix
+            failures = [2]
+            
+            def flaky_fetch(prefix):
+                if failures[0]:
+                    failures[0] -= 1
+                    raise sqlite3.OperationalError('database is locked')
+                return fetch_prefix(prefix)
+            
+            layer._fetch_prefix = flaky_fetch
+            with self.assertLogs('channel_notify.notifications.layers', 'ERROR') as logs:
+                await layer.send(channel, {'type': 'a'})
+                self.assertEqual(await asyncio.wait_for(layer.receive(channel), 5), {'type': 'a'})
+            self.assertEqual(len(logs.records), 2)
+            await layer.close()
+        
+        async_to_sync(flow)()
+    
+    def test_cancelled_receive_releases_buffer(self):
+        """receive 被取消（连接关闭）时释放本地通道的缓冲区，即使其中还有未取出的消息"""
+        async def flow():
+            layer = SQLiteChannelLayer(path=self.path)
+            channel = await layer.new_channel()
+            receiver = asyncio.ensure_future(layer.receive(channel))
+            await asyncio.sleep(0)
+            layer._buffers[channel].put_nowait({'type': 'a'})
+            receiver.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await receiver
+            self.assertNotIn(channel, layer._buffers)
+            await layer.close()
+        
+        async_to_sync(flow)()
+    
+    async def test_consumer_delivery_over_sqlite_layer(self):
+        """消费者通过 SQLite 通道层完成发送与接收"""
+        ops_group = await Group.objects.acreate(name='operations_group_1')
+        fin_group = await Group.objects.acreate(name='finance_group_1')
+        await GroupRoute.objects.acreate(sender_group=ops_group, receiver_group=fin_group)
+        op_user = await User.objects.acreate(username='op1')
+        fin_user = await User.objects.acreate(username='fin1')
+        await op_user.groups.aadd(ops_group)
+        await fin_user.groups.aadd(fin_group)
+        
+        layers = {'default': {
+            'BACKEND': 'channel_notify.notifications.layers.SQLiteChannelLayer',
+            'CONFIG': {'path': self.path},
+        }}
+        with override_settings(CHANNEL_LAYERS=layers):
+            communicators = []
+            for user, group_name in ((op_user, 'operations_group_1'), (fin_user, 'finance_group_1')):
+                communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/{group_name}/')
+                communicator.scope['url_route'] = {'kwargs': {'group_name': group_name}}
+                communicator.scope['user'] = user
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+                await communicator.receive_json_from()
+                communicators.append(communicator)
+            sender, receiver = communicators
+            
+            await sender.send_json_to({'type': 'send_notification', 'content': '跨进程通道层'})
+            self.assertEqual((await sender.receive_json_from())['type'], 'notification_sent')
+            event = await receiver.receive_json_from(timeout=5)
+            self.assertEqual(event['message']['content'], '跨进程通道层')
+            
+            await sender.disconnect()
+            await receiver.disconnect()
+            await get_channel_layer().close()
+
+class WriteBehindTests(RoutedGroupsMixin, TestCase):
+    """测试写后模式：预留ID、日志先行、批量写入与崩溃后重放"""
+    
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+    
+    def use_write_behind(self, **options):
+        from . import consumers
+        buffer = WriteBehind(enabled=True, journal_dir=self.tmpdir.name, **options)
+        original = consumers.write_behind
+        consumers.write_behind = buffer
+        self.addCleanup(setattr, consumers, 'write_behind', original)
+        return buffer
+    
+    def segments(self):
+        return sorted(name for name in os.listdir(self.tmpdir.name) if name.startswith('journal-'))
+    
+    async def wait_for_count(self, count):
+        for _ in range(200):
+            if await Notification.objects.acount() == count:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f'通知数未达到 {count}')
+    
+    def test_reserved_ids_are_skipped_by_autoincrement(self):
+        """预留的ID块不会被之后的自增插入使用"""
+        ids = reserve_ids(5)
+        self.assertEqual(len(set(ids)), 5)
+        notification = Notification.objects.create(
+            content='自增', sender=self.op_user, sender_group=self.ops_group, receiver_group=self.fin_group
+        )
+        self.assertGreater(notification.id, max(ids))
+    
+    async def test_broadcast_precedes_insert_and_rows_trigger_flush(self):
+        """发送后立即广播并写入日志，缓冲满 FLUSH_ROWS 行时批量写入数据库并删除日志段"""
+        buffer = self.use_write_behind(flush_interval_ms=60000, flush_rows=3)
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        receiver = await self.connect(self.fin_user, 'finance_group_1')
+        
+        await sender.send_json_to({'type': 'send_notification', 'content': '先广播'})
+        sent = await sender.receive_json_from()
+        await sender.send_json_to({'type': 'send_notification', 'content': '第二条'})
+        await sender.receive_json_from()
+        event = await receiver.receive_json_from()
+        self.assertEqual(event['message']['id'], sent['message']['id'])
+        self.assertFalse(await Notification.objects.aexists())
+        self.assertEqual(len(self.segments()), 1)
+        
+        await sender.send_json_to({'type': 'send_notification', 'content': '第三条'})
+        await sender.receive_json_from()
+        await self.wait_for_count(3)
+        await buffer.flush()
+        stored = await Notification.objects.aget(id=sent['message']['id'])
+        self.assertEqual(stored.created_at.isoformat(), sent['message']['created_at'])
+        self.assertEqual(stored.status, 'pending')
+        self.assertEqual(self.segments(), [])
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+        await buffer.close()
+    
+    async def test_interval_flush_and_confirm_of_buffered_notification(self):
+        """后台任务按间隔写入；确认尚在缓冲区中的通知时先写入数据库"""
+        buffer = self.use_write_behind(flush_interval_ms=20)
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        receiver = await self.connect(self.fin_user, 'finance_group_1')
+        
+        await sender.send_json_to({'type': 'send_notification', 'content': '按间隔写入'})
+        await sender.receive_json_from()
+        await receiver.receive_json_from()
+        await self.wait_for_count(1)
+        
+        buffer.flush_interval = 60
+        await sender.send_json_to({'type': 'send_notification', 'content': '立即确认'})
+        sent = await sender.receive_json_from()
+        await receiver.receive_json_from()
+        self.assertTrue(buffer.is_pending([sent['message']['id']]))
+        await receiver.send_json_to({'type': 'confirm_notification', 'notification_id': sent['message']['id']})
+        confirmed = await receiver.receive_json_from()
+        self.assertEqual(confirmed['type'], 'notification_confirmed')
+        self.assertEqual((await Notification.objects.aget(id=sent['message']['id'])).status, 'confirmed')
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+        await buffer.close()
+    
+    async def test_delta_poll_between_broadcast_and_flush(self):
+        """广播之后、写入之前做过增量查询的客户端，以查询时间为新位置再次查询时能取到写入后的通知"""
+        buffer = self.use_write_behind(flush_interval_ms=60000)
+        await database_sync_to_async(self.client.force_login)(self.fin_user)
+        
+        async def poll(since):
+            response = await database_sync_to_async(self.client.get)(
+                '/api/notifications/', {'direction': 'received', 'updated_since': since.isoformat()}
+            )
+            return [row['id'] for row in response.json()['received_notifications']]
+        
+        start = timezone.now()
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        await sender.send_json_to({'type': 'send_notification', 'content': '尚未写入'})
+        sent = await sender.receive_json_from()
+        self.assertTrue(buffer.is_pending([sent['message']['id']]))
+        self.assertEqual(await poll(start), [])
+        checkpoint = timezone.now()
+        
+        await buffer.flush()
+        self.assertEqual(await poll(checkpoint), [sent['message']['id']])
+        
+        await sender.disconnect()
+        await buffer.close()
+    
+    async def test_journal_is_replayed_on_start(self):
+        """崩溃时残留的日志在下次启动时写入数据库，写了一半的末行被丢弃"""
+        ids = await database_sync_to_async(reserve_ids)(2)
+        now = timezone.now()
+        lines = [
+            journal_line(Notification(
+                id=notification_id, content=f'崩溃前{notification_id}', sender_id=self.op_user.id,
+                sender_group_id=self.ops_group.id, receiver_group_id=self.fin_group.id, created_at=now
+            ))
+            for notification_id in ids
+        ]
+        crashed = Journal(self.tmpdir.name)
+        crashed.open()
+        crashed.append(lines)
+        crashed.rotate()
+        crashed.append([lines[0]])  # 已写入的行重复出现时只写入一次
+        crashed.close()
+        with open(os.path.join(self.tmpdir.name, self.segments()[-1]), 'a') as journal_file:
+            journal_file.write('{"id": 99')
+        
+        buffer = WriteBehind(enabled=True, journal_dir=self.tmpdir.name)
+        await buffer.start()
+        
+        stored = [n async for n in Notification.objects.order_by('id')]
+        self.assertEqual([n.id for n in stored], ids)
+        self.assertEqual(stored[0].created_at, now)
+        self.assertEqual(self.segments(), [])
+        self.assertEqual(
+            await NotificationCounter.objects.filter(scope='group', owner_id=self.fin_group.id).values_list('pending', flat=True).aget(),
+            2
+        )
+        with self.assertRaises(RuntimeError):
+            await database_sync_to_async(Journal(self.tmpdir.name).open)()
+        await buffer.close()
+
+
+class WriteBehindRejectTests(RoutedGroupsMixin, TransactionTestCase):
+    """测试写后模式的约束违反处理与配置检查（外键约束在提交时检查，需要真实事务）"""
+    
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+    
+    def notification(self, notification_id, receiver_group_id):
+        now = timezone.now()
+        return Notification(
+            id=notification_id, content=f'通知{notification_id}', sender_id=self.op_user.id,
+            sender_group_id=self.ops_group.id, receiver_group_id=receiver_group_id, created_at=now, updated_at=now
+        )
+    
+    def dead_letters(self):
+        with open(os.path.join(self.tmpdir.name, 'dead-letter.jsonl'), encoding='utf-8') as dead_letter_file:
+            return [json.loads(line)['id'] for line in dead_letter_file]
+    
+    async def test_rows_violating_constraints_go_to_dead_letter(self):
+        """违反外键约束的通知转入死信文件，同批其他通知照常写入；重放与后台写入都不再反复失败"""
+        good, bad, later = await database_sync_to_async(reserve_ids)(3)
+        missing_group = self.fin_group.id + 1000
+        crashed = Journal(self.tmpdir.name)
+        crashed.open()
+        crashed.append([journal_line(self.notification(good, self.fin_group.id)), journal_line(self.notification(bad, missing_group))])
+        crashed.close()
+        
+        buffer = WriteBehind(enabled=True, journal_dir=self.tmpdir.name)
+        with self.assertLogs('channel_notify.notifications.writebehind', 'ERROR'):
+            await buffer.start()
+        self.assertEqual([n.id async for n in Notification.objects.order_by('id')], [good])
+        self.assertEqual(self.dead_letters(), [bad])
+        
+        with self.assertLogs('channel_notify.notifications.writebehind', 'ERROR'):
+            await buffer.submit([self.notification(later, missing_group)])
+            await buffer.flush()
+        self.assertFalse(buffer.is_pending([later]))
+        self.assertEqual(self.dead_letters(), [bad, later])
+        self.assertEqual(await Notification.objects.acount(), 1)
+        await buffer.close()
+        self.assertEqual(sorted(name for name in os.listdir(self.tmpdir.name) if name.startswith('journal-')), [])
+    
+    def test_unsupported_database_fails_at_configuration(self):
+        """不支持的数据库在加载配置时报错，而不是在第一次发送时"""
+        with mock.patch.object(connection, 'vendor', 'mysql'), self.assertRaises(ImproperlyConfigured):
+            WriteBehind(enabled=True, journal_dir=self.tmpdir.name)
+    
+    def test_second_writer_on_same_database_is_rejected(self):
+        """同一数据库只允许一个进程开启写后模式，即使日志目录不同"""
+        lock = os.path.join(self.tmpdir.name, 'db.sqlite3.write-behind.lock')
+        first = Journal(os.path.join(self.tmpdir.name, 'a'), writer_lock=lock)
+        first.open()
+        self.addCleanup(first.close)
+        with self.assertRaises(RuntimeError):
+            Journal(os.path.join(self.tmpdir.name, 'b'), writer_lock=lock).open()
+        first.close()
+        second = Journal(os.path.join(self.tmpdir.name, 'b'), writer_lock=lock)
+        second.open()
+        second.close()
+
+
+class CounterTests(RoutedGroupsMixin, TestCase):
+    """测试增量维护的待确认计数"""
+    
+    def setUp(self):
+        counter_cache.clear()
+        self.addCleanup(counter_cache.clear)
+        super().setUp()
+    
+    async def connect(self, user, group_name):
+        # 本类的连接都订阅待确认计数
+        return await super().connect(user, group_name, '?counters=1')
+    
+    async def test_counters_follow_send_and_confirm(self):
+        """订阅计数的连接收到初始计数，发送与确认后收到更新后的组计数与发送者计数"""
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        receiver = await self.connect(self.fin_user, 'finance_group_1')
+        self.assertEqual(
+            await sender.receive_json_from(),
+            {'type': 'counters', 'groups': {'operations_group_1': 0}, 'sent_pending': 0}
+        )
+        self.assertEqual(
+            await receiver.receive_json_from(),
+            {'type': 'counters', 'groups': {'finance_group_1': 0}, 'sent_pending': 0}
+        )
+        
+        await sender.send_json_to({'type': 'send_notifications', 'contents': ['一', '二']})
+        self.assertEqual((await sender.receive_json_from())['type'], 'send_notifications_result')
+        self.assertEqual(await sender.receive_json_from(), {'type': 'counters', 'sent_pending': 2})
+        batch = await receiver.receive_json_from()
+        self.assertEqual(batch['type'], 'notification_batch')
+        self.assertEqual(await receiver.receive_json_from(), {'type': 'counters', 'groups': {'finance_group_1': 2}})
+        
+        await receiver.send_json_to({'type': 'confirm_notification', 'notification_id': batch['messages'][0]['id']})
+        self.assertEqual((await receiver.receive_json_from())['type'], 'notification_confirmed')
+        self.assertEqual(await receiver.receive_json_from(), {'type': 'counters', 'groups': {'finance_group_1': 1}})
+        self.assertEqual((await sender.receive_json_from())['type'], 'notification_confirmed')
+        self.assertEqual(await sender.receive_json_from(), {'type': 'counters', 'sent_pending': 1})
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+    
+    def test_counts_endpoint_reads_counters_without_aggregation(self):
+        """计数接口读取计数表而不聚合通知表，缓存有效期内不再查询计数表"""
+        notifications = Notification.objects.bulk_create([
+            Notification(content=f'计数{i}', sender=self.op_user, sender_group=self.ops_group, receiver_group=self.fin_group)
+            for i in range(3)
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_deltas({self.fin_group.id: 3}, {self.op_user.id: 3})
+        counter_cache.clear()
+        self.client.login(username='fin1', password='testpass')
+        
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('notification_counts'))
+        self.assertEqual(response.json(), {'status': 'success', 'groups': {'finance_group_1': 3}, 'sent_pending': 0})
+        self.assertFalse([query for query in captured.captured_queries if 'COUNT(' in query['sql'].upper()])
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('notification_counts'))
+        self.assertFalse([query for query in captured.captured_queries if 'notificationcounter' in query['sql']])
+        
+        # 绕过发送/确认路径删除通知后，重建命令按通知表恢复计数
+        notifications[0].delete()
+        call_command('rebuild_notification_counters', stdout=open(os.devnull, 'w'))
+        self.assertEqual(
+            counter_cache.load([('group', self.fin_group.id), ('user', self.op_user.id)]),
+            {('group', self.fin_group.id): 2, ('user', self.op_user.id): 2}
+        )
+
+class RateLimitTests(RoutedGroupsMixin, TestCase):
+    """测试按用户与发送组的令牌桶限流"""
+    
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+    
+    def limiter(self, config):
+        return RateLimiter(config, clock=lambda: self.now)
+    
+    def test_buckets_refill_and_report_retry_after(self):
+        """桶耗尽后抛出带重试时间的 Throttled 且不消耗令牌；按组覆盖的限额独立生效"""
+        limiter = self.limiter({
+            'USER': {'RATE': 1, 'BURST': 2},
+            'GROUP': {'RATE': 10, 'BURST': 3},
+            'GROUPS': {'finance_group_1': {'USER': {'RATE': 0}}},
+        })
+        limiter.acquire(1, 'operations_group_1')
+        limiter.acquire(1, 'operations_group_1')
+        with self.assertRaises(Throttled) as raised:
+            limiter.acquire(1, 'operations_group_1')
+        self.assertEqual((raised.exception.scope, raised.exception.retry_after), ('user', 1.0))
+        
+        # 同组的另一用户共享组桶
+        limiter.acquire(2, 'operations_group_1')
+        with self.assertRaises(Throttled) as raised:
+            limiter.acquire(3, 'operations_group_1')
+        self.assertEqual(raised.exception.scope, 'group')
+        
+        self.now = 0.5
+        with self.assertRaises(Throttled) as raised:
+            limiter.acquire(1, 'operations_group_1')
+        self.assertAlmostEqual(raised.exception.retry_after, 0.5)
+        self.now = 1.0
+        limiter.acquire(1, 'operations_group_1')
+        
+        # finance_group_1 不限制用户，只受组桶限制；超过桶容量的批量永远无法放行
+        for _ in range(3):
+            limiter.acquire(1, 'finance_group_1')
+        with self.assertRaises(Throttled) as raised:
+            limiter.acquire(2, 'operations_group_1', cost=5)
+        self.assertIsNone(raised.exception.retry_after)
+        
+        # 补满的桶在清理时丢弃
+        self.now = 1000.0
+        limiter.acquire(4, 'operations_group_1')
+        self.assertEqual(set(limiter._buckets), {('user', 4), ('group', 'operations_group_1')})
+    
+    async def test_consumer_replies_throttled_without_storing(self):
+        """超出限流的发送收到 throttled 帧，不写入数据库、不广播"""
+        from . import consumers
+        original = consumers.rate_limiter
+        consumers.rate_limiter = self.limiter({'USER': {'RATE': 0.5, 'BURST': 2}})
+        self.addCleanup(setattr, consumers, 'rate_limiter', original)
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        receiver = await self.connect(self.fin_user, 'finance_group_1')
+        
+        await sender.send_json_to({'type': 'send_notification', 'content': '放行'})
+        self.assertEqual((await sender.receive_json_from())['type'], 'notification_sent')
+        await sender.send_json_to({'type': 'send_notifications', 'contents': ['一', '二']})
+        throttled = await sender.receive_json_from()
+        self.assertEqual(throttled['type'], 'throttled')
+        self.assertEqual(throttled['request_type'], 'send_notifications')
+        self.assertEqual(throttled['scope'], 'user')
+        self.assertEqual(throttled['retry_after'], 2.0)
+        
+        self.assertEqual((await receiver.receive_json_from())['type'], 'notification_message')
+        self.assertTrue(await receiver.receive_nothing())
+        self.assertEqual(await Notification.objects.acount(), 1)
+        
+        await sender.disconnect()
+        await receiver.disconnect()
+
+
+class OutboundQueueTests(RoutedGroupsMixin, TestCase):
+    """测试连接的有界发送队列：停滞的客户端不拖慢同组其他连接，溢出按策略处理"""
+    
+    def setUp(self):
+        super().setUp()
+        # fin1 是停滞的连接，fin_fast 是同组的正常连接
+        fast_user = User.objects.create_user(username='fin_fast', password='testpass')
+        fast_user.groups.add(self.fin_group)
+        self.fin_users = [self.fin_user, fast_user]
+        self.stall = asyncio.Event()
+        enabled = metrics.enabled
+        self.addCleanup(setattr, metrics, 'enabled', enabled)
+        self.addCleanup(metrics.reset)
+        metrics.reset()
+        metrics.enabled = True
+    
+    async def connect(self, user, group_name):
+        stall = self.stall
+        slow_user_id = self.fin_users[0].id
+        
+        class StalledConsumer(NotificationConsumer):
+            # 模拟网络很差的客户端：连接建立后的写入一直阻塞，直到测试放行
+            async def send_frame(self, frame):
+                if self.user.id == slow_user_id and self.accepted and 'connection_established' not in frame:
+                    await stall.wait()
+                await super().send_frame(frame)
+        
+        communicator = WebsocketCommunicator(StalledConsumer.as_asgi(), f'/ws/notifications/{group_name}/')
+        communicator.scope['url_route'] = {'kwargs': {'group_name': group_name}}
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        return communicator
+    
+    async def flood(self, policy, count=6):
+        """停滞连接的队列上限为3，发送 count 条通知；返回 (发送端, 停滞连接, 正常连接, 快速连接收到的帧)"""
+        with override_settings(NOTIFY_OUTBOUND_QUEUE={'MAX_FRAMES': 3, 'POLICY': policy}):
+            sender = await self.connect(self.op_user, 'operations_group_1')
+            slow = await self.connect(self.fin_users[0], 'finance_group_1')
+            fast = await self.connect(self.fin_users[1], 'finance_group_1')
+        received = []
+        for i in range(count):
+            await sender.send_json_to({'type': 'send_notification', 'content': f'通知{i}'})
+            await sender.receive_json_from()
+            # 正常连接在停滞连接放行之前就收到每一条通知
+            received.append(await fast.receive_json_from(timeout=1))
+        return sender, slow, fast, received
+    
+    async def close_all(self, *communicators):
+        self.stall.set()
+        for communicator in communicators:
+            await communicator.disconnect()
+    
+    async def test_drop_oldest_sends_gap_marker(self):
+        """drop_oldest：停滞期间丢弃最旧的帧，放行后先收到 gap 标记再收到最新的帧"""
+        sender, slow, fast, received = await self.flood('drop_oldest')
+        self.assertEqual([event['message']['content'] for event in received], [f'通知{i}' for i in range(6)])
+        
+        self.stall.set()
+        frames = [await slow.receive_json_from() for _ in range(5)]
+        # 第一条已在写入中，其后的队列只保留最新的3条
+        self.assertEqual(frames[0]['message']['content'], '通知0')
+        self.assertEqual((frames[1]['type'], frames[1]['dropped']), ('gap', 2))
+        self.assertEqual([frame['message']['content'] for frame in frames[2:]], ['通知3', '通知4', '通知5'])
+        self.assertTrue(await slow.receive_nothing())
+        await self.close_all(sender, slow, fast)
+        
+        body = metrics.render()
+        self.assertIn('notify_outbound_overflow_total{policy="drop_oldest"} 2', body)
+        self.assertIn('notify_outbound_queue_depth_bucket{le="+Inf"}', body)
+        self.assertEqual(metrics.outbound_queued, 0)
+    
+    async def test_coalesce_merges_queued_notifications(self):
+        """coalesce：队列满时把排队的通知合并为一条 notification_batch，不丢失通知"""
+        sender, slow, fast, _ = await self.flood('coalesce')
+        
+        self.stall.set()
+        frames = [await slow.receive_json_from() for _ in range(4)]
+        self.assertEqual(frames[0]['message']['content'], '通知0')
+        self.assertEqual(frames[1]['type'], 'notification_batch')
+        self.assertEqual([message['content'] for message in frames[1]['messages']], ['通知1', '通知2', '通知3'])
+        self.assertEqual([frame['message']['content'] for frame in frames[2:]], ['通知4', '通知5'])
+        self.assertTrue(await slow.receive_nothing())
+        await self.close_all(sender, slow, fast)
+    
+    def test_coalesce_keeps_notify_confirm_order(self):
+        """coalesce 只合并相邻的同类帧：某条通知的确认不会被提前到这条通知之前"""
+        def frame(kind, **fields):
+            return (kind, dumps({'type': kind, **fields}))
+        
+        merged = coalesce([
+            frame('notification_message', message={'id': 1}),
+            frame('notification_message', message={'id': 2}),
+            frame('counters', groups={'finance_group_1': 2}),
+            frame('notification_confirmed', message={'id': 1}),
+            frame('notification_message', message={'id': 3}),
+            frame('counters', groups={'finance_group_1': 1}),
+            frame('notification_confirmed', message={'id': 3}),
+        ])
+        events = [json.loads(value) for _, value in merged]
+        self.assertEqual([kind for kind, _ in merged], [
+            'notification_batch', 'notifications_confirmed', 'notification_batch', 'counters', 'notifications_confirmed'
+        ])
+        self.assertEqual([[message['id'] for message in event['messages']] for event in events if 'messages' in event], [[1, 2], [1], [3], [3]])
+        # 计数合并为一帧最新的值，放在最后一个计数帧的位置
+        self.assertEqual(events[3]['groups'], {'finance_group_1': 1})
+    
+    async def test_disconnect_policy_closes_slow_connection(self):
+        """disconnect：队列溢出时关闭停滞的连接，其他连接不受影响"""
+        sender, slow, fast, received = await self.flood('disconnect', count=5)
+        self.assertEqual(len(received), 5)
+        
+        output = await slow.receive_output()
+        self.assertEqual(output, {'type': 'websocket.close', 'code': OVERFLOW_CLOSE_CODE})
+        await self.close_all(sender, fast)
+
+
+class HandshakeAuthTests(TestCase):
+    """测试握手认证缓存"""
+    
+    def setUp(self):
+        self.fin_group = Group.objects.create(name='finance_group_1')
+        self.user = User.objects.create_user(username='fin1', password='testpass')
+        self.user.groups.add(self.fin_group)
+        handshake_cache.clear()
+        self.addCleanup(handshake_cache.clear)
+    
+    async def connect(self, cookie):
+        application = HandshakeAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        communicator = WebsocketCommunicator(application, '/ws/notifications/finance_group_1/', headers=[cookie])
+        connected, code = await communicator.connect()
+        if connected:
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+        return connected, code
+    
+    async def test_reconnect_skips_session_and_group_queries(self):
+        """同一会话再次握手时命中缓存，连接建立过程不执行任何 SQL"""
+        cookie = await database_sync_to_async(login_cookie)(self.user)
+        with QueryCounter() as first:
+            connected, _ = await self.connect(cookie)
+        self.assertTrue(connected)
+        self.assertGreater(first.queries, 0)
+        
+        with QueryCounter() as second:
+            connected, _ = await self.connect(cookie)
+        self.assertTrue(connected)
+        self.assertEqual(second.queries, 0)
+        
+        connected, code = await self.connect((b'cookie', f'{settings.SESSION_COOKIE_NAME}=invalid'.encode()))
+        self.assertFalse(connected)
+        self.assertEqual(code, 401)
+    
+    async def test_group_change_invalidates_cached_membership(self):
+        """用户被移出组后，缓存失效，下次握手按最新成员关系被拒绝"""
+        cookie = await database_sync_to_async(login_cookie)(self.user)
+        self.assertTrue((await self.connect(cookie))[0])
+        
+        def remove():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.groups.remove(self.fin_group)
+        await database_sync_to_async(remove)()
+        
+        self.assertEqual(await self.connect(cookie), (False, 403))
+    
+    def test_logout_invalidates_session(self):
+        """登出后同一会话键解析为匿名用户"""
+        self.client.login(username='fin1', password='testpass')
+        session_key = self.client.session.session_key
+        user, groups = async_to_sync(HandshakeAuthMiddleware.resolve)(session_key)
+        self.assertEqual((user.pk, groups), (self.user.pk, ((self.fin_group.id, 'finance_group_1'),)))
+        
+        self.client.logout()
+        user, groups = async_to_sync(HandshakeAuthMiddleware.resolve)(session_key)
+        self.assertFalse(user.is_authenticated)
+    
+    async def test_broadcast_invalidation_from_other_process(self):
+        """其他进程经频道层广播的用户、会话与组失效消息丢弃本进程的缓存项"""
+        cookie = await database_sync_to_async(login_cookie)(self.user)
+        # 握手时启动本进程的失效频道
+        self.assertTrue((await self.connect(cookie))[0])
+        session_key = cookie[1].decode().split('=', 1)[1]
+        messages = (
+            {'kind': 'users', 'user_ids': [self.user.pk]},
+            {'kind': 'session', 'digest': handshake_cache.digest(session_key).hex()},
+            {'kind': 'groups'},
+        )
+        for message in messages:
+            with self.subTest(kind=message['kind']):
+                await HandshakeAuthMiddleware.resolve(session_key)
+                self.assertIsNotNone(handshake_cache.get(session_key))
+                await get_channel_layer().group_send(INVALIDATION_GROUP, {'type': 'notify.invalidate', **message})
+                for _ in range(100):
+                    if handshake_cache.get(session_key) is None:
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertIsNone(handshake_cache.get(session_key))
+    
+    def test_logout_broadcasts_session_digest(self):
+        """匿名登出只广播会话键摘要，不在频道层中传递会话键本身"""
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(INVALIDATION_GROUP, channel)
+        self.addCleanup(async_to_sync(layer.group_discard), INVALIDATION_GROUP, channel)
+        
+        request = SimpleNamespace(session=SimpleNamespace(session_key='secret-session-key'))
+        with self.captureOnCommitCallbacks(execute=True):
+            user_logged_out.send(sender=User, request=request, user=None)
+        
+        self.assertEqual(async_to_sync(layer.receive)(channel), {
+            'type': 'notify.invalidate', 'kind': 'session',
+            'digest': handshake_cache.digest('secret-session-key').hex(),
+        })
+    
+    def test_session_engines(self):
+        """signed_cookies 与 cached_db 会话引擎均可解析"""
+        for engine in ('signed_cookies', 'cached_db'):
+            with self.subTest(engine=engine), self.settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                _, cookie = login_cookie(self.user)
+                session_key = cookie.decode().split('=', 1)[1]
+                user, _ = async_to_sync(HandshakeAuthMiddleware.resolve)(session_key)
+                self.assertEqual(user.pk, self.user.pk)
+                self.assertIsNotNone(handshake_cache.get(session_key))
+    
+    def test_cache_is_bounded_lru_with_ttl(self):
+        """超出容量淘汰最久未用的项，过期项不返回，解析期间发生失效的结果不写入"""
+        now = [0.0]
+        cache = HandshakeAuthCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        alice, bob = User(pk=1), User(pk=2)
+        cache.set('a', alice, (), 3600, cache.generation)
+        cache.set('b', bob, (), 3600, cache.generation)
+        cache.get('a')
+        cache.set('c', bob, (), 3600, cache.generation)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), (alice, ()))
+        
+        cache.invalidate_users([2])
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(len(cache), 1)
+        
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+        
+        generation = cache.generation
+        cache.invalidate_session('a')
+        cache.set('a', alice, (), 3600, generation)
+        self.assertIsNone(cache.get('a'))
+        # 会话剩余有效期短于 TTL 时以会话为准
+        cache.set('a', alice, (), 1, cache.generation)
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+
+
+class HeartbeatTests(TestCase):
+    """测试服务端心跳与失效连接回收"""
+    
+    def setUp(self):
+        from . import consumers
+        self.fin_group = Group.objects.create(name='finance_group_1')
+        self.users = [User.objects.create_user(username=name) for name in ('fin_alive', 'fin_dead')]
+        for user in self.users:
+            user.groups.add(self.fin_group)
+        self.wheel = HeartbeatWheel(interval=0.2, misses=1, slots=4)
+        original = consumers.heartbeat
+        consumers.heartbeat = self.wheel
+        self.addCleanup(setattr, consumers, 'heartbeat', original)
+        # 测试检查各连接在频道层组中的成员关系，固定使用逐连接订阅
+        original = consumers.local_fanout
+        consumers.local_fanout = LocalFanout(enabled=False)
+        self.addCleanup(setattr, consumers, 'local_fanout', original)
+        enabled = metrics.enabled
+        self.addCleanup(setattr, metrics, 'enabled', enabled)
+        self.addCleanup(metrics.reset)
+        metrics.reset()
+        metrics.enabled = True
+    
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/finance_group_1/')
+        communicator.scope['url_route'] = {'kwargs': {'group_name': 'finance_group_1'}}
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        return communicator
+    
+    async def test_unresponsive_connection_is_reaped(self):
+        """回复 pong 的连接保持在线；不响应 ping 的连接被关闭并立即退出频道层的组"""
+        channel_layer = get_channel_layer()
+        # 内存频道层在测试之间共享，只看本测试加入的频道
+        existing = set(channel_layer.groups.get('finance_group_1', ()))
+        
+        def members():
+            return set(channel_layer.groups.get('finance_group_1', ())) - existing
+        
+        alive = await self.connect(self.users[0])
+        dead = await self.connect(self.users[1])
+        self.assertEqual(len(members()), 2)
+        
+        async def respond():
+            while True:
+                ping = await alive.receive_json_from(timeout=2)
+                self.assertEqual(ping, {'type': 'ping', 'interval': 0.2})
+                await alive.send_json_to({'type': 'pong'})
+        
+        responder = asyncio.ensure_future(respond())
+        self.assertEqual((await dead.receive_json_from(timeout=1))['type'], 'ping')
+        output = await dead.receive_output(timeout=1)
+        self.assertEqual((output['type'], output['code']), ('websocket.close', 4009))
+        self.assertEqual(len(members()), 1)
+        self.assertEqual(len(self.wheel), 1)
+        
+        # 再经过几个周期，回复 pong 的连接仍然在线
+        await asyncio.sleep(0.6)
+        self.assertFalse(responder.done())
+        responder.cancel()
+        self.assertIn('notify_reaped_connections_total 1', metrics.render())
+        self.assertIn('notify_active_connections{group="finance_group_1"} 1', metrics.render())
+        
+        await dead.disconnect()
+        await alive.disconnect()
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(members(), set())
+        # 没有连接时心跳任务退出
+        await asyncio.sleep(0.1)
+        self.assertTrue(self.wheel.task.done())
+
+class LocalFanoutTests(RoutedGroupsMixin, TestCase):
+    """测试进程内扇出：组广播在频道层中每个进程只投递一次"""
+    
+    def setUp(self):
+        from . import consumers
+        super().setUp()
+        self.fin_users = [self.fin_user] + [User.objects.create_user(username=f'fin{i}') for i in (2, 3)]
+        for user in self.fin_users[1:]:
+            user.groups.add(self.fin_group)
+        self.fanout = LocalFanout(enabled=True)
+        original = consumers.local_fanout
+        consumers.local_fanout = self.fanout
+        self.addCleanup(setattr, consumers, 'local_fanout', original)
+        enabled = metrics.enabled
+        self.addCleanup(setattr, metrics, 'enabled', enabled)
+        self.addCleanup(metrics.reset)
+        metrics.reset()
+        metrics.enabled = True
+    
+    async def test_broadcast_crosses_layer_once(self):
+        """组内多个本地连接时频道层的组中只有一个扇出频道，各连接收到同一帧及组计数"""
+        channel_layer = get_channel_layer()
+        existing = set(channel_layer.groups.get('finance_group_1', ()))
+        receivers = []
+        for user in self.fin_users:
+            receiver = await self.connect(user, 'finance_group_1', '?counters=1')
+            await receiver.receive_json_from()
+            receivers.append(receiver)
+        self.assertEqual(set(channel_layer.groups['finance_group_1']) - existing, {self.fanout.channel_name})
+        self.assertEqual(len(self.fanout.groups['finance_group_1']), 3)
+        
+        sender = await self.connect(self.op_user, 'operations_group_1')
+        await sender.send_json_to({'type': 'send_notification', 'content': '扇出'})
+        self.assertEqual((await sender.receive_json_from())['type'], 'notification_sent')
+        for receiver in receivers:
+            frames = {}
+            for _ in range(2):
+                frame = await receiver.receive_json_from()
+                frames[frame['type']] = frame
+            self.assertEqual(frames['notification_message']['message']['content'], '扇出')
+            self.assertEqual(frames['counters'], {'type': 'counters', 'groups': {'finance_group_1': 1}})
+        self.assertIn('notify_messages_total{kind="delivered"} 3', metrics.render())
+        
+        # 最后一个本地连接离开时扇出频道才退出频道层的组
+        await receivers[0].disconnect()
+        self.assertIn(self.fanout.channel_name, channel_layer.groups['finance_group_1'])
+        for receiver in receivers[1:]:
+            await receiver.disconnect()
+        self.assertEqual(set(channel_layer.groups.get('finance_group_1', ())) - existing, set())
+        self.assertNotIn('finance_group_1', self.fanout.groups)
+        await sender.disconnect()
+    
+    async def test_membership_outlives_layer_group_expiry(self):
+        """组内一直有本地连接时，扇出频道在频道层的组过期之前续期，之后加入的连接同样收到广播"""
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'group_expiry': 1}}}
+        with override_settings(CHANNEL_LAYERS=layers):
+            first = await self.connect(self.fin_users[0], 'finance_group_1')
+            await asyncio.sleep(1.5)
+            second = await self.connect(self.fin_users[1], 'finance_group_1')
+            await asyncio.sleep(1.5)
+            await get_channel_layer().group_send('finance_group_1', {
+                'type': 'notification_message', 'group': 'finance_group_1',
+                'frame': json.dumps({'type': 'notification_message', 'message': {'content': '续期'}})
+            })
+            for communicator in (first, second):
+                self.assertEqual((await communicator.receive_json_from())['message']['content'], '续期')
+                await communicator.disconnect()
+    
+    async def test_receive_error_does_not_stop_fanout(self):
+        """频道层接收出错时记录日志后重试，扇出任务继续运行"""
+        self.fanout.retry_delay = 0.01
+        receiver = await self.connect(self.fin_users[0], 'finance_group_1')
+        channel_layer = get_channel_layer()
+        receive = channel_layer.receive
+        failures = [RuntimeError('layer unavailable')]
+        
+        async def flaky_receive(channel):
+            if failures:
+                raise failures.pop()
+            return await receive(channel)
+        
+        channel_layer.receive = flaky_receive
+        self.addCleanup(delattr, channel_layer, 'receive')
+        # 扇出任务当前阻塞在原 receive 中，先送达一条消息让它进入下一次（失败的）接收
+        with self.assertLogs('channel_notify.notifications.fanout', 'ERROR'):
+            for content in ('一', '二'):
+                await channel_layer.group_send('finance_group_1', {
+                    'type': 'notification_message', 'group': 'finance_group_1',
+                    'frame': json.dumps({'type': 'notification_message', 'message': {'content': content}})
+                })
+                self.assertEqual((await receiver.receive_json_from())['message']['content'], content)
+        self.assertEqual(failures, [])
+        self.assertFalse(self.fanout.task.done())
+        await receiver.disconnect()
+
+class ConnectionFootprintTests(TestCase):
+    """测试空闲连接的内存占用"""
+    
+    CONNECTIONS = 200
+    # 每个空闲连接的字节数上限（含测试通信器与内存频道层的队列），当前实测约 19KB
+    MAX_BYTES_PER_CONNECTION = 24 * 1024
+    
+    def setUp(self):
+        self.fin_group = Group.objects.create(name='finance_group_1')
+        self.users = [User.objects.create_user(username=f'fin{i}') for i in range(self.CONNECTIONS)]
+        self.groups = ((self.fin_group.id, self.fin_group.name),)
+    
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/finance_group_1/')
+        # 与 HandshakeAuthMiddleware 交给消费者的 scope 相同
+        communicator.scope.update(
+            url_route={'kwargs': {'group_name': 'finance_group_1'}},
+            user=ConnectionUser.from_user(user), notify_groups=self.groups,
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        return communicator
+    
+    async def test_idle_connection_footprint(self):
+        """空闲连接只持有精简的用户与共享的组状态，平均内存占用不超过上限"""
+        # 预热：导入、类属性缓存等一次性分配不计入
+        await (await self.connect(self.users[0])).disconnect()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            communicators = [await self.connect(user) for user in self.users]
+            gc.collect()
+            per_connection = (tracemalloc.get_traced_memory()[0] - baseline) / len(communicators)
+        finally:
+            tracemalloc.stop()
+        
+        consumers = [obj for obj in gc.get_objects() if isinstance(obj, NotificationConsumer)]
+        self.assertEqual(len(consumers), len(communicators))
+        self.assertEqual(len({id(consumer.state) for consumer in consumers}), 1)
+        for consumer in consumers:
+            self.assertIsInstance(consumer.user, ConnectionUser)
+            self.assertIsNone(consumer.outbound.items)
+        self.assertLess(per_connection, self.MAX_BYTES_PER_CONNECTION, f'空闲连接平均占用 {per_connection:.0f} 字节')
+        await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+
+class SQLiteProfileTests(SimpleTestCase):
+    """测试 sqlite-performance 配置档的连接钩子"""
+    
+    def test_connection_hook_applies_pragmas_and_read_only_alias(self):
+        """新连接上执行配置的 PRAGMA，只读别名可以读取但拒绝写入"""
+        from django.db.utils import ConnectionHandler
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(tmpdir.name, 'profile.sqlite3')}
+        # 与全局配置不同名的别名，SimpleTestCase 允许其建立连接
+        handler = ConnectionHandler({'default': {}, 'primary': database, 'history': dict(database)})
+        pragmas = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'mmap_size': 1048576, 'busy_timeout': 5000}
+        
+        with override_settings(NOTIFY_SQLITE_PRAGMAS=pragmas, NOTIFY_READ_ONLY_DATABASES=('history',)):
+            try:
+                with handler['primary'].cursor() as cursor:
+                    self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+                    self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+                    self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+                    cursor.execute('CREATE TABLE t (x INTEGER)')
+                    cursor.execute('INSERT INTO t VALUES (1)')
+                with handler['history'].cursor() as cursor:
+                    self.assertEqual(cursor.execute('SELECT x FROM t').fetchall(), [(1,)])
+                    with self.assertRaises(OperationalError):
+                        cursor.execute('INSERT INTO t VALUES (2)')
+            finally:
+                handler.close_all()
+
 # 同步测试装饰器
 from django.test import override_settings
 
@@ -8,4 +8,6 @@ urlpatterns = [
     path('create_groups/', views.create_groups, name='create_groups'),
     path('create_users/', views.create_users, name='create_users'),
     path('api/notifications/', views.get_notifications, name='get_notifications'),
+    path('api/notifications/counts/', views.get_notification_counts, name='notification_counts'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,9 +1,24 @@
+import functools
+import hashlib
+
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User, Group
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.contrib.auth.decorators import login_required
-from .models import Notification
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition
+from .models import Notification, ArchivedNotification
+from .archive import archive_watermark, needs_archive
+from .counters import GROUP, USER, counter_cache
+from .paging import per_group_pages
+from .serializers import NOTIFICATION_FIELDS, serialize_notification, encode_cursor, decode_cursor
+from .router import group_router
+from .metrics import metrics
 
 
 def index(request):
@@ -15,9 +30,17 @@ def index(request):
     user_groups = request.user.groups.all()
     group_names = [group.name for group in user_groups]
     
+    # 根据路由表确定用户可以发送通知的目标组
+    route_targets = []
+    for group_name in group_names:
+        for target in group_router.targets(group_name):
+            if target not in route_targets:
+                route_targets.append(target)
+    
     context = {
         'user': request.user,
         'groups': group_names,
+        'route_targets': route_targets,
     }
     
     return render(request, 'notifications/index.html', context)
@@ -100,53 +123,229 @@ def create_users(request):
     })
 
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+HISTORY_DIRECTIONS = ('sent', 'received')
+
+
+def keyset_queryset(queryset, cursor):
+    """按 (created_at, id) 倒序排列，并从游标位置之后开始"""
+    if cursor:
+        created_at, notification_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=notification_id)
+        )
+    return queryset.order_by('-created_at', '-id')
+
+
+def updated_keyset_queryset(queryset, cursor):
+    """增量同步：按 (updated_at, id) 正序排列，并从游标位置之后开始"""
+    if cursor:
+        updated_at, notification_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=notification_id)
+        )
+    return queryset.order_by('updated_at', 'id')
+
+
+def history_page_queryset(queryset, cursor, limit, delta=False):
+    """键集分页查询，多取一行用于判断是否还有下一页；delta=True 时按更新时间正序并带出 updated_at"""
+    if delta:
+        return updated_keyset_queryset(queryset, cursor).values(*NOTIFICATION_FIELDS, 'updated_at')[:limit + 1]
+    return keyset_queryset(queryset, cursor).values(*NOTIFICATION_FIELDS)[:limit + 1]
+
+
+def sent_page_queryset(user, filters, cursor, limit, using=None, model=Notification, delta=False):
+    """用户发送的通知，走 (sender, created_at) 索引；增量同步走 (sender, updated_at) 索引"""
+    return history_page_queryset(model.objects.using(using).filter(filters, sender=user), cursor, limit, delta)
+
+
+def received_page_queryset(group_ids, filters, cursor, limit, using=None, model=Notification, delta=False):
+    """发送给指定组的通知
+    
+    单个组直接按 (receiver_group, created_at) 索引有序读取；多个组时每个组先用索引各取一页ID，
+    再对最多 组数×(limit+1) 行合并排序，而不是对 IN 条件命中的全部历史排序。
+    增量同步时同样按组分页，走 (receiver_group, updated_at) 索引。
+    """
+    notifications = model.objects.using(using)
+    if not group_ids:
+        return notifications.none().values(*NOTIFICATION_FIELDS)
+    keyset = updated_keyset_queryset if delta else keyset_queryset
+    pages = per_group_pages(
+        notifications.filter(filters), 'receiver_group_id', group_ids, lambda page: keyset(page, cursor), limit + 1
+    )
+    # 游标条件已在各组的一页中应用
+    return history_page_queryset(pages, None, limit, delta)
+
+
+def paginate_notifications(page_queryset, limit):
+    """执行分页查询，返回 (序列化后的列表, 下一页游标)"""
+    rows = list(page_queryset)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [serialize_notification(row) for row in rows[:limit]], next_cursor
+
+
+def delta_page(page_queryset, limit):
+    """增量同步的一页：只查询通知表（归档的通知早已不再变化），返回 (序列化后的列表, 下一页游标)"""
+    rows = list(page_queryset(Notification))
+    next_cursor = encode_cursor(rows[limit - 1], 'updated_at') if len(rows) > limit else None
+    return [serialize_notification(row) for row in rows[:limit]], next_cursor
+
+
+def history_etag(request):
+    """历史接口的 ETag：由请求参数与用户相关通知每组的 (最新 updated_at, 行数) 计算
+    
+    聚合只读取 (receiver_group, updated_at) 与 (sender, updated_at) 索引，不读取通知行；
+    发送、确认或删除通知都会改变其中一项。
+    """
+    user = request.user
+    using = settings.NOTIFY_HISTORY_DATABASE
+    direction = request.GET.get('direction')
+    notifications = Notification.objects.using(using)
+    parts = [str(user.id), request.GET.urlencode()]
+    if direction in (None, '', 'sent'):
+        sent = notifications.filter(sender=user).aggregate(latest=Max('updated_at'), rows=Count('id'))
+        parts.append(f"sent:{sent['latest']}:{sent['rows']}")
+    if direction in (None, '', 'received'):
+        group_ids = sorted(user.groups.using(using).values_list('id', flat=True))
+        received = (
+            notifications.filter(receiver_group_id__in=group_ids)
+            .values('receiver_group_id')
+            .annotate(latest=Max('updated_at'), rows=Count('id'))
+            .order_by('receiver_group_id')
+        )
+        parts.append(f'groups:{group_ids}')
+        parts += [f"{row['receiver_group_id']}:{row['latest']}:{row['rows']}" for row in received]
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def history_page(page_queryset, limit, watermark, since):
+    """先查询通知表；本页范围可能包含归档数据时再查询归档表，合并两边的结果"""
+    rows = list(page_queryset(Notification))
+    if needs_archive(rows, limit, watermark, since):
+        rows += page_queryset(ArchivedNotification)
+        rows.sort(key=lambda row: (row['created_at'], row['id']), reverse=True)
+        rows = rows[:limit + 1]
+    return paginate_notifications(rows, limit)
+
+
 @login_required
+@condition(etag_func=history_etag)
 def get_notifications(request):
-    """获取用户相关的通知"""
+    """获取用户相关的通知，支持键集分页及 since/status/direction 过滤
+    
+    查询参数:
+    - limit: 每页条数，默认50，最大200
+    - direction: sent 或 received，缺省时两者都返回
+    - status: pending 或 confirmed
+    - since: ISO 8601 时间，只返回此时间及之后创建的通知
+    - updated_since: ISO 8601 时间，增量同步：只返回此时间及之后有变化（新建或确认）的通知，按更新时间正序
+    - sent_cursor / received_cursor: 上一页响应中的 next_sent_cursor / next_received_cursor
+    
+    响应带有 ETag，请求携带相同的 If-None-Match 且数据没有变化时返回 304。
+    查询走 settings.NOTIFY_HISTORY_DATABASE 连接（sqlite-performance 配置档下为只读别名 history）。
+    已归档的通知同样会返回，只在请求的范围需要时才查询归档表。
+    """
     user = request.user
+    using = settings.NOTIFY_HISTORY_DATABASE
     
     try:
-        # 获取用户所属的组
-        user_groups = user.groups.all()
-        
-        # 获取用户发送的通知，按创建时间倒序排列
-        sent_notifications = Notification.objects.filter(sender=user).order_by('-created_at')
+        limit = int(request.GET.get('limit', HISTORY_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'limit必须为正整数'}, status=400)
+    limit = min(limit, HISTORY_MAX_PAGE_SIZE)
+    
+    direction = request.GET.get('direction')
+    if direction and direction not in HISTORY_DIRECTIONS:
+        return JsonResponse({'status': 'error', 'message': f'无效的direction: {direction}'}, status=400)
+    
+    status = request.GET.get('status')
+    if status and status not in dict(Notification.STATUS_CHOICES):
+        return JsonResponse({'status': 'error', 'message': f'无效的status: {status}'}, status=400)
+    
+    since = request.GET.get('since') or None
+    if since:
+        since = parse_datetime(since)
+        if since is None:
+            return JsonResponse({'status': 'error', 'message': 'since必须为ISO 8601时间'}, status=400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+    
+    updated_since = request.GET.get('updated_since') or None
+    if updated_since:
+        updated_since = parse_datetime(updated_since)
+        if updated_since is None:
+            return JsonResponse({'status': 'error', 'message': 'updated_since必须为ISO 8601时间'}, status=400)
+        if timezone.is_naive(updated_since):
+            updated_since = timezone.make_aware(updated_since)
+    
+    try:
+        filters = Q()
+        if status:
+            filters &= Q(status=status)
+        if since:
+            filters &= Q(created_at__gte=since)
+        if updated_since:
+            filters &= Q(updated_at__gte=updated_since)
         
-        # 获取发送给用户所在组的通知，按创建时间倒序排列
-        received_notifications = Notification.objects.filter(receiver_group__in=user_groups).order_by('-created_at')
+        response = {'status': 'success'}
+        delta = updated_since is not None
+        if delta:
+            page = functools.partial(delta_page, limit=limit)
+        else:
+            page = functools.partial(history_page, limit=limit, watermark=archive_watermark(using), since=since)
         
-        # 序列化通知数据
-        sent_data = [{
-            'id': notif.id,
-            'content': notif.content,
-            'sender': notif.sender.username if notif.sender else None,
-            'sender_group': notif.sender_group.name if notif.sender_group else None,
-            'receiver_group': notif.receiver_group.name if notif.receiver_group else None,
-            'status': notif.status,
-            'created_at': notif.created_at.isoformat(),
-            'confirmed_by': notif.confirmed_by.username if notif.confirmed_by else None,
-            'confirmed_at': notif.confirmed_at.isoformat() if notif.confirmed_at else None
-        } for notif in sent_notifications]
+        if direction in (None, 'sent'):
+            # 获取用户发送的通知，按创建时间倒序排列（增量同步时按更新时间正序）
+            sent_cursor = request.GET.get('sent_cursor')
+            response['sent_notifications'], response['next_sent_cursor'] = page(
+                lambda model: sent_page_queryset(user, filters, sent_cursor, limit, using, model, delta)
+            )
         
-        received_data = [{
-            'id': notif.id,
-            'content': notif.content,
-            'sender': notif.sender.username if notif.sender else None,
-            'sender_group': notif.sender_group.name if notif.sender_group else None,
-            'receiver_group': notif.receiver_group.name if notif.receiver_group else None,
-            'status': notif.status,
-            'created_at': notif.created_at.isoformat(),
-            'confirmed_by': notif.confirmed_by.username if notif.confirmed_by else None,
-            'confirmed_at': notif.confirmed_at.isoformat() if notif.confirmed_at else None
-        } for notif in received_notifications]
+        if direction in (None, 'received'):
+            # 获取发送给用户所在组的通知
+            group_ids = list(user.groups.using(using).values_list('id', flat=True))
+            received_cursor = request.GET.get('received_cursor')
+            response['received_notifications'], response['next_received_cursor'] = page(
+                lambda model: received_page_queryset(group_ids, filters, received_cursor, limit, using, model, delta)
+            )
         
+        response = JsonResponse(response)
+        # 浏览器每次使用缓存前都携带 If-None-Match 重新验证，数据未变化时只收到 304
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    except ValueError as e:
         return JsonResponse({
-            'status': 'success',
-            'sent_notifications': sent_data,
-            'received_notifications': received_data
-        })
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
     except Exception as e:
         return JsonResponse({
             'status': 'error',
             'message': str(e)
         }, status=500)
+
+
+@login_required
+def get_notification_counts(request):
+    """返回用户各组收到的待确认通知数与用户发送的待确认通知数
+    
+    计数取自增量维护的计数表（经进程内缓存），不对通知表做聚合查询。
+    """
+    user = request.user
+    groups = list(user.groups.values_list('id', 'name'))
+    values = counter_cache.load([(GROUP, group_id) for group_id, _ in groups] + [(USER, user.id)])
+    return JsonResponse({
+        'status': 'success',
+        'groups': {name: values[GROUP, group_id] for group_id, name in groups},
+        'sent_pending': values[USER, user.id],
+    })
+
+
+def metrics_view(request):
+    """以 Prometheus 文本格式导出本进程的指标，未开启指标时返回404"""
+    if not metrics.enabled:
+        raise Http404('指标未开启')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,444 @@
+"""通知写入的写后（write-behind）缓冲
+
+默认每条 send_notification 各自 INSERT 并提交一次事务，SQLite 下每条消息至少一次 fsync，
+早高峰时数据库写锁成为瓶颈。开启 settings.NOTIFY_WRITE_BEHIND['ENABLED'] 后：
+
+- 通知ID从预留的ID块中分配（hi/lo）：一次数据库调用预留 ID_BLOCK_SIZE 个ID，之后的发送在进程内存中取号
+- 通知先追加到本地日志文件并 fsync（同一时刻的多个发送合并为一次 fsync），随即广播给接收组
+- 后台 asyncio 任务每 FLUSH_INTERVAL_MS 毫秒或缓冲满 FLUSH_ROWS 行时，用一条批量 INSERT 写入数据库
+- 日志按段轮转，段内的通知全部写入数据库后删除该段；进程崩溃后，下次启动时把残留日志段重放写入数据库
+
+写后模式下，数据库中的通知最多落后广播 FLUSH_INTERVAL_MS 毫秒：历史接口可能暂时查不到刚发送的通知，
+确认与断线补发前会先写入缓冲中的通知。
+
+写后模式只支持一个工作进程：断线补发按 id > last_seen_id 查询，多个进程各自预留ID块时通知ID不再按发送顺序递增，
+补发会漏掉其他进程稍后发出的、ID较小的通知。启动时除日志目录外还会锁定按数据库确定的写入锁文件
+（SQLite 为数据库文件旁的 .write-behind.lock，其他数据库为本机临时目录中按连接参数命名的文件），
+同一数据库的第二个进程启用写后模式时启动失败；PostgreSQL 多机部署时无法用文件锁检查，需自行保证只有一个进程开启。
+
+批量写入违反约束（例如发送者或接收组在写入前已被删除）时，改为逐条写入，被拒绝的通知追加到
+日志目录中的 dead-letter.jsonl 并记录错误日志，其余通知照常写入；这些通知已经广播，但不会出现在数据库中。
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .counters import apply_deltas, pending_deltas, publish_counters
+from .db import database_sync_to_pool
+from .jsoncodec import dumps, loads
+from .metrics import metrics
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+# 日志中保存的通知字段；写入数据库时原样使用（包括发送时的 created_at）
+JOURNAL_FIELDS = ('id', 'content', 'sender_id', 'sender_group_id', 'receiver_group_id', 'created_at')
+
+# reserve_ids 支持的数据库
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+
+def writer_lock_path():
+    """同一数据库的写后写入锁文件路径；内存数据库不跨进程共享，返回 None"""
+    config = connection.settings_dict
+    name = str(config['NAME'])
+    if connection.vendor == 'sqlite':
+        if connection.is_in_memory_db():
+            return None
+        return Path(f'{name}.write-behind.lock')
+    identity = f"{connection.vendor}:{config.get('HOST')}:{config.get('PORT')}:{name}"
+    digest = hashlib.blake2b(identity.encode(), digest_size=8).hexdigest()
+    return Path(tempfile.gettempdir()) / f'notify-write-behind-{digest}.lock'
+
+
+def reserve_ids(count):
+    """在一个事务中预留 count 个通知ID，之后的自增插入不会再使用这些ID"""
+    table = Notification._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT 表的下一个ID取自 sqlite_sequence，直接把序列推进 count
+            cursor.execute(
+                f'INSERT INTO sqlite_sequence (name, seq) SELECT %s, COALESCE(MAX(id), 0) FROM {table} '
+                'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                [table, table],
+            )
+            cursor.execute('UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s RETURNING seq', [count, table])
+            last = cursor.fetchone()[0]
+            return list(range(last - count + 1, last + 1))
+        # 其余只能是 postgresql：WriteBehind 启用时已按 SUPPORTED_VENDORS 检查过数据库
+        cursor.execute(
+            'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+            [table, 'id', count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def insert_notifications(notifications):
+    """批量写入通知并更新待确认计数，已存在的ID跳过（日志重放可能与已完成的写入重叠）
+
+    以 raw 方式插入，created_at 使用发送时记录的值；updated_at 为写入时间：增量同步（updated_since）按 updated_at
+    翻页，若沿用发送时间，在广播之后、写入之前查询过的客户端拿到的位置已经晚于这些行，之后再也查不到它们。
+    整批在一个事务中写入；违反约束时整批回滚，改为每条通知各自一个事务写入，只拒绝违反约束的通知。
+    返回 (待推送的计数 (组计数, 用户计数, {组ID: 组名}), 被拒绝的通知列表)。
+    """
+    rejected = []
+    try:
+        with transaction.atomic():
+            group_counts, user_counts = _insert_notifications(notifications)
+    except IntegrityError:
+        group_counts, user_counts = {}, {}
+        for notification in notifications:
+            try:
+                with transaction.atomic():
+                    groups, users = _insert_notifications([notification])
+            except IntegrityError:
+                rejected.append(notification)
+            else:
+                # 计数为更新后的总数，后写入的覆盖先写入的
+                group_counts.update(groups)
+                user_counts.update(users)
+    group_names = dict(Group.objects.filter(id__in=group_counts).values_list('id', 'name')) if group_counts else {}
+    return (group_counts, user_counts, group_names), rejected
+
+
+def _insert_notifications(notifications):
+    """在当前事务中写入通知并更新计数，返回更新后的 (组计数, 用户计数)"""
+    fields = Notification._meta.concrete_fields
+    # 同一批的ID取自连续的预留块，按主键范围查询已存在的ID，不受 SQL 参数个数限制
+    ids = [notification.id for notification in notifications]
+    existing = set(Notification.objects.filter(id__range=(min(ids), max(ids))).values_list('id', flat=True))
+    notifications = list({
+        notification.id: notification for notification in notifications if notification.id not in existing
+    }.values())
+    now = timezone.now()
+    for notification in notifications:
+        notification.updated_at = now
+    batch_size = connection.ops.bulk_batch_size(fields, notifications) or len(notifications)
+    for start in range(0, len(notifications), batch_size):
+        Notification.objects._insert(
+            notifications[start:start + batch_size], fields=fields, raw=True, on_conflict=OnConflict.IGNORE
+        )
+    return apply_deltas(*pending_deltas(
+        (notification.receiver_group_id, notification.sender_id) for notification in notifications
+    ))
+
+
+def journal_line(notification):
+    return dumps({
+        field: getattr(notification, field).isoformat() if field == 'created_at' else getattr(notification, field)
+        for field in JOURNAL_FIELDS
+    })
+
+
+def notification_from_journal(line):
+    row = loads(line)
+    created_at = parse_datetime(row.pop('created_at'))
+    return Notification(status='pending', created_at=created_at, updated_at=created_at, **row)
+
+
+class Journal:
+    """本地追加日志，按段（journal-00000001.jsonl ...）轮转；只在日志专属的单线程执行器中调用"""
+
+    def __init__(self, directory, writer_lock=None):
+        self.directory = Path(directory)
+        self.writer_lock = writer_lock
+        self._lock_file = None
+        self._writer_lock_file = None
+        self._file = None
+        self._segment = 0
+
+    def segment_path(self, segment):
+        return self.directory / f'journal-{segment:08d}.jsonl'
+
+    @staticmethod
+    def lock(path):
+        """以非阻塞方式独占锁定 path，已被其他进程锁定时返回 None"""
+        lock_file = open(path, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def open(self):
+        """锁定写入锁与日志目录，返回上次运行残留的日志段（按写入顺序）"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.writer_lock is not None:
+            self._writer_lock_file = self.lock(self.writer_lock)
+            if self._writer_lock_file is None:
+                raise RuntimeError(f'同一数据库已有其他进程开启写后模式（{self.writer_lock}），写后模式只支持一个工作进程')
+        self._lock_file = self.lock(self.directory / 'lock')
+        if self._lock_file is None:
+            self.release()
+            raise RuntimeError(f'写后日志目录 {self.directory} 已被其他进程使用')
+        leftovers = sorted(self.directory.glob('journal-*.jsonl'))
+        self._segment = max((int(path.stem.split('-')[1]) for path in leftovers), default=0) + 1
+        return leftovers
+
+    def append(self, lines):
+        if self._file is None:
+            self._file = open(self.segment_path(self._segment), 'ab')
+        self._file.write(''.join(line + '\n' for line in lines).encode())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """关闭当前段，之后的追加写入新段；返回被关闭的段"""
+        if self._file is None:
+            return []
+        self._file.close()
+        self._file = None
+        closed = self.segment_path(self._segment)
+        self._segment += 1
+        return [closed]
+
+    def dead_letter(self, lines):
+        """追加被数据库拒绝的通知，格式与日志相同，便于排查后手动重放"""
+        with open(self.directory / DEAD_LETTER_FILE, 'ab') as dead_letter_file:
+            dead_letter_file.write(''.join(line + '\n' for line in lines).encode())
+            dead_letter_file.flush()
+            os.fsync(dead_letter_file.fileno())
+
+    @staticmethod
+    def read(paths):
+        notifications = []
+        for path in paths:
+            with open(path, encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    # 崩溃时最后一行可能只写了一半，这样的行在 fsync 之前从未被广播，可以丢弃
+                    try:
+                        notifications.append(notification_from_journal(line))
+                    except ValueError:
+                        logger.warning('write_behind_journal_line_skipped', extra={'fields': {'path': str(path)}})
+        return notifications
+
+    @staticmethod
+    def discard(paths):
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    def close(self):
+        self.rotate()
+        self.release()
+
+    def release(self):
+        for lock_file in (self._lock_file, self._writer_lock_file):
+            if lock_file is not None:
+                lock_file.close()
+        self._lock_file = self._writer_lock_file = None
+
+
+class WriteBehind:
+    """进程级写后缓冲：预留ID、写日志、后台批量写入数据库
+
+    缓冲区、ID块与日志都只在事件循环线程中修改；日志文件读写在专属的单线程执行器中顺序进行，
+    数据库写入通过 database_sync_to_pool 在数据库线程中进行。
+    """
+
+    def __init__(self, enabled=False, journal_dir=None, flush_interval_ms=50, flush_rows=500, id_block_size=1000):
+        if enabled and connection.vendor not in SUPPORTED_VENDORS:
+            raise ImproperlyConfigured(f'写后模式不支持 {connection.vendor} 数据库（支持 {", ".join(SUPPORTED_VENDORS)}）')
+        self.enabled = enabled
+        self.journal = Journal(
+            journal_dir or Path(settings.BASE_DIR) / 'notify_journal', writer_lock_path() if enabled else None
+        )
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_rows = flush_rows
+        self.id_block_size = id_block_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notify-journal')
+        self._ids = deque()
+        self._rows = []
+        self._pending_ids = set()
+        self._closed_segments = []
+        self._lines = []
+        self._waiters = []
+        self._started = False
+        self._starting = None
+        self._writer = None
+        self._flusher = None
+        self._flushing = None
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'NOTIFY_WRITE_BEHIND', {})
+        return cls(
+            enabled=config.get('ENABLED', False),
+            journal_dir=config.get('JOURNAL_DIR'),
+            flush_interval_ms=config.get('FLUSH_INTERVAL_MS', 50),
+            flush_rows=config.get('FLUSH_ROWS', 500),
+            id_block_size=config.get('ID_BLOCK_SIZE', 1000),
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _current(task):
+        """只复用属于当前事件循环且尚未结束的任务"""
+        return task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop()
+
+    # 启动与日志重放
+
+    async def start(self):
+        """首次使用时锁定日志目录，并把上次运行残留的日志写入数据库"""
+        if self._started:
+            return
+        if not self._current(self._starting):
+            self._starting = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._starting)
+
+    async def _start(self):
+        leftovers = await self._run(self.journal.open)
+        if leftovers:
+            notifications = await self._run(self.journal.read, leftovers)
+            if notifications:
+                counts, rejected = await database_sync_to_pool(insert_notifications)(notifications)
+                await self._dead_letter(rejected)
+                await publish_counters(*counts)
+            await self._run(self.journal.discard, leftovers)
+            logger.info('write_behind_journal_replayed', extra={'fields': {
+                'segments': len(leftovers), 'notifications': len(notifications)
+            }})
+        self._started = True
+
+    async def close(self):
+        """写入全部缓冲并释放日志目录"""
+        await self.flush()
+        if self._started:
+            await self._run(self.journal.close)
+            self._started = False
+
+    # 发送路径
+
+    async def allocate(self, count):
+        """从预留的ID块中取 count 个ID，不足时预留新的ID块"""
+        await self.start()
+        while len(self._ids) < count:
+            self._ids.extend(await database_sync_to_pool(reserve_ids)(max(self.id_block_size, count - len(self._ids))))
+        return [self._ids.popleft() for _ in range(count)]
+
+    async def submit(self, notifications):
+        """把已分配ID的通知写入日志并 fsync 后返回，此后即可广播；数据库写入由后台任务完成"""
+        self._rows.extend(notifications)
+        self._pending_ids.update(notification.id for notification in notifications)
+        try:
+            await self._append([journal_line(notification) for notification in notifications])
+        except Exception:
+            submitted = {id(notification) for notification in notifications}
+            self._rows = [row for row in self._rows if id(row) not in submitted]
+            self._pending_ids.difference_update(notification.id for notification in notifications)
+            raise
+        if len(self._rows) >= self.flush_rows:
+            self._flush_task()
+        if not self._current(self._flusher):
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def _append(self, lines):
+        """组提交：日志写入进行期间到达的行合并为下一次写入，共用一次 fsync"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._lines.extend(lines)
+        self._waiters.append(waiter)
+        if not self._current(self._writer):
+            self._writer = asyncio.get_running_loop().create_task(self._write_journal())
+        await waiter
+
+    async def _write_journal(self):
+        while self._lines:
+            lines, waiters = self._lines, self._waiters
+            self._lines, self._waiters = [], []
+            try:
+                await self._run(self.journal.append, lines)
+            except Exception as e:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+            else:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+
+    # 写入数据库
+
+    def is_pending(self, notification_ids):
+        """这些通知中是否有尚未写入数据库的"""
+        for notification_id in notification_ids:
+            try:
+                if int(notification_id) in self._pending_ids:
+                    return True
+            except (TypeError, ValueError):
+                continue
+        return False
+
+    async def flush(self):
+        """等待缓冲区（包括正在进行的写入）全部写入数据库"""
+        while self._rows or self._current(self._flushing):
+            await asyncio.shield(self._flush_task())
+
+    def _flush_task(self):
+        if not self._current(self._flushing):
+            self._flushing = asyncio.get_running_loop().create_task(self._flush_once())
+        return self._flushing
+
+    async def _flush_once(self):
+        # 先轮转日志：轮转前写入的每一行都已在缓冲区中，本次写入成功后这些日志段即可删除
+        self._closed_segments += await self._run(self.journal.rotate)
+        rows, self._rows = self._rows, []
+        if rows:
+            start = time.perf_counter()
+            try:
+                counts, rejected = await database_sync_to_pool(insert_notifications)(rows)
+            except Exception:
+                self._rows[:0] = rows
+                raise
+            self._pending_ids.difference_update(row.id for row in rows)
+            await self._dead_letter(rejected)
+            metrics.observe('write_behind_flush', time.perf_counter() - start)
+            metrics.count_messages('flushed', len(rows))
+            try:
+                await publish_counters(*counts)
+            except Exception:
+                # 计数已随通知写入数据库，推送失败只影响实时更新
+                logger.exception('counters_publish_failed')
+        closed, self._closed_segments = self._closed_segments, []
+        await self._run(self.journal.discard, closed)
+
+    async def _dead_letter(self, rejected):
+        """被数据库拒绝的通知不再重试，写入死信文件后随日志段一起丢弃"""
+        if not rejected:
+            return
+        await self._run(self.journal.dead_letter, [journal_line(notification) for notification in rejected])
+        metrics.count_messages('rejected', len(rejected))
+        logger.error('write_behind_rows_rejected', extra={'fields': {
+            'rows': len(rejected), 'ids': ','.join(str(notification.id) for notification in rejected),
+            'dead_letter': str(self.journal.directory / DEAD_LETTER_FILE),
+        }})
+
+    async def _flush_periodically(self):
+        """缓冲区非空期间每 flush_interval 秒写入一次，缓冲区清空后退出"""
+        while self._rows or self._current(self._flushing):
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.shield(self._flush_task())
+            except Exception:
+                logger.exception('write_behind_flush_failed', extra={'fields': {'rows': len(self._rows)}})
+
+
+write_behind = WriteBehind.from_settings()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -72,26 +73,99 @@ TEMPLATES = [
 WSGI_APPLICATION = 'channel_notify.wsgi.application'
 ASGI_APPLICATION = 'channel_notify.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
+# 通道层后端通过环境变量 CHANNEL_LAYER_BACKEND 选择：
+# - memory：进程内通道层，仅适用于单进程（默认）
+# - sqlite：共享 SQLite 文件的跨进程通道层，适用于单机多个 daphne 工作进程
+# - redis：channels_redis，适用于多机部署（需安装 channels_redis）
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'memory')
+
+# 每个频道（连接的收件箱）最多积压的消息数；积压满时组广播对该连接静默丢弃，单播抛出 ChannelFull
+CHANNEL_LAYER_CAPACITY = int(os.environ.get('CHANNEL_LAYER_CAPACITY', '100'))
+
+CHANNEL_LAYER_BACKENDS = {
+    'memory': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
         'CONFIG': {
             "expiry": 300,
+            "capacity": CHANNEL_LAYER_CAPACITY,
+        },
+    },
+    'sqlite': {
+        'BACKEND': 'channel_notify.notifications.layers.SQLiteChannelLayer',
+        'CONFIG': {
+            "path": os.environ.get('CHANNEL_LAYER_PATH', str(BASE_DIR / 'channel_layer.sqlite3')),
+            "expiry": 300,
+            "capacity": CHANNEL_LAYER_CAPACITY,
+        },
+    },
+    'redis': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            "hosts": [os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')],
+            "expiry": 300,
+            "capacity": CHANNEL_LAYER_CAPACITY,
         },
     },
 }
 
+CHANNEL_LAYERS = {
+    'default': CHANNEL_LAYER_BACKENDS[CHANNEL_LAYER_BACKEND],
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# 数据库配置档通过环境变量 DATABASE_PROFILE 选择：
+# - default：Django 默认的 SQLite 配置（回滚日志、每次请求新建连接）
+# - sqlite-performance：WAL、synchronous=NORMAL、mmap、busy_timeout 与持久连接，
+#   写事务以 BEGIN IMMEDIATE 开始；历史查询走只读连接别名 history，不与消费者的写入共用连接
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'default')
+
+SQLITE_PERFORMANCE_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': BASE_DIR / 'db.sqlite3',
+    'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', '600')),
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'timeout': 5,
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+
+DATABASE_PROFILES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    },
+    'sqlite-performance': {
+        'default': SQLITE_PERFORMANCE_DATABASE,
+        'history': {
+            **SQLITE_PERFORMANCE_DATABASE,
+            'OPTIONS': {'timeout': 5},
+            'TEST': {'MIRROR': 'default'},
+        },
+    },
 }
 
+DATABASES = DATABASE_PROFILES[DATABASE_PROFILE]
+
+# 每个新建的 SQLite 连接上由 connection_created 钩子执行的 PRAGMA
+NOTIFY_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,
+} if DATABASE_PROFILE == 'sqlite-performance' else {}
+
+# 只读连接别名，连接建立时开启 PRAGMA query_only
+NOTIFY_READ_ONLY_DATABASES = ('history',)
+
+# 历史查询接口（/api/notifications/）使用的连接别名
+NOTIFY_HISTORY_DATABASE = 'history' if 'history' in DATABASES else 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -133,3 +207,89 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# 日志：通知应用使用结构化的 key=value 输出，级别由环境变量 NOTIFY_LOG_LEVEL 控制（默认 INFO）
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'channel_notify.notifications.log.KeyValueFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'channel_notify': {
+            'handlers': ['console'],
+            'level': os.environ.get('NOTIFY_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# 性能指标：开启后在 /metrics/ 以 Prometheus 文本格式导出（按进程统计）
+NOTIFY_METRICS_ENABLED = os.environ.get('NOTIFY_METRICS_ENABLED', '') == '1'
+
+# 消费者数据库调用的专用线程池大小。0 表示沿用 channels 默认的 thread_sensitive 单线程执行（测试需要）；
+# 生产环境建议按数据库可承受的并发连接数设置，例如 NOTIFY_DB_THREADS=8
+NOTIFY_DB_THREADS = int(os.environ.get('NOTIFY_DB_THREADS', '0'))
+
+# 写后模式：通知先写本地日志并立即广播，由后台任务按间隔/行数批量写入数据库（默认关闭）。
+# 只支持一个工作进程（断线补发依赖通知ID按发送顺序递增），同一数据库的第二个进程开启时启动失败
+NOTIFY_WRITE_BEHIND = {
+    'ENABLED': os.environ.get('NOTIFY_WRITE_BEHIND', '') == '1',
+    'JOURNAL_DIR': os.environ.get('NOTIFY_WRITE_BEHIND_JOURNAL', str(BASE_DIR / 'notify_journal')),
+    'FLUSH_INTERVAL_MS': int(os.environ.get('NOTIFY_WRITE_BEHIND_INTERVAL_MS', '50')),
+    'FLUSH_ROWS': int(os.environ.get('NOTIFY_WRITE_BEHIND_ROWS', '500')),
+    'ID_BLOCK_SIZE': 1000,
+}
+
+# 归档：创建时间超过 AFTER_DAYS 天的已确认通知移入归档表，每个事务移动 BATCH_SIZE 行。
+# INTERVAL_SECONDS > 0 时消费者进程内的 asyncio 任务定期归档（多进程部署时建议只在一个进程开启，或改用定时执行 archive_notifications）
+NOTIFY_ARCHIVE = {
+    'AFTER_DAYS': int(os.environ.get('NOTIFY_ARCHIVE_AFTER_DAYS', '90')),
+    'BATCH_SIZE': 1000,
+    'INTERVAL_SECONDS': int(os.environ.get('NOTIFY_ARCHIVE_INTERVAL', '0')),
+}
+
+# 待确认计数的进程内缓存有效期（秒）：本进程的更新在事务提交后立即写入缓存，其他工作进程的更新最多延迟这么久可见
+NOTIFY_COUNTER_CACHE_TTL = float(os.environ.get('NOTIFY_COUNTER_CACHE_TTL', '2'))
+
+# 发送限流（令牌桶）：RATE 为每秒补充的条数，BURST 为最多可连续发送的条数；批量发送按条数计
+# USER 按用户、GROUP 按发送组（组内全部用户合计）限流，GROUPS 可按发送组覆盖，例如
+# 'GROUPS': {'operations_group_1': {'USER': {'RATE': 5, 'BURST': 50}}}；RATE 为 0 时不限制
+NOTIFY_RATE_LIMITS = {
+    'USER': {'RATE': float(os.environ.get('NOTIFY_RATE_LIMIT_USER', '20')), 'BURST': 500},
+    'GROUP': {'RATE': float(os.environ.get('NOTIFY_RATE_LIMIT_GROUP', '200')), 'BURST': 2000},
+    'GROUPS': {},
+}
+
+# WebSocket 握手认证缓存：会话键 -> (用户, 所属组)，最多 MAX_ENTRIES 项，TTL 秒后重新读取会话与数据库。
+# 本进程内的登出、用户与组变更立即失效；其他工作进程最多延迟 TTL 秒
+NOTIFY_HANDSHAKE_AUTH_CACHE = {
+    'MAX_ENTRIES': int(os.environ.get('NOTIFY_HANDSHAKE_CACHE_SIZE', '10000')),
+    'TTL': float(os.environ.get('NOTIFY_HANDSHAKE_CACHE_TTL', '60')),
+}
+
+# 每个连接的发送队列：最多积压 MAX_FRAMES 帧，满时按 POLICY 处理
+# coalesce（合并通知/确认/计数帧）、drop_oldest（丢弃最旧的帧并发送 gap 标记）或 disconnect（以 4008 断开）
+NOTIFY_OUTBOUND_QUEUE = {
+    'MAX_FRAMES': int(os.environ.get('NOTIFY_OUTBOUND_QUEUE', '256')),
+    'POLICY': os.environ.get('NOTIFY_OUTBOUND_POLICY', 'drop_oldest'),
+}
+
+# 服务端心跳：每 INTERVAL 秒向每个连接发送一次 ping，连续 MISSES 次未收到客户端的任何帧时以 4009 关闭并退出频道层的组
+# INTERVAL 为 0 时关闭心跳
+NOTIFY_HEARTBEAT = {
+    'INTERVAL': float(os.environ.get('NOTIFY_HEARTBEAT_INTERVAL', '30')),
+    'MISSES': int(os.environ.get('NOTIFY_HEARTBEAT_MISSES', '2')),
+}
+
+# 进程内扇出：组广播在频道层中每个进程只投递一次，由进程内的登记表分发给本地连接（见 notifications/fanout.py）
+NOTIFY_LOCAL_FANOUT = os.environ.get('NOTIFY_LOCAL_FANOUT', '') == '1'